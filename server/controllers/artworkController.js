@@ -6,7 +6,7 @@
 import mongoose from 'mongoose'
 import Artwork from '../models/Artwork.js'
 import User from '../models/User.js'
-import { generateEmbeddingHook } from '../middleware/recommendationMiddleware.js'
+import { generateEmbeddingHook, trackInteractionHook } from '../middleware/recommendationMiddleware.js'
 
 const normalizeTagsInput = (tags) => {
     if (!tags) return []
@@ -218,6 +218,7 @@ export const likeArtwork = async (req, res) => {
                 { $addToSet: { likedArtworks: req.params.id } }
             )
         }
+        trackInteractionHook(req.user.id, req.params.id, 'like', { removed: isLiked })
 
         res.json({ message: isLiked ? 'Unliked' : 'Liked', isLiked: !isLiked })
     } catch (error) {
@@ -269,6 +270,7 @@ export const saveArtwork = async (req, res) => {
                 { $addToSet: { savedArtworks: req.params.id } }
             )
         }
+        trackInteractionHook(req.user.id, req.params.id, 'save', { removed: isSaved })
 
         res.json({ message: isSaved ? 'Unsaved' : 'Saved', isSaved: !isSaved })
     } catch (error) {
@@ -320,6 +322,7 @@ export const trackArtworkView = async (req, res) => {
                 }
             }
         })
+        trackInteractionHook(userId, id, 'view', { durationSeconds })
         res.status(200).json({ ok: true })
     } catch (error) {
         console.error('Track view error:', error)
@@ -347,6 +350,7 @@ export const purchaseArtwork = async (req, res) => {
             userId,
             { $addToSet: { purchasedArtworks: artworkId } }
         )
+        trackInteractionHook(userId, artworkId, 'purchase')
 
         res.json({ success: true, message: 'Purchase successful' })
     } catch (error) {
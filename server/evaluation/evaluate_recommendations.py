@@ -31,6 +31,11 @@ warnings.filterwarnings("ignore", category=UserWarning, module="matplotlib")
 # Load environment variables
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
+# Share the service's embedding decoder so stored formats cannot drift apart
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'recommendation-service'))
+from embedding_storage import decode_embedding
+
 class RecommendationEvaluator:
     """
     Comprehensive evaluation system for ArtScape recommendation engine
@@ -91,6 +96,22 @@ class RecommendationEvaluator:
             self.logger.error(f"Health check failed: {e}")
             return {"status": "unreachable"}
     
+    @staticmethod
+    def _embedding_vector(value) -> np.ndarray:
+        """
+        Decode a stored embedding (BSON array or packed float32/float16 Binary)
+        
+        Args:
+            value: clip_embedding field value
+            
+        Returns:
+            float32 numpy array
+        """
+        vector = decode_embedding(value)
+        if vector is None:
+            raise ValueError("Unrecognised clip_embedding format")
+        return vector
+    
     def calculate_cosine_similarity_metrics(self, sample_size: int = 1000) -> Dict:
         """
         Analyze cosine similarity distribution across recommendations
@@ -119,8 +140,8 @@ class RecommendationEvaluator:
         # Sample pairs for similarity calculation
         for i in range(min(100, len(artworks_with_embeddings))):
             for j in range(i + 1, min(i + 10, len(artworks_with_embeddings))):
-                emb1 = artworks_with_embeddings[i]["clip_embedding"]
-                emb2 = artworks_with_embeddings[j]["clip_embedding"]
+                emb1 = self._embedding_vector(artworks_with_embeddings[i]["clip_embedding"])
+                emb2 = self._embedding_vector(artworks_with_embeddings[j]["clip_embedding"])
                 
                 # Calculate cosine similarity
                 similarity = np.dot(emb1, emb2)
@@ -3,38 +3,121 @@
  * Handles asynchronous embedding generation and recommendation operations
  */
 
+import mongoose from 'mongoose'
+
 const RECOMMENDATION_SERVICE_URL = process.env.RECOMMENDATION_SERVICE_URL || 'https://joyful-cooperation-production-cdb6.up.railway.app'
 
 /**
- * Generate embedding asynchronously (doesn't block response)
- * Calls the recommendation service in the background using setImmediate
+ * Queue embedding generation for an artwork (doesn't block response)
+ * The job is written to the embedding_jobs collection the service drains,
+ * so it survives the service being cold, busy or down; the HTTP call only
+ * wakes the drain worker. Same document shape as embedding_queue.py
  */
 export const generateEmbeddingHook = (artworkId, imageUrl) => {
     // Fire and forget - don't await, don't block response
     setImmediate(async () => {
+        let queued = false
+        try {
+            const now = new Date()
+            await mongoose.connection.collection('embedding_jobs').updateOne(
+                { _id: new mongoose.Types.ObjectId(artworkId) },
+                {
+                    $set: {
+                        status: 'pending',
+                        image_url: imageUrl,
+                        attempts: 0,
+                        next_attempt_at: now,
+                        updated_at: now
+                    },
+                    $setOnInsert: { created_at: now },
+                    $unset: { claim_token: '', lease_until: '', owner: '', last_error: '', completed_at: '' }
+                },
+                { upsert: true }
+            )
+            queued = true
+        } catch (error) {
+            // The service enqueues the job itself when it receives the request below
+            console.error(`[Embedding] Could not queue job for ${artworkId}:`, error.message)
+        }
+
         try {
             const response = await fetch(`${RECOMMENDATION_SERVICE_URL}/generate-embedding`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
+                // queued: only wake the worker; a second write could revoke a claim made since
                 body: JSON.stringify({
                     artwork_id: artworkId,
-                    image_url: imageUrl
+                    image_url: imageUrl,
+                    queued
                 })
             })
             
             if (!response.ok) {
                 const error = await response.json()
-                console.error(`[Embedding] Failed for artwork ${artworkId}:`, error)
+                console.error(`[Embedding] Failed to queue artwork ${artworkId}:`, error)
             } else {
-                const data = await response.json()
-                console.log(`[Embedding] ✓ Generated for artwork ${artworkId}`)
+                console.log(`[Embedding] ✓ Queued artwork ${artworkId}`)
             }
         } catch (error) {
-            console.error(`[Embedding] Error generating embedding for ${artworkId}:`, error.message)
+            // Job is already stored; the service picks it up when it is back
+            console.error(`[Embedding] Service unreachable for ${artworkId}:`, error.message)
         }
     })
 }
 
+/**
+ * Report a user interaction so the service can update the user's profile vector
+ * Fire and forget like generateEmbeddingHook; removed=true marks an unlike/unsave,
+ * durationSeconds weights a view
+ */
+export const trackInteractionHook = (userId, artworkId, interaction, { removed = false, durationSeconds = 0 } = {}) => {
+    setImmediate(async () => {
+        try {
+            const response = await fetch(`${RECOMMENDATION_SERVICE_URL}/profiles/interaction`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    user_id: String(userId),
+                    artwork_id: String(artworkId),
+                    interaction,
+                    removed,
+                    duration_seconds: durationSeconds
+                })
+            })
+
+            if (!response.ok) {
+                const error = await response.json()
+                console.error(`[Profile] Failed to track ${interaction} for user ${userId}:`, error)
+            }
+        } catch (error) {
+            console.error(`[Profile] Error tracking ${interaction} for user ${userId}:`, error.message)
+        }
+    })
+}
+
+/**
+ * Rebuild a user's profile vector from their stored history
+ * Call after editing a user's interaction history outside the tracked endpoints
+ */
+export const rebuildUserProfile = async (userId) => {
+    try {
+        const response = await fetch(`${RECOMMENDATION_SERVICE_URL}/profiles/${userId}/rebuild`, {
+            method: 'POST'
+        })
+
+        if (!response.ok) {
+            const error = await response.json()
+            console.error(`[Profile] Rebuild failed for user ${userId}:`, error)
+            return null
+        }
+
+        return await response.json()
+    } catch (error) {
+        console.error(`[Profile] Error rebuilding profile for user ${userId}:`, error.message)
+        return null
+    }
+}
+
 /**
  * Batch regenerate embeddings for all artworks
  * Useful for one-time migration or updates
@@ -97,6 +180,34 @@ export const getRecommendations = async (artworkId, topK = 20) => {
     }
 }
 
+/**
+ * Get recommendations for many artworks in one request
+ * The service answers all of them with a single batched search
+ */
+export const getRecommendationsBatch = async (artworkIds, topK = 20) => {
+    try {
+        const response = await fetch(`${RECOMMENDATION_SERVICE_URL}/recommend/similar/batch`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                artwork_ids: artworkIds,
+                top_k: topK
+            })
+        })
+
+        if (!response.ok) {
+            const error = await response.json()
+            console.error(`[Recommendations] Batch error for ${artworkIds.length} artworks:`, error)
+            return null
+        }
+
+        return await response.json()
+    } catch (error) {
+        console.error(`[Recommendations] Batch error:`, error.message)
+        return null
+    }
+}
+
 /**
  * Search artworks by text
  */
@@ -124,6 +235,33 @@ export const searchByText = async (query, topK = 20) => {
     }
 }
 
+/**
+ * Search artworks by many text queries in one request
+ */
+export const searchByTextBatch = async (queries, topK = 20) => {
+    try {
+        const response = await fetch(`${RECOMMENDATION_SERVICE_URL}/recommend/text/batch`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                queries: queries,
+                top_k: topK
+            })
+        })
+
+        if (!response.ok) {
+            const error = await response.json()
+            console.error(`[Search] Batch error for ${queries.length} queries:`, error)
+            return null
+        }
+
+        return await response.json()
+    } catch (error) {
+        console.error(`[Search] Batch error:`, error.message)
+        return null
+    }
+}
+
 /**
  * Get personalized recommendations for a user
  */
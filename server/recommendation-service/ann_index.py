@@ -0,0 +1,153 @@
+"""
+Approximate nearest-neighbor engines for the embedding index
+
+Engines only propose candidate artwork ids; EmbeddingIndex re-scores the
+candidates exactly against its current matrix. An engine is therefore a
+read-only snapshot that can lag behind inserts and deletes until it is
+rebuilt.
+
+- IVFIndex: pure NumPy inverted file (spherical k-means coarse quantizer)
+- HNSWIndex: hnswlib graph, only available if hnswlib is installed
+"""
+
+import logging
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+logger = logging.getLogger(__name__)
+
+ANN_ENGINES = ('ivf', 'hnsw')
+
+
+class IVFIndex:
+    """
+    Inverted file index over unit-length embeddings
+
+    Args:
+        ids: Artwork ids, one per matrix row
+        matrix: float32 (N x dim) embeddings
+        nlist: Number of clusters (default 4 * sqrt(N))
+        nprobe: Clusters scanned per query; higher = better recall
+        iterations: k-means iterations
+        seed: Random seed for centroid initialization
+    """
+
+    name = 'ivf'
+
+    def __init__(self, ids, matrix, nlist=None, nprobe=8, iterations=10, seed=0):
+        n = len(ids)
+        self.nlist = max(1, min(nlist or int(4 * np.sqrt(n)), n))
+        self.nprobe = nprobe
+        self.size = n
+
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, self.nlist * 64)
+        sample = matrix[rng.choice(n, sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, self.nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(assignment, kind='stable')
+            clusters, starts = np.unique(assignment[order], return_index=True)
+            sums = np.zeros_like(centroids)
+            sums[clusters] = np.add.reduceat(sample[order], starts)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            centroids[~empty] = sums[~empty] / norms[~empty]
+
+        # Assign every row in chunks to bound the temporary score matrix
+        assignment = np.empty(n, dtype=np.int64)
+        for start in range(0, n, 65536):
+            block = matrix[start:start + 65536]
+            assignment[start:start + 65536] = np.argmax(block @ centroids.T, axis=1)
+
+        order = np.argsort(assignment, kind='stable')
+        self.centroids = centroids
+        self.offsets = np.searchsorted(assignment[order], np.arange(self.nlist + 1))
+        self.list_ids = np.asarray(ids, dtype=object)[order]
+
+    def candidates(self, query, fetch_k, nprobe=None):
+        """
+        Ids in the clusters closest to the query
+
+        Args:
+            query: float32 query embedding
+            fetch_k: Unused; IVF returns every id in the probed clusters
+            nprobe: Override of the number of clusters to scan
+
+        Returns:
+            Array of artwork ids
+        """
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        scores = self.centroids @ query
+        probes = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        return np.concatenate([
+            self.list_ids[self.offsets[c]:self.offsets[c + 1]] for c in probes
+        ])
+
+
+class HNSWIndex:
+    """
+    Hierarchical navigable small world graph (hnswlib)
+
+    Args:
+        ids: Artwork ids, one per matrix row
+        matrix: float32 (N x dim) embeddings
+        m: Graph degree; higher = better recall, more memory
+        ef_construction: Build-time candidate list size
+        ef_search: Query-time candidate list size; higher = better recall
+    """
+
+    name = 'hnsw'
+
+    def __init__(self, ids, matrix, m=16, ef_construction=200, ef_search=64):
+        if hnswlib is None:
+            raise ImportError("hnswlib is not installed")
+        n, dim = matrix.shape
+        self.size = n
+        self.ef_search = ef_search
+        self.ids = list(ids)
+        self.graph = hnswlib.Index(space='ip', dim=dim)
+        self.graph.init_index(max_elements=max(n, 1), M=m, ef_construction=ef_construction)
+        self.graph.add_items(matrix, np.arange(n))
+
+    def candidates(self, query, fetch_k, ef_search=None):
+        """
+        Approximate fetch_k nearest ids
+
+        Args:
+            query: float32 query embedding
+            fetch_k: Number of neighbors to retrieve
+            ef_search: Override of the query-time candidate list size
+
+        Returns:
+            List of artwork ids
+        """
+        k = max(1, min(fetch_k, self.size))
+        self.graph.set_ef(max(ef_search or self.ef_search, k))
+        labels, _ = self.graph.knn_query(query, k=k)
+        return [self.ids[label] for label in labels[0]]
+
+
+def build_ann_index(engine, ids, matrix, params):
+    """
+    Build an ANN engine snapshot
+
+    Args:
+        engine: 'ivf' or 'hnsw'
+        ids: Artwork ids, one per matrix row
+        matrix: float32 (N x dim) embeddings
+        params: Dict of engine keyword arguments
+
+    Returns:
+        IVFIndex or HNSWIndex
+    """
+    if engine == 'ivf':
+        return IVFIndex(ids, matrix, **params)
+    if engine == 'hnsw':
+        return HNSWIndex(ids, matrix, **params)
+    raise ValueError(f"Unknown ANN engine: {engine}")
@@ -0,0 +1,487 @@
+"""
+ASGI entry point for the Artscape recommendation service
+
+Serves the recommendation routes, /generate-embedding and /health from an
+asyncio event loop, so one process can hold thousands of open connections
+from the Node server while handlers wait on Mongo or the model:
+
+- Mongo reads/writes on the request path use motor (async driver)
+- inference and index searches are awaited on a bounded thread pool of
+  ASYNC_INFERENCE_WORKERS threads, which caps CPU-bound work no matter how
+  many requests are open
+- blocking I/O (image downloads, the sync profile store) runs on a separate
+  pool of ASYNC_IO_WORKERS threads
+
+Model, index, caches and background services are shared with the Flask
+app in recommendation_service, which initializes them on import.
+
+Run with:
+    uvicorn asgi_service:app --host 0.0.0.0 --port 7860
+"""
+
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ReturnDocument
+from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+import recommendation_service as service
+from recommendation_service import Config
+from embedding_index import SearchFilter, artwork_metadata, METADATA_PROJECTION
+from embedding_storage import encode_embedding
+from embedding_queue import enqueue_update
+from user_profiles import merge_centroid_results
+
+logger = logging.getLogger(__name__)
+
+inference_executor = ThreadPoolExecutor(max_workers=Config.ASYNC_INFERENCE_WORKERS, thread_name_prefix='asgi-inference')
+io_executor = ThreadPoolExecutor(max_workers=Config.ASYNC_IO_WORKERS, thread_name_prefix='asgi-io')
+
+# Async database handle, opened on startup
+mongo = None
+
+
+class BadRequest(Exception):
+    """Invalid request parameters, answered with 400"""
+
+
+class ServiceJSONResponse(JSONResponse):
+    """JSON response encoded by the service's JSON provider (orjson if installed)"""
+
+    def render(self, content):
+        return service.app.json.dumps(content).encode('utf-8')
+
+
+def error(message, status_code, headers=None, **extra):
+    return ServiceJSONResponse({'success': False, 'error': message, **extra}, status_code=status_code, headers=headers)
+
+
+async def run_cpu(function, *args, **kwargs):
+    """Await a CPU-bound call on the bounded inference pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(inference_executor, lambda: function(*args, **kwargs))
+
+
+async def run_io(function, *args, **kwargs):
+    """Await a blocking I/O call on the I/O pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, lambda: function(*args, **kwargs))
+
+
+def fields_of(data, request, include_tags=False):
+    try:
+        return service.parse_fields(data.get('fields') or request.query_params.get('fields'), include_tags)
+    except ValueError as e:
+        raise BadRequest(str(e))
+
+
+def endpoint(handler, gated=True):
+    """
+    Wrap an async handler(data, request) with readiness gating, JSON body
+    parsing, error responses and the request latency metric
+    """
+    async def route(request):
+        started = time.perf_counter()
+        response = await dispatch(handler, request, gated)
+        if Config.METRICS_ENABLED:
+            service.request_latency.observe(
+                time.perf_counter() - started,
+                endpoint=request.url.path,
+                method=request.method,
+                status=response.status_code
+            )
+        return response
+    return route
+
+
+async def dispatch(handler, request, gated):
+    if gated and not service.service_ready.is_set():
+        ready = await run_io(service.service_ready.wait, Config.READY_WAIT_SECONDS)
+        if not ready:
+            return error('Service is starting, retry shortly', 503, {'Retry-After': '5'},
+                         phase=service.startup_state['phase'])
+    try:
+        data = await request.json() if request.method == 'POST' else {}
+    except ValueError:
+        return error('Invalid JSON body', 400)
+    try:
+        return await handler(data or {}, request)
+    except BadRequest as e:
+        return error(str(e), 400)
+    except Exception as e:
+        logger.error(f"Error in {handler.__name__}: {str(e)}")
+        return error(str(e), 500)
+
+
+async def health(data, request):
+    """Health check endpoint"""
+    ready = service.service_ready.is_set()
+    return ServiceJSONResponse({
+        'status': 'healthy' if ready else 'starting',
+        'ready': ready,
+        'startup': service.startup_state,
+        'server': 'asgi',
+        'device': service.device,
+        'model_loaded': service.model is not None,
+        'db_connected': mongo is not None,
+        'model_name': Config.MODEL_NAME,
+        'indexed_artworks': len(service.embedding_index),
+        'search_engine': service.embedding_index.ann_stats(),
+        'executors': {
+            'inference_workers': Config.ASYNC_INFERENCE_WORKERS,
+            'io_workers': Config.ASYNC_IO_WORKERS
+        },
+        'embedding_queue': service.embedding_queue.stats() if service.embedding_queue else None,
+        'inference_batching': {'image': service.image_batcher.stats(), 'text': service.text_batcher.stats()}
+    })
+
+
+async def generate_embedding(data, request):
+    """Queue (or with "sync": true, generate) the embedding of an artwork"""
+    artwork_id = data.get('artwork_id')
+    image_url = data.get('image_url')
+    if not artwork_id or not image_url:
+        return error('Missing artwork_id or image_url', 400)
+    if not ObjectId.is_valid(artwork_id):
+        return error('Invalid artwork_id', 400)
+
+    queue = service.embedding_queue
+    if queue is not None and not data.get('sync', False):
+        # A job the caller already stored is only picked up (see the Flask route)
+        job = await mongo.embedding_jobs.find_one({'_id': ObjectId(artwork_id)}) if data.get('queued') else None
+        if job is None:
+            job = await mongo.embedding_jobs.find_one_and_update(
+                {'_id': ObjectId(artwork_id)},
+                enqueue_update(image_url, datetime.utcnow()),
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        queue.notify()
+        return ServiceJSONResponse({
+            'success': True,
+            'artwork_id': artwork_id,
+            'status': job['status'],
+            'queued': True
+        }, status_code=202)
+
+    logger.info(f"Generating embedding for artwork: {artwork_id}")
+
+    _, image, source = await run_io(service.load_image_from_url, image_url)
+    if image is None:
+        return error('Failed to load image', 400)
+
+    embedding = await run_cpu(service.get_image_embedding, image)
+    if embedding is None:
+        return error('Failed to generate embedding', 500)
+
+    artwork = await mongo.artworks.find_one_and_update(
+        {'_id': ObjectId(artwork_id)},
+        {
+            '$set': {
+                'clip_embedding': encode_embedding(embedding, Config.EMBEDDING_STORAGE),
+                'embedding_source': source,
+                'embedding_updated_at': datetime.utcnow()
+            }
+        },
+        projection=METADATA_PROJECTION
+    )
+    if artwork is None:
+        return error('Artwork not found', 404)
+
+    # Make the new embedding searchable without a reload
+    await run_cpu(service.embedding_index.upsert, artwork_id, embedding, artwork_metadata(artwork))
+
+    logger.info(f"✓ Embedding stored for artwork: {artwork_id}")
+    return ServiceJSONResponse({
+        'success': True,
+        'artwork_id': artwork_id,
+        'embedding_dimension': len(embedding)
+    })
+
+
+def table_neighbors(neighbor_table, index, artwork_id, top_k):
+    """Precomputed neighbors with their metadata, or None if not in the table"""
+    neighbors = neighbor_table.get(artwork_id, top_k)
+    if neighbors is None:
+        return None
+    return [
+        (neighbor_id, score, index.get_metadata(neighbor_id))
+        for neighbor_id, score in neighbors
+        if neighbor_id in index
+    ]
+
+
+def batch_queries(index, artwork_ids, request_filters, exclude_artist):
+    """
+    Embeddings and filters of the artworks of a batch request
+
+    Returns:
+        (results, positions, queries, filters): results holds the error
+        entries of unknown artworks, positions the request index of each query
+    """
+    results = [None] * len(artwork_ids)
+    positions = []
+    queries = []
+    filters = []
+    for i, artwork_id in enumerate(artwork_ids):
+        embedding = index.get(artwork_id)
+        if embedding is None:
+            results[i] = {
+                'source_artwork_id': artwork_id,
+                'recommendations': [],
+                'error': 'Artwork not found or has no embedding'
+            }
+            continue
+        exclude_artist_id = None
+        if exclude_artist:
+            metadata = index.get_metadata(artwork_id)
+            if metadata and metadata['artist_id'] != 'Unknown':
+                exclude_artist_id = metadata['artist_id']
+        positions.append(i)
+        queries.append(embedding)
+        filters.append(SearchFilter.from_request(
+            request_filters,
+            exclude_ids=[artwork_id],
+            exclude_artist=exclude_artist_id
+        ))
+
+    return results, positions, queries, filters
+
+
+async def recommend_similar(data, request):
+    """Get similar artworks based on an artwork (see the Flask route)"""
+    artwork_id = data.get('artwork_id')
+    top_k = data.get('top_k', Config.TOP_K)
+    exclude_artist = data.get('exclude_artist', False)
+    exact = data.get('engine') == 'exact'
+    if not artwork_id:
+        return error('Missing artwork_id', 400)
+    fields = fields_of(data, request, include_tags=True)
+
+    index = service.embedding_index
+    source_embedding = await run_cpu(index.get, artwork_id)
+    if source_embedding is None:
+        if not await mongo.artworks.find_one({'_id': ObjectId(artwork_id)}, {'_id': 1}):
+            return error('Artwork not found', 404)
+        return error('Artwork does not have an embedding. Generate it first.', 404)
+
+    # Unfiltered requests are answered from the precomputed table
+    neighbor_table = service.neighbor_table
+    if neighbor_table and not exclude_artist and not exact and not data.get('filters'):
+        results = await run_cpu(table_neighbors, neighbor_table, index, artwork_id, top_k)
+        if results is not None:
+            return ServiceJSONResponse({
+                'success': True,
+                'source_artwork_id': artwork_id,
+                'recommendations': service.format_recommendations(results, fields=fields),
+                'total_compared': len(index) - 1,
+                'engine': 'neighbor_table'
+            })
+
+    exclude_artist_id = None
+    if exclude_artist:
+        source_metadata = await run_cpu(index.get_metadata, artwork_id)
+        if source_metadata and source_metadata['artist_id'] != 'Unknown':
+            exclude_artist_id = source_metadata['artist_id']
+
+    filters = SearchFilter.from_request(data.get('filters'), exclude_ids=[artwork_id], exclude_artist=exclude_artist_id)
+    results, total_compared, engine = await run_cpu(index.search, source_embedding, top_k, filters=filters, exact=exact)
+    return ServiceJSONResponse({
+        'success': True,
+        'source_artwork_id': artwork_id,
+        'recommendations': service.format_recommendations(results, fields=fields),
+        'total_compared': total_compared,
+        'engine': engine
+    })
+
+
+async def recommend_by_text(data, request):
+    """Get artworks based on a text description (see the Flask route)"""
+    query_text = data.get('query')
+    top_k = int(data.get('top_k', Config.TOP_K))
+    exact = data.get('engine') == 'exact'
+    mode = data.get('mode', Config.TEXT_SEARCH_MODE)
+    if not query_text:
+        return error('Missing query text', 400)
+    if mode not in service.TEXT_SEARCH_MODES:
+        return error(f"mode must be one of {list(service.TEXT_SEARCH_MODES)}", 400)
+    fields = fields_of(data, request)
+
+    index = service.embedding_index
+    filters = SearchFilter.from_request(data.get('filters'))
+    if mode == 'lexical':
+        results = await run_cpu(index.lexical_search, query_text, top_k, filters)
+        total_compared = len(results)
+        engine = 'lexical'
+    else:
+        text_embedding = await run_cpu(service.get_text_embedding, query_text)
+        if text_embedding is None:
+            return error('Failed to generate text embedding', 500)
+        if mode == 'hybrid':
+            results, total_compared, engine = await run_cpu(
+                service.hybrid_search, query_text, text_embedding, top_k, filters, exact
+            )
+        else:
+            results, total_compared, engine = await run_cpu(
+                index.search, text_embedding, top_k, filters=filters, exact=exact
+            )
+
+    return ServiceJSONResponse({
+        'success': True,
+        'query': query_text,
+        'mode': mode,
+        'recommendations': service.format_recommendations(results, fields=fields),
+        'total_compared': total_compared,
+        'engine': engine
+    })
+
+
+async def recommend_similar_batch(data, request):
+    """Get similar artworks for many artworks at once (see the Flask route)"""
+    artwork_ids = data.get('artwork_ids') or []
+    top_k = data.get('top_k', Config.TOP_K)
+    exclude_artist = data.get('exclude_artist', False)
+    if not artwork_ids or not isinstance(artwork_ids, list):
+        return error('Missing artwork_ids', 400)
+    if len(artwork_ids) > Config.MAX_BATCH_QUERIES:
+        return error(f'At most {Config.MAX_BATCH_QUERIES} artwork_ids per request', 400)
+    fields = fields_of(data, request, include_tags=True)
+
+    index = service.embedding_index
+    results, positions, queries, filters = await run_cpu(
+        batch_queries, index, artwork_ids, data.get('filters'), exclude_artist
+    )
+
+    if queries:
+        batch_results = await run_cpu(index.search_batch, queries, top_k, filters)
+        for i, (matches, total_compared) in zip(positions, batch_results):
+            results[i] = {
+                'source_artwork_id': artwork_ids[i],
+                'recommendations': service.format_recommendations(matches, fields=fields),
+                'total_compared': total_compared
+            }
+
+    return ServiceJSONResponse({'success': True, 'results': results, 'engine': 'exact'})
+
+
+async def recommend_by_text_batch(data, request):
+    """Get artworks for many text descriptions at once (see the Flask route)"""
+    queries = data.get('queries') or []
+    top_k = data.get('top_k', Config.TOP_K)
+    if not queries or not isinstance(queries, list) or not all(isinstance(q, str) and q for q in queries):
+        return error('Missing queries', 400)
+    if len(queries) > Config.MAX_BATCH_QUERIES:
+        return error(f'At most {Config.MAX_BATCH_QUERIES} queries per request', 400)
+    fields = fields_of(data, request)
+
+    text_embeddings = await run_cpu(service.get_text_embeddings, queries)
+    if text_embeddings is None:
+        return error('Failed to generate text embeddings', 500)
+
+    query_filter = SearchFilter.from_request(data.get('filters'))
+    batch_results = await run_cpu(
+        service.embedding_index.search_batch, text_embeddings, top_k, [query_filter] * len(queries)
+    )
+    return ServiceJSONResponse({
+        'success': True,
+        'results': [
+            {
+                'query': query_text,
+                'recommendations': service.format_recommendations(matches, fields=fields),
+                'total_compared': total_compared
+            }
+            for query_text, (matches, total_compared) in zip(queries, batch_results)
+        ],
+        'engine': 'exact'
+    })
+
+
+async def recommend_personalized(data, request):
+    """Get personalized recommendations based on user history (see the Flask route)"""
+    user_id = data.get('user_id')
+    top_k = data.get('top_k', Config.TOP_K)
+    exact = data.get('engine') == 'exact'
+    if not user_id:
+        return error('Missing user_id', 400)
+    fields = fields_of(data, request)
+
+    # The profile store is synchronous (and may rebuild from the user document)
+    profile = await run_io(service.profile_store.get, user_id)
+    if profile is None:
+        return error('User not found', 404)
+
+    empty = {'success': True, 'user_id': user_id, 'based_on_items': 0, 'recommendations': []}
+    if not profile['interaction_ids']:
+        return ServiceJSONResponse({
+            **empty,
+            'message': 'No user history available. Like or purchase artworks to get personalized recommendations.'
+        })
+    if profile['vectors'] is None:
+        return ServiceJSONResponse({**empty, 'message': 'No embeddings found for user history'})
+
+    index = service.embedding_index
+    filters = SearchFilter.from_request(data.get('filters'), exclude_ids=profile['interaction_ids'])
+    if len(profile['vectors']) == 1:
+        results, total_compared, engine = await run_cpu(
+            index.search, profile['vectors'][0], top_k, filters=filters, exact=exact
+        )
+    else:
+        batch = await run_cpu(index.search_batch, profile['vectors'], top_k, [filters] * len(profile['vectors']))
+        results = merge_centroid_results([r for r, _ in batch], profile['weights'], top_k)
+        total_compared = batch[0][1]
+        engine = 'exact'
+
+    if total_compared == 0:
+        return ServiceJSONResponse({
+            **empty,
+            'based_on_items': profile['count'],
+            'message': 'No new artworks to recommend'
+        })
+
+    return ServiceJSONResponse({
+        'success': True,
+        'user_id': user_id,
+        'based_on_items': profile['count'],
+        'profile_centroids': len(profile['vectors']),
+        'recommendations': service.format_recommendations(results, fields=fields),
+        'total_compared': total_compared,
+        'engine': engine
+    })
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global mongo
+    if Config.SERVICE_PRELOAD:
+        # Preloaded before fork without a post_fork hook (no-op if it ran)
+        service.start_worker_services()
+    mongo = AsyncIOMotorClient(Config.MONGODB_URI)[Config.DB_NAME]
+    logger.info(f"✓ Async MongoDB client ready (inference workers: {Config.ASYNC_INFERENCE_WORKERS})")
+    yield
+    mongo.client.close()
+    inference_executor.shutdown(wait=False)
+    io_executor.shutdown(wait=False)
+
+
+app = Starlette(
+    routes=[
+        Route('/health', endpoint(health, gated=False), methods=['GET']),
+        Route('/generate-embedding', endpoint(generate_embedding), methods=['POST']),
+        Route('/recommend/similar', endpoint(recommend_similar), methods=['POST']),
+        Route('/recommend/similar/batch', endpoint(recommend_similar_batch), methods=['POST']),
+        Route('/recommend/text', endpoint(recommend_by_text), methods=['POST']),
+        Route('/recommend/text/batch', endpoint(recommend_by_text_batch), methods=['POST']),
+        Route('/recommend/personalized', endpoint(recommend_personalized), methods=['POST'])
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=service.allowed_origins, allow_credentials=True)],
+    lifespan=lifespan
+)
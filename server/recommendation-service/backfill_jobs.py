@@ -0,0 +1,353 @@
+"""
+Resumable embedding backfill jobs
+
+Backfills run in a background worker instead of inside one HTTP request.
+Each job streams the artworks collection in _id order and checkpoints the
+last processed _id and counters to a jobs collection after every chunk,
+so a crashed or redeployed instance picks the job up again where it
+stopped instead of starting over. The owner renews a heartbeat while a
+chunk runs; checkpoints only apply while it still owns the job.
+"""
+
+import os
+import socket
+import threading
+import logging
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import CursorNotFound, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+ACTIVE_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+
+
+class LeaseLost(Exception):
+    """The job was resumed by another worker after its heartbeat expired"""
+
+
+def job_to_dict(job):
+    """
+    Convert a job document into a JSON serializable progress report
+
+    Args:
+        job: Job document from MongoDB
+
+    Returns:
+        Dict with status, counters and throughput
+    """
+    started_at = job.get('started_at')
+    end = job.get('finished_at') or datetime.utcnow()
+    elapsed = (end - started_at).total_seconds() if started_at else 0
+    done = job.get('processed', 0) + job.get('failed', 0) + job.get('skipped', 0)
+
+    def iso(value):
+        return value.isoformat() + 'Z' if value else None
+
+    return {
+        'job_id': str(job['_id']),
+        'status': job['status'],
+        'force_regenerate': job.get('force_regenerate', False),
+        'reembed_unchanged': job.get('reembed_unchanged', False),
+        'limit': job.get('limit'),
+        'processed': job.get('processed', 0),
+        'failed': job.get('failed', 0),
+        'skipped': job.get('skipped', 0),
+        'last_id': str(job['last_id']) if job.get('last_id') else None,
+        'cancel_requested': job.get('cancel_requested', False),
+        'error': job.get('error'),
+        'elapsed_seconds': round(elapsed, 1),
+        'throughput_per_second': round(done / elapsed, 2) if elapsed > 0 else 0.0,
+        'created_at': iso(job.get('created_at')),
+        'started_at': iso(started_at),
+        'finished_at': iso(job.get('finished_at'))
+    }
+
+
+class BackfillJobManager:
+    """
+    Runs queued backfill jobs one at a time in a daemon thread
+
+    Every worker process runs a manager; jobs are claimed atomically, so a
+    job runs in exactly one process. The owner renews the job's heartbeat
+    every lease_seconds / 3, also in the middle of a chunk; a running job
+    whose heartbeat is older than lease_seconds is considered orphaned and
+    is resumed from its checkpoint (or finished as cancelled) by the next
+    manager that polls.
+
+    Args:
+        jobs: pymongo collection storing job documents
+        artworks: pymongo collection of artworks
+        embed: Function (list_of_artworks, skip_unchanged) ->
+            (processed, failed, skipped)
+        projection: Artwork fields needed by embed
+        chunk_size: Artworks processed between checkpoints
+        poll_interval: Seconds between checks for claimable jobs
+        lease_seconds: Heartbeat age after which a running job is resumed
+    """
+
+    def __init__(self, jobs, artworks, embed, projection=None, chunk_size=64,
+                 poll_interval=5, lease_seconds=300):
+        self.jobs = jobs
+        self.artworks = artworks
+        self.embed = embed
+        self.projection = projection
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Create indexes and start the worker thread"""
+        self.jobs.create_index([('status', 1), ('created_at', 1)])
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='backfill-worker', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Signal the worker thread to exit after the current chunk"""
+        self._stop.set()
+        self._wake.set()
+
+    def submit(self, force_regenerate=False, limit=None, reembed_unchanged=False):
+        """
+        Queue a new backfill job
+
+        Args:
+            force_regenerate: Re-embed artworks that already have an embedding
+            limit: Maximum number of artworks to process (None for all)
+            reembed_unchanged: With force_regenerate, also re-embed artworks
+                whose image, model and preprocessing are unchanged
+
+        Returns:
+            Job document
+        """
+        now = datetime.utcnow()
+        job = {
+            '_id': ObjectId(),
+            'status': JOB_QUEUED,
+            'force_regenerate': bool(force_regenerate),
+            'reembed_unchanged': bool(reembed_unchanged),
+            'limit': limit,
+            'processed': 0,
+            'failed': 0,
+            'skipped': 0,
+            'last_id': None,
+            'cancel_requested': False,
+            'created_at': now,
+            'updated_at': now
+        }
+        self.jobs.insert_one(job)
+        self._wake.set()
+        logger.info(f"Queued backfill job {job['_id']}")
+        return job
+
+    def get(self, job_id):
+        """Get a job document by id or None (also for malformed ids)"""
+        if not ObjectId.is_valid(job_id):
+            return None
+        return self.jobs.find_one({'_id': ObjectId(job_id)})
+
+    def cancel(self, job_id):
+        """
+        Cancel a job
+
+        Queued jobs are cancelled immediately; running jobs stop at their
+        next checkpoint.
+
+        Returns:
+            Updated job document or None if not found
+        """
+        if not ObjectId.is_valid(job_id):
+            return None
+        job_id = ObjectId(job_id)
+        now = datetime.utcnow()
+        self.jobs.update_one(
+            {'_id': job_id, 'status': JOB_QUEUED},
+            {'$set': {'status': JOB_CANCELLED, 'cancel_requested': True, 'finished_at': now, 'updated_at': now}}
+        )
+        return self.jobs.find_one_and_update(
+            {'_id': job_id},
+            {'$set': {'cancel_requested': True, 'updated_at': now}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _claim(self):
+        """Atomically claim the oldest queued or orphaned job"""
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=self.lease_seconds)
+        return self.jobs.find_one_and_update(
+            {
+                '$or': [
+                    {'status': JOB_QUEUED, 'cancel_requested': {'$ne': True}},
+                    # Orphaned jobs are resumed, or finished as cancelled if
+                    # that was requested before their worker died
+                    {'status': JOB_RUNNING, 'heartbeat_at': {'$lt': stale}}
+                ]
+            },
+            {
+                '$set': {'status': JOB_RUNNING, 'owner': self.owner, 'heartbeat_at': now, 'updated_at': now},
+                '$min': {'started_at': now}
+            },
+            sort=[('created_at', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except PyMongoError as e:
+                logger.error(f"Error claiming backfill job: {str(e)}")
+                job = None
+
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+
+            try:
+                self._execute(job)
+            except LeaseLost:
+                logger.warning(f"Backfill job {job['_id']} was taken over by another worker, stopping")
+            except Exception as e:
+                logger.error(f"Backfill job {job['_id']} failed: {str(e)}")
+                try:
+                    self._finish(job['_id'], JOB_FAILED, error=str(e))
+                except (LeaseLost, PyMongoError):
+                    pass
+
+    def _stream(self, job):
+        """
+        Yield artworks after the job checkpoint in _id order
+
+        The cursor is reopened from the last yielded _id if the server
+        drops it while a chunk is being embedded.
+        """
+        query = {} if job.get('force_regenerate') else {'clip_embedding': {'$exists': False}}
+        last_id = job.get('last_id')
+
+        while True:
+            page_query = dict(query)
+            if last_id is not None:
+                page_query['_id'] = {'$gt': last_id}
+            cursor = self.artworks.find(page_query, self.projection).sort('_id', 1).batch_size(self.chunk_size)
+            try:
+                for artwork in cursor:
+                    last_id = artwork['_id']
+                    yield artwork
+                return
+            except CursorNotFound:
+                logger.warning(f"Backfill cursor expired, reopening after {last_id}")
+            finally:
+                cursor.close()
+
+    def _owned(self, job_id):
+        """Filter matching the job only while this worker still owns it"""
+        return {'_id': job_id, 'status': JOB_RUNNING, 'owner': self.owner}
+
+    def _keep_alive(self, job_id, done):
+        """Renew the heartbeat until done is set, so long chunks keep the lease"""
+        interval = max(self.lease_seconds / 3, 1)
+        while not done.wait(interval):
+            now = datetime.utcnow()
+            try:
+                renewed = self.jobs.update_one(self._owned(job_id), {'$set': {'heartbeat_at': now, 'updated_at': now}})
+            except PyMongoError as e:
+                logger.warning(f"Could not renew backfill job {job_id} heartbeat: {str(e)}")
+                continue
+            if not renewed.matched_count:
+                # The checkpoint that follows fails and stops the job
+                return
+
+    def _execute(self, job):
+        job_id = job['_id']
+        if job.get('cancel_requested'):
+            self._finish(job_id, JOB_CANCELLED)
+            return
+
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._keep_alive, args=(job_id, done), name='backfill-heartbeat', daemon=True)
+        heartbeat.start()
+        try:
+            self._process(job)
+        finally:
+            done.set()
+
+    def _process(self, job):
+        job_id = job['_id']
+        limit = job.get('limit')
+        done = job.get('processed', 0) + job.get('failed', 0) + job.get('skipped', 0)
+        remaining = None if limit is None else max(limit - done, 0)
+        logger.info(f"Running backfill job {job_id} from {job.get('last_id') or 'start'}")
+
+        chunk = []
+        for artwork in self._stream(job):
+            if remaining is not None and remaining <= 0:
+                break
+            chunk.append(artwork)
+            if remaining is not None:
+                remaining -= 1
+            if len(chunk) >= self.chunk_size:
+                job = self._checkpoint(job, chunk)
+                chunk = []
+                if job.get('cancel_requested') or self._stop.is_set():
+                    break
+
+        if chunk:
+            job = self._checkpoint(job, chunk)
+
+        if job.get('cancel_requested'):
+            self._finish(job_id, JOB_CANCELLED)
+        elif self._stop.is_set():
+            # Leave the job running; its lease expires and another worker resumes it
+            return
+        else:
+            self._finish(job_id, JOB_COMPLETED)
+
+    def _checkpoint(self, job, chunk):
+        """
+        Embed a chunk and persist progress; returns the updated job
+
+        Raises:
+            LeaseLost: If another worker owns the job by now
+        """
+        skip_unchanged = job.get('force_regenerate') and not job.get('reembed_unchanged')
+        processed, failed, skipped = self.embed(chunk, skip_unchanged)
+        now = datetime.utcnow()
+        job = self.jobs.find_one_and_update(
+            self._owned(job['_id']),
+            {
+                '$set': {'last_id': chunk[-1]['_id'], 'heartbeat_at': now, 'updated_at': now},
+                '$inc': {'processed': processed, 'failed': failed, 'skipped': skipped}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if job is None:
+            raise LeaseLost()
+        return job
+
+    def _finish(self, job_id, status, error=None):
+        """
+        Raises:
+            LeaseLost: If another worker owns the job by now
+        """
+        now = datetime.utcnow()
+        update = {'status': status, 'finished_at': now, 'updated_at': now}
+        if error:
+            update['error'] = error
+        if not self.jobs.update_one(self._owned(job_id), {'$set': update}).matched_count:
+            raise LeaseLost()
+        logger.info(f"✓ Backfill job {job_id} {status}")
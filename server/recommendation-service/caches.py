@@ -0,0 +1,243 @@
+"""
+In-process caches for the Artscape recommendation service
+"""
+
+import os
+import tempfile
+import threading
+import time
+import logging
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Nominal size charged for a cached failure
+NEGATIVE_ENTRY_BYTES = 64
+
+
+class ByteBudgetCache:
+    """
+    Thread-safe LRU cache bounded by total bytes instead of entry count
+
+    Entries expire after ttl seconds; failures (None values) are cached
+    for the shorter negative_ttl so a transient error is retried soon.
+
+    Args:
+        max_bytes: Total size budget of all entries
+        ttl: Seconds a value stays valid (None for no expiry)
+        negative_ttl: Seconds a cached None stays valid
+    """
+
+    def __init__(self, max_bytes, ttl=None, negative_ttl=60):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Look up a key
+
+        Returns:
+            (found, value) - found is False on a miss or an expired entry
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, size, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+                self.current_bytes -= size
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value, size):
+        """
+        Store a value, evicting least recently used entries to fit
+
+        Args:
+            key: Hashable cache key
+            value: Value to cache (None caches a failure)
+            size: Size of value in bytes
+        """
+        if value is None:
+            size, ttl = NEGATIVE_ENTRY_BYTES, self.negative_ttl
+        else:
+            ttl = self.ttl
+        if size > self.max_bytes or ttl == 0:
+            return
+
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous[1]
+            while self._entries and self.current_bytes + size > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+            self._entries[key] = (value, size, expires_at)
+            self.current_bytes += size
+
+    def items(self):
+        """Snapshot of unexpired (key, value) pairs, least recently used first"""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (key, value)
+                for key, (value, _, expires_at) in self._entries.items()
+                if expires_at is None or expires_at > now
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """Cache counters for /health"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+def normalize_query(text):
+    """Normalize a search query so trivially different spellings share a cache entry"""
+    return ' '.join(text.lower().split())
+
+
+class TextEmbeddingCache(ByteBudgetCache):
+    """
+    LRU cache of normalized text query -> CLIP text embedding
+
+    Optionally persisted to an .npz file so repeated searches skip the
+    text tower across restarts. The file records the model key (model name
+    plus tower precision and mode) and is ignored if it was written by
+    different towers. Periodic saves run in a background thread, never on
+    the request thread.
+
+    Args:
+        max_entries: Maximum number of cached queries
+        model_name: Key of the towers producing the embeddings, see set_model
+        path: .npz file to persist to (None to keep in memory only)
+        save_every: Save after this many new entries
+        dim: Embedding dimension
+    """
+
+    def __init__(self, max_entries, model_name, path=None, save_every=100, dim=512):
+        super().__init__(max_entries * dim * 4, ttl=None, negative_ttl=0)
+        self.model_name = model_name
+        self.path = path
+        self.save_every = save_every
+        self._unsaved = 0
+        self._save_pending = False
+        self._state_lock = threading.Lock()
+        # Serializes writers of the file within this process
+        self._save_lock = threading.Lock()
+
+    def set_model(self, model_name):
+        """
+        Switch to the towers actually loaded (e.g. 'model:int8/torchscript')
+
+        Entries computed by other towers are dropped, so embeddings of
+        different precisions or execution modes are never mixed.
+        """
+        if model_name != self.model_name:
+            self.clear()
+            self.model_name = model_name
+
+    def get_embedding(self, query):
+        """
+        Look up a query
+
+        Returns:
+            float32 embedding or None on a miss
+        """
+        _, embedding = self.get(normalize_query(query))
+        return embedding
+
+    def set_embedding(self, query, embedding):
+        """Cache the embedding of a query"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        self.set(normalize_query(query), vector, vector.nbytes)
+        if self.path:
+            self._schedule_save()
+
+    def _schedule_save(self):
+        """Start a background save once save_every entries are unsaved"""
+        with self._state_lock:
+            self._unsaved += 1
+            if self._unsaved < self.save_every or self._save_pending:
+                return
+            self._save_pending = True
+        threading.Thread(target=self._background_save, name='text-cache-save', daemon=True).start()
+
+    def _background_save(self):
+        try:
+            self.save()
+        finally:
+            with self._state_lock:
+                self._save_pending = False
+
+    def save(self):
+        """Atomically write the cache to disk"""
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._state_lock:
+                self._unsaved = 0
+            entries = self.items()
+            if not entries:
+                return
+            tmp_path = None
+            try:
+                # Unique temp file in the target directory, so concurrent
+                # writers never share it and os.replace stays atomic
+                fd, tmp_path = tempfile.mkstemp(
+                    dir=os.path.dirname(os.path.abspath(self.path)),
+                    prefix=os.path.basename(self.path) + '.',
+                    suffix='.tmp.npz'
+                )
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez(
+                        f,
+                        model_name=np.array(self.model_name),
+                        queries=np.array([key for key, _ in entries]),
+                        embeddings=np.stack([value for _, value in entries])
+                    )
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logger.error(f"Error saving text embedding cache: {str(e)}")
+                if tmp_path and os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+
+    def load(self):
+        """Load a previously saved cache, if any"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                if str(data['model_name']) != self.model_name:
+                    logger.info("Text embedding cache was built by another model, ignoring it")
+                    return
+                for query, embedding in zip(data['queries'], data['embeddings']):
+                    self.set(str(query), embedding, embedding.nbytes)
+            logger.info(f"✓ Loaded {len(self)} cached text embeddings")
+        except Exception as e:
+            logger.error(f"Error loading text embedding cache: {str(e)}")
@@ -1,10 +1,12 @@
-
 from transformers import CLIPModel, CLIPProcessor
 import os
 
 # Set cache directory to local models folder
-cache_dir = "./models"
-model_name = "openai/clip-vit-base-patch32"
+cache_dir = os.getenv('MODEL_CACHE_DIR', './models')
+model_name = os.getenv('MODEL_NAME', 'openai/clip-vit-base-patch32')
+
+# Local snapshot loaded by the service at startup (see Config.MODEL_SNAPSHOT_DIR)
+snapshot_dir = os.getenv('MODEL_SNAPSHOT_DIR', f"./models/snapshot/{model_name.replace('/', '--')}")
 
 print(f"Downloading {model_name} to {cache_dir}...")
 
@@ -13,4 +15,10 @@ model = CLIPModel.from_pretrained(model_name, cache_dir=cache_dir)
 processor = CLIPProcessor.from_pretrained(model_name, cache_dir=cache_dir)
 
 print("Download complete!")
-print(f"Model saved in: {os.path.abspath(cache_dir)}")
\ No newline at end of file
+print(f"Model saved in: {os.path.abspath(cache_dir)}")
+
+# Write a safetensors snapshot: loads memory-mapped with no hub lookups
+model.save_pretrained(snapshot_dir, safe_serialization=True)
+processor.save_pretrained(snapshot_dir)
+
+print(f"Snapshot saved in: {os.path.abspath(snapshot_dir)}")
@@ -0,0 +1,870 @@
+"""
+In-memory embedding index for the Artscape recommendation service
+
+Keeps every artwork's CLIP embedding in one contiguous float32 matrix
+(N x 512) together with an artwork id -> row map, so that a recommendation
+query is a single matrix-vector product followed by an argpartition top-k
+instead of a full MongoDB scan.
+"""
+
+import sys
+import threading
+import logging
+import numpy as np
+from contextlib import contextmanager
+from datetime import datetime
+from embedding_storage import decode_embedding
+from ann_index import build_ann_index
+from lexical_index import LexicalIndex
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 512
+
+# Fields needed to render a recommendation card
+METADATA_PROJECTION = {
+    'title': 1,
+    'artist': 1,
+    'image': 1,
+    'price': 1,
+    'tags': 1
+}
+
+
+def normalize_tags(tags):
+    """
+    Normalize stored tags to a list of strings
+
+    Args:
+        tags: List of tags or comma separated string
+
+    Returns:
+        List of tag strings
+    """
+    if isinstance(tags, str):
+        return [t.strip() for t in tags.split(',')] if tags else []
+    return tags if isinstance(tags, list) else []
+
+
+def artwork_metadata(artwork):
+    """
+    Extract the display fields of an artwork document
+
+    Args:
+        artwork: Artwork document from MongoDB
+
+    Returns:
+        Dict with title, artist_id, image, price and tags
+    """
+    return {
+        'title': artwork.get('title', 'Untitled'),
+        'artist_id': str(artwork.get('artist', 'Unknown')) if artwork.get('artist') else 'Unknown',
+        'image': artwork.get('image', ''),
+        'price': artwork.get('price', 0),
+        'tags': normalize_tags(artwork.get('tags', []))
+    }
+
+
+def price_value(metadata):
+    """Numeric price of an artwork for filtering (NaN if not a number)"""
+    try:
+        return float(metadata.get('price'))
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+class MetadataColumns:
+    """
+    Row-aligned display fields stored column by column
+
+    Replaces a list of per-artwork dicts: each field is one list, artist ids
+    are interned, and a dict is only built (hydrated) for rows that are
+    actually returned, e.g. the top-k of a search. Supports the list
+    operations the index needs (index, assign, append, pop, iterate).
+    """
+
+    FIELDS = ('title', 'artist_id', 'image', 'price', 'tags')
+
+    def __init__(self, rows=()):
+        self._columns = {field: [] for field in self.FIELDS}
+        for metadata in rows:
+            self.append(metadata)
+
+    def __len__(self):
+        return len(self._columns['title'])
+
+    def __getitem__(self, row):
+        return {field: column[row] for field, column in self._columns.items()}
+
+    def __setitem__(self, row, metadata):
+        for field, column in self._columns.items():
+            column[row] = self._value(field, metadata)
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+    @staticmethod
+    def _value(field, metadata):
+        value = metadata.get(field)
+        if field == 'artist_id' and isinstance(value, str):
+            return sys.intern(value)
+        return value
+
+    def append(self, metadata):
+        for field, column in self._columns.items():
+            column.append(self._value(field, metadata))
+
+    def pop(self):
+        for column in self._columns.values():
+            column.pop()
+
+
+def normalize_tag(tag):
+    """Case-insensitive form of a tag used for tag filters"""
+    return str(tag).strip().lower()
+
+
+class SearchFilter:
+    """
+    Pre-filter applied as a boolean row mask during top-k selection
+
+    Args:
+        exclude_ids: Artwork ids to leave out
+        exclude_artist: Artist id whose artworks are left out
+        artist_id: Only artworks by this artist
+        min_price: Only artworks priced at least this much
+        max_price: Only artworks priced at most this much
+        tags: Only artworks having any of these tags
+    """
+
+    def __init__(self, exclude_ids=(), exclude_artist=None, artist_id=None,
+                 min_price=None, max_price=None, tags=None):
+        self.exclude_ids = exclude_ids
+        self.exclude_artist = exclude_artist
+        self.artist_id = artist_id
+        self.min_price = min_price
+        self.max_price = max_price
+        self.tags = tags
+
+    @classmethod
+    def from_request(cls, filters, **kwargs):
+        """
+        Build a filter from the optional "filters" object of a request body
+
+        Args:
+            filters: Dict with artist_id, min_price, max_price and/or tags
+            **kwargs: Additional SearchFilter arguments
+
+        Returns:
+            SearchFilter
+        """
+        filters = filters or {}
+        tags = filters.get('tags')
+        if isinstance(tags, str):
+            tags = [tags]
+        return cls(
+            artist_id=filters.get('artist_id'),
+            min_price=filters.get('min_price'),
+            max_price=filters.get('max_price'),
+            tags=tags,
+            **kwargs
+        )
+
+
+class _ReadWriteLock:
+    """
+    Held by any number of readers or by one writer
+
+    Waiting writers hold back new readers, so a steady stream of searches
+    cannot starve index updates. Not reentrant.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writer or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._writers_waiting += 1
+            try:
+                while self._writer or self._readers:
+                    self._condition.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class EmbeddingIndex:
+    """
+    Process-resident index of artwork embeddings
+
+    Rows live in a preallocated buffer that grows by doubling, so single
+    inserts are amortized O(1) and deletes swap the last row into the hole.
+    Prices are kept as a parallel column and artists/tags as id posting
+    sets, so search filters become boolean masks instead of Mongo queries.
+    Lookups and searches share a read lock, so concurrent searches run their
+    BLAS calls in parallel (numpy releases the GIL); changes take it
+    exclusively.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self._lock = _ReadWriteLock()
+        self._buffer = np.empty((0, dim), dtype=np.float32)
+        self._size = 0
+        self._ids = []
+        self._id_to_row = {}
+        self._prices = np.empty(0, dtype=np.float64)
+        self._by_artist = {}
+        self._by_tag = {}
+        self._metadata = MetadataColumns()
+        # Title/tag inverted index, maintained together with the postings
+        self.lexical = LexicalIndex()
+        self.loaded = False
+        self.loaded_at = None
+        # Incremented on every change; lets snapshot publishing detect
+        # whether the rows changed since an export
+        self.version = 0
+        self._listeners = []
+
+        # Optional approximate search engine (see configure_ann)
+        self.ann_engine = None
+        self.ann_params = {}
+        self.ann_min_size = 0
+        self.ann_oversample = 4
+        self.ann_rebuild_ratio = 0.05
+        self._ann = None
+        self._ann_dirty = set()
+        self._ann_building = False
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, artwork_id):
+        return str(artwork_id) in self._id_to_row
+
+    @property
+    def matrix(self):
+        """View of the populated rows of the embedding matrix"""
+        return self._buffer[:self._size]
+
+    def load(self, collection):
+        """
+        (Re)build the index from the artworks collection
+
+        Only the embedding and the display fields are projected, so documents
+        are read once at startup instead of on every request. Embeddings may
+        be stored as legacy arrays or packed binary.
+
+        Args:
+            collection: pymongo collection of artworks
+        """
+        projection = {'clip_embedding': 1, **METADATA_PROJECTION}
+        started_at = datetime.utcnow()
+        expected = collection.count_documents({'clip_embedding': {'$exists': True}})
+
+        buffer = np.empty((max(expected, 1), self.dim), dtype=np.float32)
+        ids = []
+        metadata = []
+        size = 0
+
+        cursor = collection.find({'clip_embedding': {'$exists': True}}, projection, batch_size=1000)
+        for artwork in cursor:
+            embedding = decode_embedding(artwork.get('clip_embedding'))
+            if embedding is None or embedding.shape != (self.dim,):
+                continue
+            if size == buffer.shape[0]:
+                buffer = self._grow(buffer, size + 1)
+            buffer[size] = embedding
+            ids.append(str(artwork['_id']))
+            metadata.append(artwork_metadata(artwork))
+            size += 1
+
+        self._install(buffer, size, ids, metadata, started_at)
+        logger.info(f"✓ Embedding index loaded: {size} artworks ({buffer.nbytes / 1e6:.1f} MB)")
+
+        if self.ann_engine:
+            self.build_ann()
+
+    def load_snapshot(self, snapshot):
+        """
+        Replace the rows with a memory-mapped snapshot (see index_snapshot)
+
+        The snapshot buffer is mapped copy-on-write: unchanged pages stay
+        shared with every other process mapping the same file, and only
+        rows modified afterwards become private.
+
+        Args:
+            snapshot: IndexSnapshot
+        """
+        self._install(snapshot.buffer, snapshot.size, snapshot.ids, snapshot.metadata, snapshot.watermark)
+        logger.info(f"✓ Embedding index mapped from snapshot {snapshot.version}: {snapshot.size} artworks")
+
+        if self.ann_engine and self._ann is None:
+            self.build_ann()
+
+    def adopt_snapshot(self, snapshot, expected_version):
+        """
+        Switch to a snapshot exported from this index, if nothing changed since
+
+        Used by the publishing process so it shares the mapped pages too
+        instead of keeping a private copy next to them.
+
+        Returns:
+            True if the snapshot was adopted
+        """
+        with self._lock.write():
+            if self.version != expected_version or snapshot.size != self._size:
+                return False
+            self._buffer = snapshot.buffer
+            if self._prices.shape[0] < self._buffer.shape[0]:
+                self._prices = self._grow(self._prices, self._buffer.shape[0])
+            return True
+
+    def export(self):
+        """
+        Consistent copy of the rows for writing a snapshot
+
+        Returns:
+            (ids, matrix, metadata, version)
+        """
+        with self._lock.read():
+            return list(self._ids), self._buffer[:self._size].copy(), list(self._metadata), self.version
+
+    def _install(self, buffer, size, ids, metadata, loaded_at):
+        """Swap in a complete set of rows"""
+        prices = np.empty(buffer.shape[0], dtype=np.float64)
+        prices[:size] = [price_value(m) for m in metadata]
+        columns = MetadataColumns(metadata)
+
+        with self._lock.write():
+            self._buffer = buffer
+            self._size = size
+            self._ids = ids
+            self._id_to_row = {artwork_id: row for row, artwork_id in enumerate(ids)}
+            self._prices = prices
+            self._by_artist = {}
+            self._by_tag = {}
+            self._metadata = columns
+            self.lexical.clear()
+            for artwork_id, artwork_meta in zip(ids, metadata):
+                self._add_postings(artwork_id, artwork_meta)
+            self.loaded = True
+            self.loaded_at = loaded_at
+            self.version += 1
+
+    def _grow(self, buffer, min_rows):
+        """Return a copy of buffer with capacity for at least min_rows rows"""
+        capacity = max(min_rows, buffer.shape[0] * 2, 16)
+        grown = np.empty((capacity,) + buffer.shape[1:], dtype=buffer.dtype)
+        grown[:buffer.shape[0]] = buffer
+        return grown
+
+    def _add_postings(self, artwork_id, metadata):
+        self._by_artist.setdefault(metadata['artist_id'], set()).add(artwork_id)
+        for tag in metadata.get('tags', []):
+            self._by_tag.setdefault(normalize_tag(tag), set()).add(artwork_id)
+        self.lexical.add(artwork_id, metadata)
+
+    def _remove_postings(self, artwork_id, metadata):
+        self.lexical.remove(artwork_id, metadata)
+        postings = [(self._by_artist, metadata['artist_id'])]
+        postings += [(self._by_tag, normalize_tag(tag)) for tag in metadata.get('tags', [])]
+        for index, key in postings:
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(artwork_id)
+                if not ids:
+                    del index[key]
+
+    def ids(self):
+        """Snapshot of the indexed artwork ids"""
+        with self._lock.read():
+            return list(self._ids)
+
+    def get(self, artwork_id):
+        """
+        Get the stored embedding of an artwork
+
+        Args:
+            artwork_id: Artwork id (str or ObjectId)
+
+        Returns:
+            Copy of the float32 embedding or None if not indexed
+        """
+        with self._lock.read():
+            row = self._id_to_row.get(str(artwork_id))
+            if row is None:
+                return None
+            return self._buffer[row].copy()
+
+    def get_metadata(self, artwork_id):
+        """Get the display fields of an indexed artwork or None"""
+        with self._lock.read():
+            row = self._id_to_row.get(str(artwork_id))
+            return None if row is None else self._metadata[row]
+
+    def get_many(self, artwork_ids):
+        """
+        Get the embeddings of several artworks
+
+        Args:
+            artwork_ids: Iterable of artwork ids
+
+        Returns:
+            (found_ids, matrix) for the ids present in the index
+        """
+        with self._lock.read():
+            found = [str(a) for a in artwork_ids if str(a) in self._id_to_row]
+            rows = [self._id_to_row[a] for a in found]
+            return found, self._buffer[rows].copy()
+
+    def upsert(self, artwork_id, embedding, metadata):
+        """
+        Insert or replace a single artwork in place
+
+        Re-applying an unchanged artwork (e.g. a poll that sees the same
+        document again) leaves the index and its version untouched.
+
+        Args:
+            artwork_id: Artwork id (str or ObjectId)
+            embedding: Sequence of floats of length dim
+            metadata: Display fields as returned by artwork_metadata
+
+        Returns:
+            True if the index changed
+        """
+        artwork_id = str(artwork_id)
+        vector = np.asarray(embedding, dtype=np.float32)
+        if vector.shape != (self.dim,):
+            raise ValueError(f"Expected embedding of dimension {self.dim}, got {vector.shape}")
+
+        with self._lock.write():
+            row = self._id_to_row.get(artwork_id)
+            if row is None:
+                row = self._size
+                if row == self._buffer.shape[0]:
+                    self._buffer = self._grow(self._buffer, row + 1)
+                    self._prices = self._grow(self._prices, self._buffer.shape[0])
+                self._ids.append(artwork_id)
+                self._metadata.append(metadata)
+                self._id_to_row[artwork_id] = row
+                self._size += 1
+                vector_changed = True
+            else:
+                vector_changed = not np.array_equal(self._buffer[row], vector)
+                # Postings and price are derived from the metadata
+                if not vector_changed and self._metadata[row] == metadata:
+                    return False
+                self._remove_postings(artwork_id, self._metadata[row])
+                self._metadata[row] = metadata
+            if vector_changed:
+                # Skipping identical writes keeps mapped snapshot pages shared
+                self._buffer[row] = vector
+            self._prices[row] = price_value(metadata)
+            self._add_postings(artwork_id, metadata)
+            self.version += 1
+
+            if self.ann_engine:
+                self._ann_dirty.add(artwork_id)
+                self._schedule_ann_rebuild()
+
+        if vector_changed:
+            self._notify('upsert', artwork_id, vector)
+        return True
+
+    def remove(self, artwork_id):
+        """
+        Remove an artwork from the index
+
+        Args:
+            artwork_id: Artwork id (str or ObjectId)
+
+        Returns:
+            True if the artwork was indexed
+        """
+        artwork_id = str(artwork_id)
+        with self._lock.write():
+            row = self._id_to_row.pop(artwork_id, None)
+            if row is None:
+                return False
+            self._remove_postings(artwork_id, self._metadata[row])
+            last = self._size - 1
+            if row != last:
+                moved_id = self._ids[last]
+                self._buffer[row] = self._buffer[last]
+                self._prices[row] = self._prices[last]
+                self._ids[row] = moved_id
+                self._metadata[row] = self._metadata[last]
+                self._id_to_row[moved_id] = row
+            self._ids.pop()
+            self._metadata.pop()
+            self._size = last
+            self._ann_dirty.discard(artwork_id)
+            self.version += 1
+
+        self._notify('remove', artwork_id, None)
+        return True
+
+    def add_listener(self, listener):
+        """
+        Register a callback for embedding changes
+
+        Args:
+            listener: Function (event, artwork_id, vector) called after an
+                embedding is inserted/changed ('upsert') or removed
+                ('remove'); vector is None for removals
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """Unregister a callback added with add_listener"""
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify(self, event, artwork_id, vector):
+        for listener in self._listeners:
+            try:
+                listener(event, artwork_id, vector)
+            except Exception as e:
+                logger.error(f"Embedding index listener failed: {str(e)}")
+
+    def scores_above(self, query, threshold):
+        """
+        Artworks whose similarity to query exceeds a threshold
+
+        Args:
+            query: Query embedding
+            threshold: Minimum similarity (exclusive)
+
+        Returns:
+            List of (artwork_id, similarity)
+        """
+        query = np.asarray(query, dtype=np.float32)
+        with self._lock.read():
+            scores = self._buffer[:self._size] @ query
+            rows = np.flatnonzero(scores > threshold)
+            return [(self._ids[row], float(scores[row])) for row in rows]
+
+    def lexical_search(self, query, top_k, filters=None):
+        """
+        Rank artworks by title/tag match without using embeddings
+
+        Args:
+            query: Query text
+            top_k: Number of results to return
+            filters: Optional SearchFilter
+
+        Returns:
+            List of (artwork_id, lexical_score, metadata), best first
+        """
+        with self._lock.read():
+            mask = self._filter_mask(filters) if filters is not None else None
+            allowed = None
+            if mask is not None:
+                allowed = lambda artwork_id: artwork_id in self._id_to_row and mask[self._id_to_row[artwork_id]]
+            matches = self.lexical.search(query, int(top_k), allowed)
+            return [
+                (artwork_id, score, self._metadata[self._id_to_row[artwork_id]])
+                for artwork_id, score in matches
+                if artwork_id in self._id_to_row
+            ]
+
+    def score(self, query, artwork_ids):
+        """
+        Similarity of a query embedding to specific artworks
+
+        Returns:
+            Dict artwork_id -> (similarity, metadata) for the indexed ids
+        """
+        query = np.asarray(query, dtype=np.float32)
+        with self._lock.read():
+            rows = [self._id_to_row[a] for a in artwork_ids if a in self._id_to_row]
+            scores = self._buffer[rows] @ query if rows else []
+            return {
+                self._ids[row]: (float(score), self._metadata[row])
+                for row, score in zip(rows, scores)
+            }
+
+    def configure_ann(self, engine, params=None, min_size=20000, oversample=4, rebuild_ratio=0.05):
+        """
+        Enable an approximate nearest-neighbor engine for search
+
+        Args:
+            engine: 'ivf', 'hnsw' or None for exact search only
+            params: Engine keyword arguments (see ann_index)
+            min_size: Below this many rows search stays exact
+            oversample: Candidates fetched per requested result
+            rebuild_ratio: Fraction of rows changed since the last build
+                that triggers a background rebuild
+        """
+        self.ann_engine = engine
+        self.ann_params = params or {}
+        self.ann_min_size = min_size
+        self.ann_oversample = oversample
+        self.ann_rebuild_ratio = rebuild_ratio
+
+    def build_ann(self):
+        """
+        Build the ANN engine from a snapshot of the current rows
+
+        Rows changed while building are tracked separately and searched
+        exactly until the next build.
+        """
+        with self._lock.write():
+            if not self.ann_engine or self._size < max(self.ann_min_size, 1):
+                self._ann = None
+                return
+            ids = list(self._ids)
+            matrix = self._buffer[:self._size].copy()
+            self._ann_dirty = set()
+
+        try:
+            started = datetime.utcnow()
+            ann = build_ann_index(self.ann_engine, ids, matrix, self.ann_params)
+            elapsed = (datetime.utcnow() - started).total_seconds()
+            logger.info(f"✓ Built {self.ann_engine} index over {len(ids)} artworks in {elapsed:.1f}s")
+        except Exception as e:
+            logger.error(f"Failed to build {self.ann_engine} index, using exact search: {str(e)}")
+            ann = None
+
+        with self._lock.write():
+            self._ann = ann
+
+    def ann_stats(self):
+        """Search engine state for /health"""
+        ann = self._ann
+        return {
+            'configured': self.ann_engine or 'exact',
+            'active': ann.name if ann is not None else 'exact',
+            'snapshot_size': ann.size if ann is not None else 0,
+            'pending_changes': len(self._ann_dirty)
+        }
+
+    def _schedule_ann_rebuild(self):
+        """Rebuild the ANN engine in the background once enough rows changed"""
+        if self._ann_building or self._size < max(self.ann_min_size, 1):
+            return
+        if self._ann is not None and len(self._ann_dirty) < self.ann_rebuild_ratio * self._size:
+            return
+        self._ann_building = True
+
+        def rebuild():
+            try:
+                self.build_ann()
+            finally:
+                self._ann_building = False
+
+        threading.Thread(target=rebuild, name='ann-rebuild', daemon=True).start()
+
+    def _ann_candidate_rows(self, query, fetch_k):
+        """Rows proposed by the ANN engine plus rows changed since its build"""
+        candidate_ids = self._ann.candidates(query, fetch_k)
+        rows = {self._id_to_row.get(artwork_id) for artwork_id in candidate_ids}
+        rows.update(self._id_to_row.get(artwork_id) for artwork_id in self._ann_dirty)
+        rows.discard(None)
+        return np.fromiter(rows, dtype=np.int64, count=len(rows))
+
+    def _rows_mask(self, artwork_ids):
+        """Boolean row mask with True for the given artwork ids"""
+        mask = np.zeros(self._size, dtype=bool)
+        rows = [self._id_to_row[a] for a in artwork_ids if a in self._id_to_row]
+        mask[rows] = True
+        return mask
+
+    def _filter_mask(self, filters):
+        """
+        Boolean mask of rows passing a SearchFilter, or None if it has no
+        conditions. Artist and tag conditions cost O(matching artworks),
+        price conditions one vectorized comparison.
+        """
+        n = self._size
+        mask = None
+
+        if filters.min_price is not None or filters.max_price is not None:
+            prices = self._prices[:n]
+            mask = np.ones(n, dtype=bool)
+            if filters.min_price is not None:
+                mask &= prices >= float(filters.min_price)
+            if filters.max_price is not None:
+                mask &= prices <= float(filters.max_price)
+
+        if filters.artist_id is not None:
+            artist_mask = self._rows_mask(self._by_artist.get(str(filters.artist_id), ()))
+            mask = artist_mask if mask is None else mask & artist_mask
+
+        if filters.tags:
+            tagged = set()
+            for tag in filters.tags:
+                tagged |= self._by_tag.get(normalize_tag(tag), set())
+            tag_mask = self._rows_mask(tagged)
+            mask = tag_mask if mask is None else mask & tag_mask
+
+        excluded = [
+            self._id_to_row[str(artwork_id)]
+            for artwork_id in filters.exclude_ids
+            if str(artwork_id) in self._id_to_row
+        ]
+        if filters.exclude_artist is not None:
+            excluded += [
+                self._id_to_row[artwork_id]
+                for artwork_id in self._by_artist.get(str(filters.exclude_artist), ())
+            ]
+        if excluded:
+            if mask is None:
+                mask = np.ones(n, dtype=bool)
+            mask[excluded] = False
+
+        return mask
+
+    def search(self, query, top_k, filters=None, exact=False):
+        """
+        Find the rows most similar to a query embedding
+
+        Filters are applied as a boolean mask before the top-k selection.
+        With an ANN engine configured, candidates proposed by the engine
+        (over-fetched in proportion to the filter selectivity) are masked
+        and re-scored exactly; if too few survive, the query falls back to
+        an exact scan of the rows passing the filter.
+
+        Args:
+            query: Query embedding (sequence of floats)
+            top_k: Number of results to return
+            filters: Optional SearchFilter
+            exact: Force exact search even if an ANN engine is available
+
+        Returns:
+            (results, total_compared, engine) where results is a list of
+            (artwork_id, similarity, metadata) sorted by similarity and
+            engine is 'exact' or the name of the ANN engine used
+        """
+        query = np.asarray(query, dtype=np.float32)
+        top_k = int(top_k)
+
+        with self._lock.read():
+            if self._size == 0 or top_k <= 0:
+                return [], 0, 'exact'
+
+            mask = self._filter_mask(filters) if filters is not None else None
+            allowed = self._size if mask is None else int(mask.sum())
+            if allowed == 0:
+                return [], 0, 'exact'
+
+            engine = 'exact'
+            rows = None
+
+            if self._ann is not None and not exact:
+                fetch_k = int(np.ceil(top_k * self.ann_oversample * self._size / allowed))
+                if fetch_k < self._size // 2:
+                    rows = self._ann_candidate_rows(query, fetch_k)
+                    if mask is not None:
+                        rows = rows[mask[rows]]
+                    if len(rows) >= min(top_k, allowed):
+                        engine = self._ann.name
+                    else:
+                        rows = None
+
+            if rows is None and mask is not None and allowed < self._size // 4:
+                # Selective filter: only score the rows that pass it
+                rows = np.flatnonzero(mask)
+
+            if rows is None:
+                scores = self._buffer[:self._size] @ query
+                if mask is not None:
+                    scores[~mask] = -np.inf
+                total_compared = allowed
+            else:
+                scores = self._buffer[rows] @ query
+                total_compared = len(rows)
+
+            k = min(top_k, total_compared)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind='stable')]
+
+            results = []
+            for position in top:
+                row = position if rows is None else rows[position]
+                results.append((self._ids[row], float(scores[position]), self._metadata[row]))
+
+        return results, total_compared, engine
+
+    def search_batch(self, queries, top_k, filters=None, block_bytes=64 * 1024 * 1024):
+        """
+        Answer many queries with one matrix-matrix product
+
+        Queries are scored in blocks so the (queries x rows) score matrix
+        stays under block_bytes, then reduced with a row-wise top-k.
+        Always exact.
+
+        Args:
+            queries: (m x dim) query embeddings
+            top_k: Number of results per query
+            filters: Optional list of SearchFilter (or None), one per query
+            block_bytes: Memory budget of one block of scores
+
+        Returns:
+            List of (results, total_compared), one per query, where results
+            is a list of (artwork_id, similarity, metadata)
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        top_k = int(top_k)
+        m = queries.shape[0]
+
+        with self._lock.read():
+            n = self._size
+            if n == 0 or top_k <= 0:
+                return [([], 0) for _ in range(m)]
+
+            block = max(1, block_bytes // (n * 4))
+            output = []
+
+            for start in range(0, m, block):
+                scores = queries[start:start + block] @ self._buffer[:n].T
+                allowed = np.full(scores.shape[0], n)
+
+                for i in range(scores.shape[0]):
+                    query_filter = filters[start + i] if filters else None
+                    mask = self._filter_mask(query_filter) if query_filter is not None else None
+                    if mask is not None:
+                        scores[i, ~mask] = -np.inf
+                        allowed[i] = int(mask.sum())
+
+                k = min(top_k, n)
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                top_scores = np.take_along_axis(scores, top, axis=1)
+                order = np.argsort(-top_scores, axis=1, kind='stable')
+                top = np.take_along_axis(top, order, axis=1)
+                top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+                for i in range(scores.shape[0]):
+                    count = min(k, int(allowed[i]))
+                    results = [
+                        (self._ids[row], float(score), self._metadata[row])
+                        for row, score in zip(top[i, :count], top_scores[i, :count])
+                    ]
+                    output.append((results, int(allowed[i])))
+
+        return output
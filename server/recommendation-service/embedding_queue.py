@@ -0,0 +1,363 @@
+"""
+Durable queue of per-artwork embedding jobs
+
+Uploads used to trigger a synchronous /generate-embedding call; if the
+service was cold or busy the embedding was lost until someone ran a manual
+backfill. Jobs now live in the embedding_jobs collection, one document per
+artwork (_id = artwork id), so re-enqueueing an artwork replaces its job
+instead of duplicating it:
+
+    pending --claim--> processing --ok--> done (expires after retention)
+       ^                   |
+       +---- backoff ------+--- permanent error / max attempts ---> dead
+
+The Node server writes jobs directly to the collection, so uploads are not
+lost while this service is down, and a periodic sweep enqueues any artwork
+that still has no embedding. Every worker process drains the queue;
+claims are atomic and carry a lease, so a job held by a crashed worker is
+picked up again once its lease expires.
+"""
+
+import os
+import random
+import socket
+import threading
+import logging
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+JOB_PENDING = 'pending'
+JOB_PROCESSING = 'processing'
+JOB_DONE = 'done'
+JOB_DEAD = 'dead'
+
+JOB_STATUSES = (JOB_PENDING, JOB_PROCESSING, JOB_DONE, JOB_DEAD)
+
+# Expires completed jobs after retention_days
+TTL_INDEX = 'completed_at_ttl'
+
+
+class JobFailure:
+    """
+    Outcome of a failed job
+
+    Args:
+        error: Error message stored on the job
+        permanent: Dead-letter immediately instead of retrying
+    """
+
+    def __init__(self, error, permanent=False):
+        self.error = error
+        self.permanent = permanent
+
+
+def enqueue_update(image_url, now):
+    """Upsert that (re)queues an artwork's job, resetting its attempts"""
+    return {
+        '$set': {
+            'status': JOB_PENDING,
+            'image_url': image_url,
+            'attempts': 0,
+            'next_attempt_at': now,
+            'updated_at': now
+        },
+        '$setOnInsert': {'created_at': now},
+        '$unset': {'claim_token': '', 'lease_until': '', 'owner': '', 'last_error': '', 'completed_at': ''}
+    }
+
+
+class EmbeddingQueue:
+    """
+    Drains embedding_jobs in batches in a daemon thread
+
+    Args:
+        jobs: pymongo collection of job documents
+        artworks: pymongo collection of artworks
+        process: Function list_of_jobs -> {artwork_id: None or JobFailure}
+        batch_size: Jobs claimed per batch
+        poll_interval: Seconds between checks for due jobs
+        lease_seconds: Claim duration after which a job is retried
+        max_attempts: Attempts before a job is dead-lettered
+        backoff_seconds: Delay before the first retry; doubles per attempt
+        backoff_max_seconds: Upper bound of the retry delay
+        sweep_interval: Seconds between scans for artworks without an
+            embedding (0 disables)
+        retention_days: Days completed jobs are kept
+    """
+
+    def __init__(self, jobs, artworks, process, batch_size=16, poll_interval=5, lease_seconds=300,
+                 max_attempts=6, backoff_seconds=30, backoff_max_seconds=3600, sweep_interval=300,
+                 retention_days=7):
+        self.jobs = jobs
+        self.artworks = artworks
+        self.process = process
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.sweep_interval = sweep_interval
+        self.retention_days = retention_days
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.completed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.swept = 0
+        self._last_sweep = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Create indexes and start the drain thread"""
+        self.jobs.create_index([('status', 1), ('next_attempt_at', 1)])
+        self.jobs.create_index([('status', 1), ('lease_until', 1)])
+        self._ensure_ttl_index()
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='embedding-queue', daemon=True)
+        self._thread.start()
+
+    def _ensure_ttl_index(self):
+        """
+        Expire completed jobs after retention_days
+
+        An existing TTL index is changed in place with collMod when the
+        retention changed; create_index would fail with a conflict. Errors
+        are logged so the queue still starts (completed jobs then keep the
+        previous retention).
+        """
+        seconds = int(self.retention_days * 86400)
+        try:
+            for name, spec in self.jobs.index_information().items():
+                if spec['key'] == [('completed_at', 1)]:
+                    if spec.get('expireAfterSeconds') != seconds:
+                        self.jobs.database.command({
+                            'collMod': self.jobs.name,
+                            'index': {'name': name, 'expireAfterSeconds': seconds}
+                        })
+                        logger.info(f"Completed embedding jobs now expire after {self.retention_days} days")
+                    return
+            self.jobs.create_index('completed_at', name=TTL_INDEX, expireAfterSeconds=seconds)
+        except PyMongoError as e:
+            logger.error(f"Could not set the embedding job retention: {str(e)}")
+
+    def stop(self):
+        """Signal the drain thread to exit after the current batch"""
+        self._stop.set()
+        self._wake.set()
+
+    def enqueue(self, artwork_id, image_url):
+        """
+        Queue (or requeue) the embedding of an artwork
+
+        Returns:
+            Job document
+
+        Raises:
+            ValueError: If artwork_id is not a valid ObjectId
+        """
+        if not ObjectId.is_valid(artwork_id):
+            raise ValueError(f"Invalid artwork id: {artwork_id}")
+        now = datetime.utcnow()
+        job = self.jobs.find_one_and_update(
+            {'_id': ObjectId(artwork_id)},
+            enqueue_update(image_url, now),
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self.notify()
+        return job
+
+    def find(self, artwork_id):
+        """Job document of an artwork, or None"""
+        if not ObjectId.is_valid(artwork_id):
+            return None
+        return self.jobs.find_one({'_id': ObjectId(artwork_id)})
+
+    def notify(self):
+        """Wake the drain thread, e.g. after a job was written elsewhere"""
+        self._wake.set()
+
+    def retry_dead(self):
+        """
+        Requeue every dead-lettered job
+
+        Returns:
+            Number of jobs requeued
+        """
+        now = datetime.utcnow()
+        result = self.jobs.update_many(
+            {'status': JOB_DEAD},
+            {'$set': {'status': JOB_PENDING, 'attempts': 0, 'next_attempt_at': now, 'updated_at': now}}
+        )
+        self.notify()
+        return result.modified_count
+
+    def sweep(self, limit=1000):
+        """
+        Enqueue artworks that have no embedding and no job yet
+
+        Existing jobs (including dead ones) are left untouched.
+
+        Returns:
+            Number of jobs created
+        """
+        now = datetime.utcnow()
+        artworks = list(self.artworks.find(
+            {'clip_embedding': {'$exists': False}, 'image': {'$nin': [None, '']}},
+            {'image': 1}
+        ).limit(limit))
+        if not artworks:
+            return 0
+        operations = [
+            UpdateOne(
+                {'_id': artwork['_id']},
+                {'$setOnInsert': {
+                    'status': JOB_PENDING,
+                    'image_url': artwork['image'],
+                    'attempts': 0,
+                    'next_attempt_at': now,
+                    'created_at': now,
+                    'updated_at': now
+                }},
+                upsert=True
+            )
+            for artwork in artworks
+        ]
+        created = self.jobs.bulk_write(operations, ordered=False).upserted_count
+        if created:
+            self.swept += created
+            logger.info(f"Queued embeddings for {created} artworks without one")
+        return created
+
+    def _claim(self):
+        """Atomically claim one due or orphaned job"""
+        now = datetime.utcnow()
+        return self.jobs.find_one_and_update(
+            {
+                '$or': [
+                    {'status': JOB_PENDING, 'next_attempt_at': {'$lte': now}},
+                    {'status': JOB_PROCESSING, 'lease_until': {'$lt': now}}
+                ]
+            },
+            {
+                '$set': {
+                    'status': JOB_PROCESSING,
+                    'owner': self.owner,
+                    'claim_token': ObjectId(),
+                    'lease_until': now + timedelta(seconds=self.lease_seconds),
+                    'updated_at': now
+                },
+                # Counted at claim time so crashes mid-job count as attempts
+                '$inc': {'attempts': 1}
+            },
+            sort=[('next_attempt_at', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _claim_batch(self):
+        batch = []
+        while len(batch) < self.batch_size:
+            job = self._claim()
+            if job is None:
+                break
+            batch.append(job)
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._maybe_sweep()
+                batch = self._claim_batch()
+            except PyMongoError as e:
+                logger.error(f"Error claiming embedding jobs: {str(e)}")
+                batch = []
+
+            if not batch:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+
+            try:
+                outcomes = self.process(batch)
+            except Exception as e:
+                logger.error(f"Embedding batch of {len(batch)} jobs failed: {str(e)}")
+                outcomes = {job['_id']: JobFailure(str(e)) for job in batch}
+
+            try:
+                self._record(batch, outcomes)
+            except PyMongoError as e:
+                # Leases expire and the jobs are retried
+                logger.error(f"Error recording embedding job results: {str(e)}")
+
+    def _maybe_sweep(self):
+        if not self.sweep_interval:
+            return
+        now = datetime.utcnow()
+        if self._last_sweep and (now - self._last_sweep).total_seconds() < self.sweep_interval:
+            return
+        self._last_sweep = now
+        self.sweep()
+
+    def _backoff(self, attempts):
+        delay = min(self.backoff_max_seconds, self.backoff_seconds * 2 ** (attempts - 1))
+        # Jitter spreads retries of jobs that failed together
+        return delay * random.uniform(0.8, 1.2)
+
+    def _record(self, batch, outcomes):
+        """Store each job's outcome unless it was requeued meanwhile"""
+        now = datetime.utcnow()
+        operations = []
+        for job in batch:
+            outcome = outcomes.get(job['_id'], JobFailure('No result for job'))
+            # A requeue (new upload) replaces the claim token; leave that job alone
+            owned = {'_id': job['_id'], 'claim_token': job['claim_token']}
+            unclaim = {'claim_token': '', 'lease_until': '', 'owner': ''}
+
+            if outcome is None:
+                operations.append(UpdateOne(owned, {
+                    '$set': {'status': JOB_DONE, 'completed_at': now, 'updated_at': now},
+                    '$unset': {**unclaim, 'last_error': ''}
+                }))
+                self.completed += 1
+            elif outcome.permanent or job['attempts'] >= self.max_attempts:
+                operations.append(UpdateOne(owned, {
+                    '$set': {'status': JOB_DEAD, 'last_error': outcome.error, 'dead_at': now, 'updated_at': now},
+                    '$unset': unclaim
+                }))
+                self.dead_lettered += 1
+                logger.error(f"Embedding job {job['_id']} dead-lettered after {job['attempts']} attempts: {outcome.error}")
+            else:
+                retry_at = now + timedelta(seconds=self._backoff(job['attempts']))
+                operations.append(UpdateOne(owned, {
+                    '$set': {'status': JOB_PENDING, 'last_error': outcome.error, 'next_attempt_at': retry_at, 'updated_at': now},
+                    '$unset': unclaim
+                }))
+                self.retried += 1
+        if operations:
+            self.jobs.bulk_write(operations, ordered=False)
+
+    def counts(self):
+        """Number of jobs per status"""
+        counts = {status: 0 for status in JOB_STATUSES}
+        for row in self.jobs.aggregate([{'$group': {'_id': '$status', 'count': {'$sum': 1}}}]):
+            counts[row['_id']] = row['count']
+        return counts
+
+    def stats(self):
+        """Drain counters of this process for /health"""
+        return {
+            'completed': self.completed,
+            'retried': self.retried,
+            'dead_lettered': self.dead_lettered,
+            'swept': self.swept,
+            'batch_size': self.batch_size,
+            'max_attempts': self.max_attempts
+        }
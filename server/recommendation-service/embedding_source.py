@@ -0,0 +1,84 @@
+"""
+Provenance of stored embeddings
+
+Every clip_embedding is written together with an embedding_source
+sub-document describing the inputs it was computed from:
+
+    {
+        'image_url': 'https://...',
+        'content_hash': sha256 of the downloaded image bytes,
+        'etag': ETag response header (or None),
+        'last_modified': Last-Modified response header (or None),
+        'model': model and tower variant, e.g. '<MODEL_NAME>:int8/eager',
+        'preprocess_version': PREPROCESS_VERSION
+    }
+
+A forced re-index compares it with the current model and image instead of
+re-embedding everything: a conditional GET answered with 304, or a body
+with the same content hash, means the stored embedding is still valid and
+the model is not run. The model includes the tower precision and execution
+mode, so switching INFERENCE_PRECISION or INFERENCE_MODE recomputes every
+embedding. Embeddings written before this existed carry no source (or a
+model without a variant) and are recomputed once.
+"""
+
+import hashlib
+
+# Bump whenever image preprocessing changes (RGB conversion, resize/crop,
+# normalization) so embeddings computed the old way are recomputed
+PREPROCESS_VERSION = 1
+
+
+def content_hash(content):
+    """sha256 hex digest of image bytes"""
+    return hashlib.sha256(content).hexdigest()
+
+
+def build_source(image_url, content, headers, model_name, preprocess_version=PREPROCESS_VERSION):
+    """
+    Describe the inputs of an embedding computed from a downloaded image
+
+    Args:
+        image_url: URL the image was downloaded from
+        content: Image bytes
+        headers: Response headers (validators for later conditional requests)
+        model_name: Model and tower variant the embedding is computed with
+        preprocess_version: Preprocessing version
+
+    Returns:
+        embedding_source dict
+    """
+    return {
+        'image_url': image_url,
+        'content_hash': content_hash(content),
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+        'model': model_name,
+        'preprocess_version': preprocess_version
+    }
+
+
+def is_current(source, model_name, preprocess_version=PREPROCESS_VERSION):
+    """Whether an embedding with this source was computed the current way"""
+    return (
+        bool(source)
+        and source.get('model') == model_name
+        and source.get('preprocess_version') == preprocess_version
+        and bool(source.get('content_hash'))
+    )
+
+
+def conditional_headers(source, image_url):
+    """
+    Request headers that let the server answer 304 if the image is unchanged
+
+    Validators are only sent for the URL they were received from.
+    """
+    if not source or source.get('image_url') != image_url:
+        return {}
+    headers = {}
+    if source.get('etag'):
+        headers['If-None-Match'] = source['etag']
+    if source.get('last_modified'):
+        headers['If-Modified-Since'] = source['last_modified']
+    return headers
@@ -0,0 +1,62 @@
+"""
+Compact storage format for CLIP embeddings in MongoDB
+
+Embeddings were historically stored as BSON arrays of 512 doubles
+(~4.6 KB per artwork once BSON per-element overhead is included). This module
+packs them into a single BSON Binary value of little-endian float32
+(2 KB) or float16 (1 KB) and transparently reads back either format.
+"""
+
+import numpy as np
+from bson.binary import Binary
+
+# BSON user-defined binary subtypes identifying the packed element type
+SUBTYPE_FLOAT32 = 0x80
+SUBTYPE_FLOAT16 = 0x81
+
+STORAGE_FORMATS = ('array', 'float32', 'float16')
+
+_DTYPES = {
+    SUBTYPE_FLOAT32: np.dtype('<f4'),
+    SUBTYPE_FLOAT16: np.dtype('<f2')
+}
+
+
+def encode_embedding(embedding, storage='array'):
+    """
+    Encode an embedding for storage in MongoDB
+
+    Args:
+        embedding: Sequence of floats or numpy array
+        storage: 'array' (legacy list of doubles), 'float32' or 'float16'
+
+    Returns:
+        List of floats or bson.Binary
+    """
+    if storage == 'array':
+        return np.asarray(embedding, dtype=np.float64).tolist()
+    if storage == 'float32':
+        return Binary(np.asarray(embedding, dtype='<f4').tobytes(), SUBTYPE_FLOAT32)
+    if storage == 'float16':
+        return Binary(np.asarray(embedding, dtype='<f2').tobytes(), SUBTYPE_FLOAT16)
+    raise ValueError(f"Unknown embedding storage format: {storage}")
+
+
+def decode_embedding(value):
+    """
+    Decode a stored embedding in any supported format
+
+    Args:
+        value: BSON array of numbers or bson.Binary from encode_embedding
+
+    Returns:
+        float32 numpy array, or None if value is missing or unrecognised
+    """
+    if value is None:
+        return None
+    if isinstance(value, (bytes, Binary)):
+        dtype = _DTYPES.get(getattr(value, 'subtype', None))
+        if dtype is None:
+            return None
+        return np.frombuffer(value, dtype=dtype).astype(np.float32)
+    return np.asarray(value, dtype=np.float32)
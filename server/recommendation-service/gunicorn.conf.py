@@ -0,0 +1,66 @@
+"""
+Gunicorn configuration for the recommendation service
+
+The app is preloaded: the master imports recommendation_service, which
+loads and converts the CLIP weights once (SERVICE_PRELOAD). Forked workers
+share those read-only pages copy-on-write instead of each holding a
+private ~600MB copy.
+
+Nothing runs a forward pass before fork, since torch's thread pools do not
+survive it. Each worker calls start_worker_services, from post_fork below
+or, when served without this file, on its first request. That sizes the
+thread pools, traces the TorchScript towers, runs the precision self-check
+and opens the worker's own MongoDB client, index and background threads.
+Until a worker is ready, /health/ready returns 503 and other requests are
+rejected with 503.
+
+With INFERENCE_SERVER_ADDRESS set, the model lives in separate
+inference_server.py processes instead (one per socket path), which the
+master starts on startup unless INFERENCE_SERVER_SPAWN=false, e.g. when
+the inference tier is deployed on its own. Spawned servers and the workers
+share a random INFERENCE_SERVER_AUTHKEY through the environment unless one
+is configured; a separately deployed tier needs it set on both sides.
+"""
+
+import os
+import sys
+import secrets
+import subprocess
+
+os.environ.setdefault('SERVICE_PRELOAD', 'true')
+
+# Set before the app is preloaded so workers and spawned servers agree
+if os.getenv('INFERENCE_SERVER_ADDRESS', '').strip() and os.getenv('INFERENCE_SERVER_SPAWN', 'true').lower() == 'true':
+    os.environ.setdefault('INFERENCE_SERVER_AUTHKEY', secrets.token_hex(32))
+
+bind = f"0.0.0.0:{os.getenv('PORT', '7860')}"
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+# Threads let concurrent requests share micro-batched forward passes
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+timeout = 300
+preload_app = True
+
+
+inference_processes = []
+
+
+def on_starting(server):
+    addresses = [a.strip() for a in os.getenv('INFERENCE_SERVER_ADDRESS', '').split(',') if a.strip()]
+    if not addresses or os.getenv('INFERENCE_SERVER_SPAWN', 'true').lower() != 'true':
+        return
+    for address in addresses:
+        inference_processes.append(subprocess.Popen(
+            [sys.executable, 'inference_server.py', address],
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ))
+    server.log.info(f"Started {len(addresses)} inference server process(es)")
+
+
+def on_exit(server):
+    for process in inference_processes:
+        process.terminate()
+
+
+def post_fork(server, worker):
+    import recommendation_service
+    recommendation_service.start_worker_services()
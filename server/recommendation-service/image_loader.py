@@ -0,0 +1,87 @@
+"""
+Image download helpers for the Artscape recommendation service
+
+Provides a pooled keep-alive HTTP session, so repeated Cloudinary fetches
+reuse TCP/TLS connections, and a bounded prefetch stage that downloads and
+decodes images on a thread pool ahead of the inference step.
+"""
+
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+def create_http_session(pool_size=16, retries=2):
+    """
+    Create a requests session with a shared connection pool
+
+    Args:
+        pool_size: Maximum number of kept-alive connections per host
+        retries: Retries for connection errors and 5xx responses
+
+    Returns:
+        requests.Session
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.3,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD'])
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def prefetch_images(items, load, workers=8, max_pending=64):
+    """
+    Load images for items on a thread pool, ahead of the consumer
+
+    At most max_pending downloads are queued or held at any time, so memory
+    stays bounded while the consumer (e.g. batched inference) runs in
+    parallel with the next downloads. Results are yielded in input order.
+
+    Args:
+        items: Iterable of items to load
+        load: Function item -> result, e.g. the (status, image, source)
+            tuple of load_image_from_url
+        workers: Number of download threads
+        max_pending: Maximum number of in-flight or unconsumed loads
+
+    Yields:
+        (item, result) tuples; result is None if load raised
+    """
+    max_pending = max(max_pending, workers, 1)
+    items = iter(items)
+    pending = deque()
+
+    def wait(future):
+        try:
+            return future.result()
+        except Exception as e:
+            logger.error(f"Error prefetching image: {str(e)}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-prefetch') as executor:
+        try:
+            for item in items:
+                pending.append((item, executor.submit(load, item)))
+                if len(pending) >= max_pending:
+                    item, future = pending.popleft()
+                    yield item, wait(future)
+
+            while pending:
+                item, future = pending.popleft()
+                yield item, wait(future)
+        finally:
+            # Consumer stopped early: drop queued downloads
+            for _, future in pending:
+                future.cancel()
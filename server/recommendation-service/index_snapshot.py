@@ -0,0 +1,294 @@
+"""
+Host-shared, memory-mapped snapshots of the embedding index
+
+With several gunicorn workers every process used to hold (and load from
+MongoDB) its own copy of the embedding matrix. Snapshots let all workers on
+a host map one file instead:
+
+    <directory>/
+        CURRENT                    name of the published version
+        publisher.lock             flock held by the publishing worker
+        versions/<version>/
+            embeddings.npy         float32 (capacity x dim), rows past size are spare
+            sidecar.json           ids, metadata, size, watermark, model
+
+One worker holds publisher.lock. When its index changed it exports the rows,
+writes a new version directory and atomically replaces CURRENT (write to a
+temp file + os.replace), then maps the new file itself. Every other worker
+polls CURRENT and remaps when it changes, then re-applies writes newer than
+the snapshot's watermark. Files are mapped copy-on-write, so untouched pages
+are shared through the page cache and only rows a worker modifies before
+the next remap become private.
+"""
+
+import os
+import json
+import fcntl
+import shutil
+import threading
+import logging
+from datetime import datetime, timedelta
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = 'CURRENT'
+LOCK_FILE = 'publisher.lock'
+VERSIONS_DIR = 'versions'
+
+# Versions kept on disk: the current one and its predecessor, which
+# workers may still be switching away from
+KEEP_VERSIONS = 2
+
+
+class IndexSnapshot:
+    """A mapped snapshot version"""
+
+    def __init__(self, version, buffer, size, ids, metadata, watermark):
+        self.version = version
+        self.buffer = buffer
+        self.size = size
+        self.ids = ids
+        self.metadata = metadata
+        self.watermark = watermark
+
+
+def write_snapshot(directory, ids, matrix, metadata, watermark, model_name, headroom=0.25):
+    """
+    Write a snapshot version and publish it as CURRENT
+
+    Args:
+        directory: Snapshot root directory
+        ids: Artwork ids, one per row
+        matrix: float32 (N x dim) embeddings
+        metadata: Display fields, one dict per row
+        watermark: Writes at or after this time may be missing
+        model_name: Model the embeddings come from
+        headroom: Spare rows (fraction of N) so inserts rarely reallocate
+
+    Returns:
+        Version name
+    """
+    size, dim = matrix.shape
+    version = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{os.getpid()}"
+    path = os.path.join(directory, VERSIONS_DIR, version)
+    os.makedirs(path)
+
+    capacity = size + max(16, int(size * headroom))
+    embeddings = np.lib.format.open_memmap(
+        os.path.join(path, 'embeddings.npy'), mode='w+', dtype=np.float32, shape=(capacity, dim)
+    )
+    embeddings[:size] = matrix
+    embeddings.flush()
+    del embeddings
+
+    with open(os.path.join(path, 'sidecar.json'), 'w') as f:
+        json.dump({
+            'size': size,
+            'dim': dim,
+            'model': model_name,
+            'watermark': watermark.isoformat(),
+            'ids': ids,
+            'metadata': metadata
+        }, f, default=str)
+
+    tmp_path = os.path.join(directory, f"{CURRENT_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(directory, CURRENT_FILE))
+    return version
+
+
+def current_version(directory):
+    """Name of the published version or None"""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def open_snapshot(directory, version, model_name, dim):
+    """
+    Map a snapshot version copy-on-write
+
+    Returns:
+        IndexSnapshot, or None if it was built by another model or dimension
+    """
+    path = os.path.join(directory, VERSIONS_DIR, version)
+    with open(os.path.join(path, 'sidecar.json')) as f:
+        sidecar = json.load(f)
+    if sidecar['model'] != model_name or sidecar['dim'] != dim:
+        return None
+    buffer = np.load(os.path.join(path, 'embeddings.npy'), mmap_mode='c')
+    return IndexSnapshot(
+        version,
+        buffer,
+        sidecar['size'],
+        sidecar['ids'],
+        sidecar['metadata'],
+        datetime.fromisoformat(sidecar['watermark'])
+    )
+
+
+class IndexSnapshotManager:
+    """
+    Publishes and follows index snapshots shared by the workers of a host
+
+    Args:
+        index: EmbeddingIndex to publish from / map into
+        directory: Snapshot root (ideally on tmpfs, e.g. /dev/shm)
+        model_name: Model the embeddings come from
+        publish_interval: Minimum seconds between published versions
+        poll_interval: Seconds between checks for a new version
+        watermark_slack: Seconds subtracted from the export time to cover
+            writes the publisher had not applied yet
+        on_remap: Function watermark -> None called after remapping, used
+            to re-apply writes newer than the snapshot
+    """
+
+    def __init__(self, index, directory, model_name, publish_interval=30, poll_interval=2,
+                 watermark_slack=60, on_remap=None):
+        self.index = index
+        self.directory = directory
+        self.model_name = model_name
+        self.publish_interval = publish_interval
+        self.poll_interval = poll_interval
+        self.watermark_slack = watermark_slack
+        self.on_remap = on_remap
+        self.mapped_version = None
+        self.published = 0
+        self.remaps = 0
+        self._lock_file = None
+        self._published_index_version = None
+        self._last_publish = None
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(os.path.join(directory, VERSIONS_DIR), exist_ok=True)
+
+    @property
+    def is_publisher(self):
+        return self._lock_file is not None
+
+    def load_current(self):
+        """
+        Map the published snapshot into the index, if there is a usable one
+
+        Returns:
+            True if the index was loaded from a snapshot
+        """
+        version = current_version(self.directory)
+        if version is None:
+            return False
+        try:
+            snapshot = open_snapshot(self.directory, version, self.model_name, self.index.dim)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not open index snapshot {version}: {str(e)}")
+            return False
+        if snapshot is None:
+            logger.info("Index snapshot was built by another model, ignoring it")
+            return False
+        self.index.load_snapshot(snapshot)
+        self.mapped_version = version
+        return True
+
+    def start(self):
+        """Start publishing/following in a daemon thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='index-snapshots', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the thread and give up the publisher role"""
+        self._stop.set()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _try_become_publisher(self):
+        if self._lock_file is not None:
+            return True
+        lock_file = open(os.path.join(self.directory, LOCK_FILE), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        logger.info(f"✓ Process {os.getpid()} publishes index snapshots")
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._try_become_publisher():
+                    self._maybe_publish()
+                else:
+                    self._maybe_remap()
+            except Exception as e:
+                logger.error(f"Index snapshot error: {str(e)}")
+            self._stop.wait(self.poll_interval)
+
+    def _maybe_publish(self):
+        if self.index.version == self._published_index_version:
+            return
+        now = datetime.utcnow()
+        if self._last_publish and (now - self._last_publish).total_seconds() < self.publish_interval:
+            return
+        self.publish()
+
+    def publish(self):
+        """Write the current rows as a new version and switch to it"""
+        started_at = datetime.utcnow()
+        watermark = started_at - timedelta(seconds=self.watermark_slack)
+        ids, matrix, metadata, index_version = self.index.export()
+
+        version = write_snapshot(self.directory, ids, matrix, metadata, watermark, self.model_name)
+        self._last_publish = started_at
+        self._published_index_version = index_version
+        self.published += 1
+
+        # Map our own snapshot so this process shares the pages as well
+        snapshot = open_snapshot(self.directory, version, self.model_name, self.index.dim)
+        if self.index.adopt_snapshot(snapshot, index_version):
+            self.mapped_version = version
+
+        self._cleanup()
+        elapsed = (datetime.utcnow() - started_at).total_seconds()
+        logger.info(f"✓ Published index snapshot {version}: {len(ids)} artworks in {elapsed:.2f}s")
+
+    def _maybe_remap(self):
+        version = current_version(self.directory)
+        if version is None or version == self.mapped_version:
+            return
+        snapshot = open_snapshot(self.directory, version, self.model_name, self.index.dim)
+        if snapshot is None:
+            return
+        self.index.load_snapshot(snapshot)
+        self.mapped_version = version
+        self.remaps += 1
+        if self.on_remap:
+            self.on_remap(snapshot.watermark)
+
+    def _cleanup(self):
+        """Delete all but the newest KEEP_VERSIONS versions"""
+        versions_dir = os.path.join(self.directory, VERSIONS_DIR)
+        # Version names start with a sortable timestamp
+        versions = sorted(os.listdir(versions_dir))
+        for version in versions[:-KEEP_VERSIONS]:
+            # Processes still mapping an old file keep it alive until they remap
+            shutil.rmtree(os.path.join(versions_dir, version), ignore_errors=True)
+
+    def stats(self):
+        """Snapshot state for /health"""
+        return {
+            'directory': self.directory,
+            'role': 'publisher' if self.is_publisher else 'follower',
+            'mapped_version': self.mapped_version,
+            'published': self.published,
+            'remaps': self.remaps
+        }
@@ -0,0 +1,204 @@
+"""
+Background maintenance of the in-memory embedding index
+
+Tails a MongoDB change stream on the artworks collection and applies
+inserts, embedding updates and deletes to the resident EmbeddingIndex in
+place, so every worker sees writes made by other workers without reloading
+the whole matrix. Falls back to polling on embedding_updated_at when change
+streams are unavailable (e.g. a standalone mongod).
+"""
+
+import threading
+import logging
+from pymongo.errors import OperationFailure, PyMongoError
+from embedding_index import artwork_metadata, METADATA_PROJECTION
+from embedding_storage import decode_embedding
+
+logger = logging.getLogger(__name__)
+
+# Server error codes meaning change streams cannot be used on this deployment
+CHANGE_STREAM_UNSUPPORTED_CODES = {40573, 40324, 136}
+
+# Fields whose change requires the index row to be refreshed
+WATCHED_FIELDS = ('clip_embedding',) + tuple(METADATA_PROJECTION)
+
+
+class IndexWatcher:
+    """
+    Keeps an EmbeddingIndex in sync with the artworks collection
+
+    Args:
+        index: EmbeddingIndex to maintain
+        collection: pymongo collection of artworks
+        poll_interval: Seconds between polls in fallback mode
+        reconcile_every: Polls between deleted-artwork reconciliations
+    """
+
+    def __init__(self, index, collection, poll_interval=10, reconcile_every=30):
+        self.index = index
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self.reconcile_every = reconcile_every
+        self.mode = None
+        self.applied = 0
+        self._resume_token = None
+        self._last_seen = None
+        # Tie-break between artworks written at the same embedding_updated_at
+        self._last_seen_id = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start watching in a daemon thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._last_seen = self.index.loaded_at
+        self._last_seen_id = None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='index-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Signal the watcher thread to exit"""
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._watch_change_stream()
+            except OperationFailure as e:
+                if e.code in CHANGE_STREAM_UNSUPPORTED_CODES or 'replica set' in str(e):
+                    logger.info("Change streams unavailable, polling embedding_updated_at instead")
+                    self._poll()
+                    return
+                logger.error(f"Index watcher error: {str(e)}")
+                self._stop.wait(self.poll_interval)
+            except PyMongoError as e:
+                logger.error(f"Index watcher error: {str(e)}")
+                self._stop.wait(self.poll_interval)
+
+    def _watch_change_stream(self):
+        """Apply change stream events until stopped"""
+        pipeline = [{'$match': {'operationType': {'$in': ['insert', 'update', 'replace', 'delete']}}}]
+        with self.collection.watch(
+            pipeline,
+            full_document='updateLookup',
+            resume_after=self._resume_token,
+            max_await_time_ms=1000
+        ) as stream:
+            if self._resume_token is None:
+                # Catch up on writes made before the stream was opened
+                self._catch_up()
+            self.mode = 'change_stream'
+            logger.info("✓ Index watcher tailing artworks change stream")
+
+            while not self._stop.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is None:
+                    continue
+                self._apply_change(change)
+                self._resume_token = stream.resume_token
+
+    def _apply_change(self, change):
+        """Apply a single change stream event to the index"""
+        operation = change['operationType']
+        artwork_id = change['documentKey']['_id']
+
+        if operation == 'delete':
+            if self.index.remove(artwork_id):
+                self.applied += 1
+            return
+
+        if operation == 'update':
+            description = change.get('updateDescription', {})
+            changed = set(description.get('updatedFields', {})) | set(description.get('removedFields', []))
+            if not any(field.split('.')[0] in WATCHED_FIELDS for field in changed):
+                return
+
+        self._apply_document(artwork_id, change.get('fullDocument'))
+
+    def _apply_document(self, artwork_id, artwork):
+        """Upsert or remove an index row from the current document state"""
+        embedding = decode_embedding(artwork.get('clip_embedding')) if artwork else None
+        if embedding is None or embedding.shape != (self.index.dim,):
+            if self.index.remove(artwork_id):
+                self.applied += 1
+            return
+        if self.index.upsert(artwork_id, embedding, artwork_metadata(artwork)):
+            self.applied += 1
+
+    def resync(self, since):
+        """
+        Re-apply writes made since a point in time and drop deleted rows
+
+        Used after the index was replaced by a snapshot that may be older
+        than changes this watcher already applied.
+        """
+        self._catch_up(since)
+        self._reconcile_deletes()
+
+    def _catch_up(self, since=None):
+        """
+        Apply embeddings written after the last seen (embedding_updated_at, _id)
+
+        An explicit since re-reads everything written at or after that time.
+        """
+        query = {'clip_embedding': {'$exists': True}}
+        if since is None and self._last_seen_id is not None:
+            # Strictly after the last applied document, so polls do not
+            # re-apply it forever
+            query['$or'] = [
+                {'embedding_updated_at': {'$gt': self._last_seen}},
+                {'embedding_updated_at': self._last_seen, '_id': {'$gt': self._last_seen_id}}
+            ]
+        else:
+            since = since or self._last_seen
+            if since is not None:
+                query['embedding_updated_at'] = {'$gte': since}
+
+        projection = {'clip_embedding': 1, 'embedding_updated_at': 1, **METADATA_PROJECTION}
+        cursor = self.collection.find(query, projection).sort([('embedding_updated_at', 1), ('_id', 1)])
+        for artwork in cursor:
+            self._apply_document(artwork['_id'], artwork)
+            self._advance(artwork.get('embedding_updated_at'), artwork['_id'])
+
+    def _advance(self, updated_at, artwork_id):
+        """Move the poll position forward (never back, e.g. during a resync)"""
+        if not updated_at:
+            return
+        if (self._last_seen is None or updated_at > self._last_seen
+                or (updated_at == self._last_seen and (self._last_seen_id is None or artwork_id > self._last_seen_id))):
+            self._last_seen = updated_at
+            self._last_seen_id = artwork_id
+
+    def _reconcile_deletes(self):
+        """Drop index rows whose artwork (or its embedding) no longer exists"""
+        current = {
+            str(artwork['_id'])
+            for artwork in self.collection.find({'clip_embedding': {'$exists': True}}, {'_id': 1})
+        }
+        for artwork_id in self.index.ids():
+            if artwork_id not in current and self.index.remove(artwork_id):
+                self.applied += 1
+
+    def _poll(self):
+        """Fallback loop for deployments without change streams"""
+        self.mode = 'polling'
+        polls = 0
+        while not self._stop.is_set():
+            try:
+                self._catch_up()
+                polls += 1
+                if polls % self.reconcile_every == 0:
+                    self._reconcile_deletes()
+            except PyMongoError as e:
+                logger.error(f"Index poll error: {str(e)}")
+            self._stop.wait(self.poll_interval)
+
+    def stats(self):
+        """Watcher state for /health"""
+        return {
+            'mode': self.mode,
+            'running': bool(self._thread and self._thread.is_alive()),
+            'applied_changes': self.applied
+        }
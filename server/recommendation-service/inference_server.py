@@ -0,0 +1,271 @@
+"""
+Dedicated CLIP inference process
+
+In the default setup every HTTP worker holds the model and runs forward
+passes on its request threads, so Flask threads, the GIL and torch's
+intra-op pool compete for the same cores. With INFERENCE_SERVER_ADDRESS set,
+HTTP workers only preprocess images and forward jobs over a Unix socket
+to one or more long-lived inference processes that own the weights:
+
+    HTTP worker                          inference process
+    image/text MicroBatcher  --(job)-->  connection thread
+        InferenceClient      <--(emb)--  image/text MicroBatcher -> ClipTowers
+
+Jobs and results are pickled numpy arrays on a multiprocessing.connection
+channel authenticated with INFERENCE_SERVER_AUTHKEY. Unpickling runs code
+chosen by the peer, so the key is required (gunicorn.conf.py generates one
+for the processes it starts) and the socket is only accessible to its
+owner from the moment it is created. The inference process
+batches jobs from all HTTP workers again, so the model tier and the HTTP
+tier scale separately and the weights are loaded once per host.
+
+Run one process per address (gunicorn.conf.py starts them when
+INFERENCE_SERVER_SPAWN is true):
+
+    python inference_server.py /tmp/artscape-inference.sock
+"""
+
+import os
+import sys
+import time
+import itertools
+import threading
+import logging
+from multiprocessing.connection import Listener, Client
+import numpy as np
+from micro_batcher import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+JOB_KINDS = ('image', 'text', 'info')
+
+
+class InferenceServer:
+    """
+    Serve image/text embedding jobs for HTTP workers on a Unix socket
+
+    Args:
+        address: Socket path
+        authkey: Shared secret (bytes) clients must present
+        encode_images: Function list of (3 x 224 x 224) arrays -> (n x dim) array
+        encode_texts: Function list of strings -> (n x dim) array
+        info: Dict describing the model, returned to 'info' jobs
+        max_batch: Maximum items per forward pass
+        max_wait_ms: Batching window
+    """
+
+    def __init__(self, address, authkey, encode_images, encode_texts, info, max_batch=32, max_wait_ms=5):
+        if not authkey:
+            raise ValueError("INFERENCE_SERVER_AUTHKEY must be set")
+        self.address = address
+        self.authkey = authkey
+        self.info = dict(info, pid=os.getpid())
+        # Jobs of all connections are merged into shared forward passes
+        self.image_batcher = MicroBatcher(encode_images, max_batch=max_batch, max_wait_ms=max_wait_ms, name='server-image-batcher')
+        self.text_batcher = MicroBatcher(encode_texts, max_batch=max_batch, max_wait_ms=max_wait_ms, name='server-text-batcher')
+        self.connections = 0
+        self.jobs = 0
+
+    def serve_forever(self):
+        """Accept connections until the process is stopped"""
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        # Create the socket owner-only instead of restricting it after bind
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, family='AF_UNIX', backlog=64, authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        with listener:
+            logger.info(f"✓ Inference server listening on {self.address} (pid {os.getpid()})")
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception as e:
+                    # Failed handshakes (wrong authkey) must not stop the server
+                    logger.warning(f"Rejected inference connection: {str(e)}")
+                    continue
+                self.connections += 1
+                threading.Thread(target=self._serve, args=(connection,), name='inference-connection', daemon=True).start()
+
+    def _serve(self, connection):
+        with connection:
+            while True:
+                try:
+                    kind, payload = connection.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if kind == 'image':
+                        result = np.stack(self.image_batcher.submit_many(list(payload)))
+                    elif kind == 'text':
+                        result = np.stack(self.text_batcher.submit_many(list(payload)))
+                    elif kind == 'info':
+                        result = dict(self.info, image_batching=self.image_batcher.stats(),
+                                      text_batching=self.text_batcher.stats())
+                    else:
+                        raise ValueError(f"Job kind must be one of {JOB_KINDS}")
+                    self.jobs += 1
+                    connection.send(('ok', result))
+                except (EOFError, OSError):
+                    return
+                except Exception as e:
+                    logger.error(f"Inference job failed: {str(e)}")
+                    connection.send(('error', str(e)))
+
+
+class InferenceClient:
+    """
+    Forward embedding jobs to inference server processes
+
+    Each calling thread keeps its own connection per address; calls are
+    spread round-robin over the addresses and retried once on another
+    connection if the server went away.
+
+    Args:
+        addresses: List of socket paths
+        authkey: Shared secret (bytes)
+    """
+
+    def __init__(self, addresses, authkey):
+        if not authkey:
+            raise ValueError("INFERENCE_SERVER_AUTHKEY must be set")
+        self.addresses = list(addresses)
+        self.authkey = authkey
+        self.info = None
+        self.jobs = 0
+        self.errors = 0
+        # Shared by all request threads; next() on a count is atomic
+        self._turns = itertools.count()
+        self._local = threading.local()
+
+    def _connection(self, address):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        if address not in connections:
+            connections[address] = Client(address, family='AF_UNIX', authkey=self.authkey)
+        return connections[address]
+
+    def _drop(self, address):
+        connection = self._local.connections.pop(address, None)
+        if connection is not None:
+            try:
+                connection.close()
+            except OSError:
+                pass
+
+    def _next_address(self):
+        return self.addresses[next(self._turns) % len(self.addresses)]
+
+    def _call(self, kind, payload, address=None):
+        if address is None:
+            address = self._next_address()
+        for attempt in range(2):
+            try:
+                connection = self._connection(address)
+                connection.send((kind, payload))
+                status, result = connection.recv()
+                break
+            except (EOFError, OSError):
+                self._drop(address)
+                self.errors += 1
+                if attempt:
+                    raise
+                address = self._next_address()
+        if status != 'ok':
+            raise RuntimeError(f"Inference server error: {result}")
+        self.jobs += 1
+        return result
+
+    def encode_images(self, pixel_values):
+        """
+        Args:
+            pixel_values: float32 array (n x 3 x 224 x 224)
+
+        Returns:
+            float32 array (n x dim) of unit-length embeddings
+        """
+        return self._call('image', np.asarray(pixel_values, dtype=np.float32))
+
+    def encode_texts(self, texts):
+        """
+        Args:
+            texts: List of strings
+
+        Returns:
+            float32 array (n x dim) of unit-length embeddings
+        """
+        return self._call('text', list(texts))
+
+    def wait_ready(self, timeout):
+        """
+        Block until every server answers, returning the first one's info
+
+        Raises:
+            TimeoutError: If a server is not reachable within timeout seconds
+        """
+        deadline = time.monotonic() + timeout
+        infos = []
+        for address in self.addresses:
+            while True:
+                try:
+                    infos.append(self._call('info', None, address))
+                    break
+                except (OSError, EOFError):
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"Inference servers {self.addresses} not reachable")
+                    time.sleep(0.5)
+        self.info = infos[0]
+        return self.info
+
+    def stats(self):
+        """Client state for /health"""
+        return {
+            'addresses': self.addresses,
+            'server': {k: v for k, v in (self.info or {}).items() if not k.endswith('_batching')},
+            'jobs': self.jobs,
+            'connection_errors': self.errors
+        }
+
+
+def main(address):
+    # Load the model through the service module without starting HTTP-side
+    # services (database, index, background workers)
+    os.environ['SERVICE_ROLE'] = 'inference'
+    import torch
+    import recommendation_service as service
+
+    service.initialize_model()
+    towers = service.towers
+    processor = service.processor
+
+    def encode_images(pixel_values):
+        return towers.encode_images(torch.from_numpy(np.stack(pixel_values))).numpy()
+
+    def encode_texts(texts):
+        inputs = towers.tokenize(processor, texts)
+        return towers.encode_texts(inputs['input_ids'], inputs['attention_mask']).numpy()
+
+    server = InferenceServer(
+        address,
+        service.Config.INFERENCE_SERVER_AUTHKEY.encode(),
+        encode_images,
+        encode_texts,
+        {
+            'model': service.Config.MODEL_NAME,
+            'device': service.device,
+            'precision': towers.precision,
+            'mode': towers.mode,
+            'self_check': towers.self_check_result
+        },
+        max_batch=service.Config.INFERENCE_MAX_BATCH,
+        max_wait_ms=service.Config.INFERENCE_BATCH_WINDOW_MS
+    )
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit("usage: python inference_server.py <socket path>")
+    main(sys.argv[1])
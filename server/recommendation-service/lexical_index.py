@@ -0,0 +1,175 @@
+"""
+In-process lexical index over artwork titles and tags
+
+CLIP text embeddings are good at vibes and bad at literals: a query that is
+exactly an artwork title or a tag often ranks the literal match poorly. This
+inverted index answers such queries without touching the model, and its
+ranking is fused with the dense ranking by reciprocal-rank fusion in
+/recommend/text hybrid mode.
+
+EmbeddingIndex keeps it in sync: every metadata change goes through its
+posting maintenance, so the lexical index is rebuilt by load() and updated
+incrementally by upsert() and remove().
+"""
+
+import re
+import math
+import heapq
+import threading
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+STOPWORDS = frozenset({'a', 'an', 'and', 'the', 'of', 'in', 'on', 'with', 'for', 'to', 'by', 'at', 'or'})
+
+# Tag tokens count more than title tokens: tags are curated descriptors
+TAG_WEIGHT = 2.0
+
+# Added for a query equal to a whole title or tag, so exact matches rank first
+EXACT_MATCH_BONUS = 100.0
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Reciprocal-rank fusion constant
+RRF_K = 60
+
+
+def tokenize(text):
+    """Lowercase word tokens of text without stopwords"""
+    return [t for t in TOKEN_PATTERN.findall(str(text).lower()) if t not in STOPWORDS]
+
+
+def normalize_phrase(text):
+    """Case- and whitespace-insensitive form of a whole title, tag or query"""
+    return ' '.join(str(text).lower().split())
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Fuse several rankings of ids
+
+    Args:
+        rankings: Lists of ids, best first
+        k: Smoothing constant; larger values flatten rank differences
+
+    Returns:
+        List of (id, fused_score), best first
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over artwork title and tags, with an exact-match map
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = {}
+        self._lengths = {}
+        self._exact = {}
+        self._total_length = 0.0
+
+    def __len__(self):
+        return len(self._lengths)
+
+    @staticmethod
+    def _fields(metadata):
+        """(term frequencies, document length, exact phrases) of an artwork"""
+        frequencies = {}
+        for token in tokenize(metadata.get('title', '')):
+            frequencies[token] = frequencies.get(token, 0.0) + 1.0
+        for tag in metadata.get('tags', []):
+            for token in tokenize(tag):
+                frequencies[token] = frequencies.get(token, 0.0) + TAG_WEIGHT
+        phrases = {normalize_phrase(metadata.get('title', ''))}
+        phrases.update(normalize_phrase(tag) for tag in metadata.get('tags', []))
+        phrases.discard('')
+        return frequencies, sum(frequencies.values()), phrases
+
+    def add(self, artwork_id, metadata):
+        """Index the title and tags of an artwork"""
+        frequencies, length, phrases = self._fields(metadata)
+        with self._lock:
+            for token, frequency in frequencies.items():
+                self._postings.setdefault(token, {})[artwork_id] = frequency
+            for phrase in phrases:
+                self._exact.setdefault(phrase, set()).add(artwork_id)
+            self._lengths[artwork_id] = length
+            self._total_length += length
+
+    def remove(self, artwork_id, metadata):
+        """Unindex an artwork, given the metadata it was added with"""
+        frequencies, _, phrases = self._fields(metadata)
+        with self._lock:
+            for token in frequencies:
+                postings = self._postings.get(token)
+                if postings is not None:
+                    postings.pop(artwork_id, None)
+                    if not postings:
+                        del self._postings[token]
+            for phrase in phrases:
+                ids = self._exact.get(phrase)
+                if ids is not None:
+                    ids.discard(artwork_id)
+                    if not ids:
+                        del self._exact[phrase]
+            self._total_length -= self._lengths.pop(artwork_id, 0.0)
+
+    def clear(self):
+        with self._lock:
+            self._postings = {}
+            self._lengths = {}
+            self._exact = {}
+            self._total_length = 0.0
+
+    def exact(self, query):
+        """Ids whose title or a tag equals the query"""
+        with self._lock:
+            return set(self._exact.get(normalize_phrase(query), ()))
+
+    def search(self, query, limit, allowed=None):
+        """
+        Rank artworks by BM25 over title and tags
+
+        Args:
+            query: Query text
+            limit: Maximum number of results
+            allowed: Optional function artwork_id -> bool applied to candidates
+
+        Returns:
+            List of (artwork_id, score), best first
+        """
+        tokens = set(tokenize(query))
+        scores = {}
+        with self._lock:
+            n = len(self._lengths)
+            if n == 0:
+                return []
+            average_length = self._total_length / n or 1.0
+
+            for artwork_id in self._exact.get(normalize_phrase(query), ()):
+                scores[artwork_id] = EXACT_MATCH_BONUS
+
+            for token in tokens:
+                postings = self._postings.get(token)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for artwork_id, frequency in postings.items():
+                    norm = K1 * (1 - B + B * self._lengths[artwork_id] / average_length)
+                    scores[artwork_id] = scores.get(artwork_id, 0.0) + idf * frequency * (K1 + 1) / (frequency + norm)
+
+        candidates = scores.items()
+        if allowed is not None:
+            candidates = [(artwork_id, score) for artwork_id, score in candidates if allowed(artwork_id)]
+        return heapq.nlargest(limit, candidates, key=lambda item: item[1])
+
+    def stats(self):
+        """Index size for /health"""
+        return {'artworks': len(self._lengths), 'terms': len(self._postings), 'phrases': len(self._exact)}
@@ -0,0 +1,250 @@
+"""
+Lightweight Prometheus metrics and per-request stage timing
+
+Request latency used to be visible only through log lines. This module
+keeps counters, gauges and fixed-bucket histograms in plain dicts (one lock
+per metric, no dependency on prometheus_client) and renders them in the
+Prometheus text exposition format for /metrics.
+
+Hot-path code marks stages with
+
+    with stage('search'):
+        ...
+
+Durations accumulate on a thread-local StageTimer started by the request
+hook, which observes them into the stage histogram when the request ends
+and can emit them as a Server-Timing header. Outside a request stage() only
+costs a thread-local lookup.
+
+Each gunicorn worker keeps its own registry; series carry no pid label, so
+a scrape sees the worker that answered it.
+"""
+
+import math
+import bisect
+import time
+import threading
+from contextlib import contextmanager
+
+# Latency buckets in seconds, 0.5 ms .. 10 s
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """Mirror a running total kept elsewhere (used by collectors)"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in values.items()
+        ]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in values.items()
+        ]
+
+
+class Histogram(_Metric):
+    """
+    Cumulative histogram with fixed buckets
+
+    Args:
+        name: Metric name
+        documentation: Help text
+        labels: Label names
+        buckets: Sorted upper bounds; +Inf is implicit
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # First bucket with value <= bound; len(buckets) is the +Inf bucket
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        lines = self.header()
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Named metrics plus collectors evaluated at scrape time
+
+    Collectors are functions returning (metric, [(labels, value), ...])
+    pairs; they turn counters other components already keep (cache hits,
+    batch sizes) into metrics without touching their hot paths.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        """Prometheus text exposition of all metrics"""
+        for collector in self._collectors:
+            for metric, samples in collector():
+                for labels, value in samples:
+                    if isinstance(metric, Counter):
+                        metric.set_total(value, **labels)
+                    else:
+                        metric.set(value, **labels)
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    """Accumulated stage durations of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Server-Timing header value (durations in milliseconds)"""
+        entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages.items()]
+        entries.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ', '.join(entries)
+
+
+_local = threading.local()
+
+
+def start_request():
+    """Start timing stages of the request handled by this thread"""
+    timer = StageTimer()
+    _local.timer = timer
+    return timer
+
+
+def finish_request():
+    """Stop timing and return the request's StageTimer (or None)"""
+    timer = getattr(_local, 'timer', None)
+    _local.timer = None
+    return timer
+
+
+@contextmanager
+def stage(name):
+    """Add the duration of the block to the current request's stage"""
+    timer = getattr(_local, 'timer', None)
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - started)
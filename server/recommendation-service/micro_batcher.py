@@ -0,0 +1,131 @@
+"""
+Request-coalescing micro-batcher for model inference
+
+Flask serves requests on many threads, and each single-item request used to
+run its own batch-size-1 forward pass. A MicroBatcher owns one worker thread
+that collects items submitted by concurrent requests for up to max_wait_ms
+(or until max_batch items are queued), runs them through the model in one
+call and hands each caller its own result. This turns many tiny forward
+passes into a few large ones, and it also means only one thread uses the
+model at a time.
+"""
+
+import os
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Merge items submitted from many threads into batched calls
+
+    Args:
+        process: Function list_of_items -> sequence of results (same order)
+        max_batch: Maximum items per call
+        max_wait_ms: How long the first item of a batch waits for company
+        name: Worker thread name
+    """
+
+    def __init__(self, process, max_batch=32, max_wait_ms=5, name='micro-batcher'):
+        self.process = process
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.name = name
+        self._queue = queue.Queue()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_worker(self):
+        """
+        Start the worker thread on first use
+
+        Threads do not survive fork, so a batcher created in a preloading
+        parent process starts a fresh thread (and queue) in each child.
+        """
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def submit(self, item):
+        """Process one item, blocking until its batch has run"""
+        return self.submit_many([item])[0]
+
+    def submit_many(self, items):
+        """
+        Process several items, blocking until all of them have run
+
+        Items may be spread over several batches and share them with
+        items of other callers.
+
+        Returns:
+            List of results in the order of items
+
+        Raises:
+            The exception raised by process for the batch an item was in
+        """
+        self._ensure_worker()
+        futures = []
+        for item in items:
+            future = Future()
+            self._queue.put((item, future))
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def _collect(self):
+        """Block for one item, then gather more until the window closes"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # Window closed; still take whatever is already queued
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = self.process([item for item, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logger.error(f"Batched inference failed for {len(batch)} items: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+
+            self.batches += 1
+            self.items += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+
+    def stats(self):
+        """Batching counters for /health"""
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'average_batch': round(self.items / self.batches, 2) if self.batches else 0.0,
+            'largest_batch': self.largest_batch,
+            'pending': self._queue.qsize(),
+            'max_batch': self.max_batch,
+            'max_wait_ms': self.max_wait * 1000
+        }
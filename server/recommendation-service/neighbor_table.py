@@ -0,0 +1,375 @@
+"""
+Precomputed "similar artworks" neighbor table
+
+Stores the top-K most similar artworks of every artwork so /recommend/similar
+is an O(1) lookup instead of a scan. The table is built in the background
+with batched matrix products, persisted to a MongoDB collection for fast
+restarts, and maintained incrementally and exactly: when an embedding is
+added, one matrix-vector product scores it against every artwork and the
+rows whose K-th neighbor score it beats get it inserted; only rows that
+contained a changed or removed artwork are recomputed.
+
+The collection is shared by all workers. A lease document in it elects one
+owner, which alone rebuilds and persists the table; the other workers load
+the persisted table (waiting while the owner builds it) and keep their
+in-memory copy current without writing. A rebuild upserts rows under a new
+build id and only then deletes rows of older builds, so readers never see
+an empty table.
+"""
+
+import os
+import queue
+import socket
+import threading
+import logging
+from datetime import datetime, timedelta
+import numpy as np
+from bson import ObjectId
+from pymongo import ReplaceOne, DeleteOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from embedding_index import SearchFilter
+
+logger = logging.getLogger(__name__)
+
+# _id of the lease/build document stored alongside the neighbor rows
+LEASE_ID = '_lease'
+
+
+class NeighborTable:
+    """
+    Top-K neighbor lists for every artwork in an EmbeddingIndex
+
+    Args:
+        index: EmbeddingIndex to derive neighbors from
+        collection: pymongo collection persisting the table (or None)
+        k: Neighbors stored per artwork
+        model_name: Model the embeddings come from; persisted rows of
+            another model are ignored
+        block_size: Artworks per batched search during a rebuild
+        flush_interval: Seconds between writes of incremental changes
+        lease_seconds: Owner lease duration; renewed every flush_interval
+    """
+
+    def __init__(self, index, collection, k=50, model_name=None, block_size=256, flush_interval=30,
+                 lease_seconds=300):
+        self.index = index
+        self.collection = collection
+        self.k = k
+        self.model_name = model_name
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.is_owner = False
+        self.build = None
+        self.ready = False
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._neighbors = {}
+        self._scores = {}
+        # Score a new artwork must beat to enter each row (-inf if not full)
+        self._kth = {}
+        self._reverse = {}
+        self._dirty = set()
+        self._events = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lease_renewed_at = None
+
+    def __len__(self):
+        return len(self._neighbors)
+
+    def start(self):
+        """Load or rebuild the table and start incremental maintenance"""
+        self.index.add_listener(self._on_index_change)
+        self._thread = threading.Thread(target=self._run, name='neighbor-table', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop maintenance after persisting pending changes"""
+        self.index.remove_listener(self._on_index_change)
+        self._stop.set()
+
+    def get(self, artwork_id, top_k):
+        """
+        Look up the precomputed neighbors of an artwork
+
+        Args:
+            artwork_id: Artwork id
+            top_k: Number of neighbors wanted (must be <= k)
+
+        Returns:
+            List of (artwork_id, similarity) or None if not available
+        """
+        if not self.ready or top_k > self.k:
+            self.misses += 1
+            return None
+        with self._lock:
+            neighbors = self._neighbors.get(str(artwork_id))
+            if neighbors is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(zip(neighbors[:top_k], self._scores[str(artwork_id)][:top_k]))
+
+    def _on_index_change(self, event, artwork_id, vector):
+        # Called from request and watcher threads; work happens in _run
+        self._events.put((event, artwork_id, vector))
+
+    def _acquire_lease(self):
+        """Take or renew the owner lease; returns whether this worker owns it"""
+        if self.collection is None:
+            return True
+        now = datetime.utcnow()
+        try:
+            lease = self.collection.find_one_and_update(
+                {'_id': LEASE_ID, '$or': [{'owner': self.owner}, {'lease_until': {'$lt': now}}]},
+                {'$set': {'owner': self.owner, 'lease_until': now + timedelta(seconds=self.lease_seconds)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Held by another worker
+            return False
+        self._lease_renewed_at = now
+        return lease['owner'] == self.owner
+
+    def _renew_lease_if_due(self):
+        if not self.is_owner or self._lease_renewed_at is None:
+            return
+        if (datetime.utcnow() - self._lease_renewed_at).total_seconds() >= self.lease_seconds / 3:
+            self.is_owner = self._acquire_lease()
+
+    def _initialize(self):
+        """Load the persisted table; only the lease owner builds it"""
+        while not self._stop.is_set():
+            self.is_owner = self._acquire_lease()
+            if self._load():
+                return True
+            if self.is_owner:
+                self.rebuild()
+                return True
+            # Another worker is building the table
+            self._stop.wait(self.flush_interval)
+        return False
+
+    def _run(self):
+        try:
+            if not self._initialize():
+                return
+        except Exception as e:
+            logger.error(f"Failed to build neighbor table: {str(e)}")
+            return
+
+        last_flush = datetime.utcnow()
+        while not self._stop.is_set():
+            try:
+                event, artwork_id, vector = self._events.get(timeout=self.flush_interval)
+                if event == 'upsert':
+                    self._apply_upsert(artwork_id, vector)
+                else:
+                    self._apply_remove(artwork_id)
+            except queue.Empty:
+                pass
+            except Exception as e:
+                logger.error(f"Error updating neighbor table: {str(e)}")
+
+            if (datetime.utcnow() - last_flush).total_seconds() >= self.flush_interval:
+                try:
+                    # A reader takes over if the owner stopped renewing
+                    self.is_owner = self._acquire_lease()
+                except Exception as e:
+                    logger.error(f"Error renewing neighbor table lease: {str(e)}")
+                    self.is_owner = False
+                self._flush()
+                last_flush = datetime.utcnow()
+
+        self._flush()
+
+    def _compute(self, artwork_ids):
+        """Compute fresh neighbor lists for artwork_ids with batched search"""
+        computed = {}
+        for start in range(0, len(artwork_ids), self.block_size):
+            found, vectors = self.index.get_many(artwork_ids[start:start + self.block_size])
+            if not found:
+                continue
+            filters = [SearchFilter(exclude_ids=[artwork_id]) for artwork_id in found]
+            results = self.index.search_batch(vectors, self.k, filters)
+            for artwork_id, (matches, _) in zip(found, results):
+                computed[artwork_id] = (
+                    [match[0] for match in matches],
+                    [match[1] for match in matches]
+                )
+            self._renew_lease_if_due()
+        return computed
+
+    def _store(self, artwork_id, neighbors, scores):
+        """Replace one neighbor list, keeping the reverse map in sync"""
+        for neighbor in self._neighbors.get(artwork_id, ()):
+            holders = self._reverse.get(neighbor)
+            if holders is not None:
+                holders.discard(artwork_id)
+        self._neighbors[artwork_id] = neighbors
+        self._scores[artwork_id] = scores
+        self._kth[artwork_id] = scores[-1] if len(scores) >= self.k else -np.inf
+        for neighbor in neighbors:
+            self._reverse.setdefault(neighbor, set()).add(artwork_id)
+        self._dirty.add(artwork_id)
+
+    def _drop(self, artwork_id):
+        for neighbor in self._neighbors.pop(artwork_id, ()):
+            holders = self._reverse.get(neighbor)
+            if holders is not None:
+                holders.discard(artwork_id)
+        self._scores.pop(artwork_id, None)
+        self._kth.pop(artwork_id, None)
+        self._dirty.add(artwork_id)
+
+    def rebuild(self):
+        """Recompute every neighbor list and persist the table (lease owner only)"""
+        started = datetime.utcnow()
+        artwork_ids = self.index.ids()
+        computed = self._compute(artwork_ids)
+
+        with self._lock:
+            self._neighbors = {}
+            self._scores = {}
+            self._kth = {}
+            self._reverse = {}
+            for artwork_id, (neighbors, scores) in computed.items():
+                self._store(artwork_id, neighbors, scores)
+            self._dirty = set()
+            self.ready = True
+
+        elapsed = (datetime.utcnow() - started).total_seconds()
+        logger.info(f"✓ Neighbor table built: {len(computed)} artworks, k={self.k} in {elapsed:.1f}s")
+
+        if self.collection is not None:
+            # Replace rows in place, then drop rows of earlier builds
+            self.build = ObjectId()
+            self._write(list(computed))
+            self.collection.delete_many({'_id': {'$ne': LEASE_ID}, 'build': {'$ne': self.build}})
+            self.collection.update_one(
+                {'_id': LEASE_ID},
+                {'$set': {'build': self.build, 'table_k': self.k, 'table_model': self.model_name, 'built_at': datetime.utcnow()}}
+            )
+
+    def _load(self):
+        """Load a persisted table if a build finished and covers the current index"""
+        if self.collection is None:
+            return False
+        lease = self.collection.find_one({'_id': LEASE_ID}) or {}
+        if lease.get('table_k') != self.k or lease.get('table_model') != self.model_name:
+            return False
+        self.build = lease['build']
+        count = self.collection.count_documents({'k': self.k, 'model': self.model_name})
+        if count == 0 or count < 0.95 * len(self.index):
+            return False
+
+        with self._lock:
+            for doc in self.collection.find({'k': self.k, 'model': self.model_name}):
+                if doc['_id'] in self.index:
+                    self._store(doc['_id'], doc['neighbors'], doc['scores'])
+            self._dirty = set()
+            missing = [artwork_id for artwork_id in self.index.ids() if artwork_id not in self._neighbors]
+            self.ready = True
+
+        # Artworks embedded while this instance was down
+        for artwork_id in missing:
+            self._events.put(('upsert', artwork_id, self.index.get(artwork_id)))
+        logger.info(f"✓ Neighbor table loaded: {len(self._neighbors)} artworks, {len(missing)} to compute")
+        return True
+
+    def _apply_upsert(self, artwork_id, vector):
+        """
+        Patch the table for a new or changed embedding
+
+        Rows whose K-th score is beaten by the new embedding get it inserted
+        in place; rows that listed the artwork before (its old position may
+        no longer be valid) and the artwork's own row are recomputed.
+        """
+        if vector is None:
+            return
+        with self._lock:
+            recompute = {artwork_id} | self._reverse.get(artwork_id, set())
+
+        # Any row can gain the artwork (hub vectors enter rows of artworks
+        # far outside their own neighborhood), so it is scored against all
+        # of them; only rows above the lowest K-th score are inspected
+        with self._lock:
+            floor = min(self._kth.values(), default=-np.inf)
+        matches = self.index.scores_above(vector, floor)
+
+        with self._lock:
+            for holder, score in matches:
+                if holder in recompute or holder not in self._neighbors:
+                    continue
+                if score <= self._kth[holder]:
+                    continue
+                neighbors = list(self._neighbors[holder])
+                scores = list(self._scores[holder])
+                position = int(np.searchsorted(-np.asarray(scores), -score))
+                neighbors.insert(position, artwork_id)
+                scores.insert(position, score)
+                self._store(holder, neighbors[:self.k], scores[:self.k])
+
+        computed = self._compute(sorted(recompute))
+        with self._lock:
+            for holder, (neighbors, scores) in computed.items():
+                self._store(holder, neighbors, scores)
+
+    def _apply_remove(self, artwork_id):
+        """Drop an artwork and recompute the rows that listed it"""
+        with self._lock:
+            holders = self._reverse.pop(artwork_id, set())
+            self._drop(artwork_id)
+        computed = self._compute(sorted(holders))
+        with self._lock:
+            for holder, (neighbors, scores) in computed.items():
+                self._store(holder, neighbors, scores)
+
+    def _flush(self):
+        """Persist rows changed since the last flush (readers only drop them)"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if dirty and self.collection is not None and self.is_owner:
+            try:
+                self._write(dirty)
+            except Exception as e:
+                logger.error(f"Error persisting neighbor table: {str(e)}")
+                with self._lock:
+                    self._dirty |= dirty
+
+    def _write(self, artwork_ids):
+        now = datetime.utcnow()
+        operations = []
+        with self._lock:
+            for artwork_id in artwork_ids:
+                if artwork_id in self._neighbors:
+                    operations.append(ReplaceOne({'_id': artwork_id}, {
+                        'neighbors': self._neighbors[artwork_id],
+                        'scores': self._scores[artwork_id],
+                        'k': self.k,
+                        'model': self.model_name,
+                        'build': self.build,
+                        'updated_at': now
+                    }, upsert=True))
+                else:
+                    operations.append(DeleteOne({'_id': artwork_id}))
+        for start in range(0, len(operations), 1000):
+            self.collection.bulk_write(operations[start:start + 1000], ordered=False)
+
+    def stats(self):
+        """Table state for /health"""
+        lookups = self.hits + self.misses
+        return {
+            'ready': self.ready,
+            'owner': self.is_owner,
+            'artworks': len(self._neighbors),
+            'k': self.k,
+            'pending_updates': self._events.qsize(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+        }
@@ -9,22 +9,45 @@ This service provides:
 - Personalized user recommendations
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import torch
 from transformers import CLIPProcessor, CLIPModel
 from PIL import Image
-import requests
 from io import BytesIO
 import numpy as np
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
 from bson import ObjectId
 import os
 import logging
-from functools import lru_cache
+import threading
 from pathlib import Path
 from datetime import datetime
 from dotenv import load_dotenv
+from embedding_index import EmbeddingIndex, SearchFilter, artwork_metadata, METADATA_PROJECTION
+from index_watcher import IndexWatcher
+from index_snapshot import IndexSnapshotManager
+from neighbor_table import NeighborTable
+from user_profiles import UserProfileStore, INTERACTION_TYPES, parse_weights, merge_centroid_results
+from image_loader import create_http_session, prefetch_images
+from backfill_jobs import BackfillJobManager, job_to_dict
+from embedding_queue import EmbeddingQueue, JobFailure, JOB_DEAD
+from embedding_storage import encode_embedding, STORAGE_FORMATS
+from embedding_source import build_source, is_current, conditional_headers
+from caches import ByteBudgetCache, TextEmbeddingCache
+from micro_batcher import MicroBatcher
+from inference_backend import ClipTowers, configure_threads
+from inference_server import InferenceClient
+from ann_index import ANN_ENGINES, hnswlib
+from lexical_index import reciprocal_rank_fusion
+from metrics import MetricsRegistry, stage, start_request, finish_request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Load environment variables from .env file
 load_dotenv()
@@ -48,8 +71,25 @@ CORS(app, origins=allowed_origins, supports_credentials=True)
 # Global variables
 model = None
 processor = None
+towers = None
+# Set instead of model/towers when inference runs in inference_server.py
+inference_client = None
+
+# Startup progress; request handlers only run once service_ready is set
+service_ready = threading.Event()
+startup_state = {'phase': 'starting', 'error': None}
+# Process that started its per-worker services (see start_worker_services)
+services_pid = None
+services_lock = threading.Lock()
 db = None
 device = None
+embedding_index = EmbeddingIndex()
+index_watcher = None
+index_snapshots = None
+backfill_manager = None
+embedding_queue = None
+neighbor_table = None
+profile_store = None
 
 # Configuration class
 class Config:
@@ -73,24 +113,253 @@ class Config:
     # 3. "/path/to/shared/models": Use custom path
     MODEL_CACHE_DIR = os.getenv('MODEL_CACHE_DIR', './models')
     
+    # Local safetensors snapshot written by download_model.py; loaded without
+    # hub lookups (memory-mapped) when present
+    MODEL_SNAPSHOT_DIR = os.getenv('MODEL_SNAPSHOT_DIR', f"./models/snapshot/{MODEL_NAME.replace('/', '--')}")
+    
+    # Startup: SERVICE_PRELOAD loads the model at import (gunicorn preload,
+    # see gunicorn.conf.py); requests wait up to READY_WAIT_SECONDS for the
+    # service to become ready before getting a 503
+    SERVICE_PRELOAD = os.getenv('SERVICE_PRELOAD', 'false').lower() == 'true'
+    READY_WAIT_SECONDS = float(os.getenv('READY_WAIT_SECONDS', 2))
+    
+    # Dedicated inference processes (inference_server.py): comma separated
+    # Unix socket paths. When set, HTTP workers only preprocess and forward
+    # jobs; empty runs the model inside every HTTP worker. SERVICE_ROLE is
+    # set to 'inference' by inference_server.py itself. The authkey is
+    # required; gunicorn.conf.py generates one when it spawns the servers.
+    INFERENCE_SERVER_ADDRESS = os.getenv('INFERENCE_SERVER_ADDRESS', '')
+    INFERENCE_SERVER_AUTHKEY = os.getenv('INFERENCE_SERVER_AUTHKEY', '')
+    INFERENCE_SERVER_WAIT_SECONDS = float(os.getenv('INFERENCE_SERVER_WAIT_SECONDS', 600))
+    SERVICE_ROLE = os.getenv('SERVICE_ROLE', 'http')
+    
     # Processing Configuration
     BATCH_SIZE = int(os.getenv('BATCH_SIZE', 32))
+    DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', 8))
+    PREFETCH_BATCHES = int(os.getenv('PREFETCH_BATCHES', 2))
+    HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 16))
+    
+    # Image cache: 'image' (decoded RGB), 'tensor' (preprocessed 224x224),
+    # 'embedding' (result keyed by URL + content hash) or 'off'
+    IMAGE_CACHE_MODE = os.getenv('IMAGE_CACHE_MODE', 'image')
+    IMAGE_CACHE_MAX_MB = int(os.getenv('IMAGE_CACHE_MAX_MB', 256))
+    IMAGE_CACHE_TTL = int(os.getenv('IMAGE_CACHE_TTL', 3600))
+    IMAGE_CACHE_NEGATIVE_TTL = int(os.getenv('IMAGE_CACHE_NEGATIVE_TTL', 60))
+    
+    # Text query embedding cache (TEXT_CACHE_PATH enables persistence)
+    TEXT_CACHE_SIZE = int(os.getenv('TEXT_CACHE_SIZE', 10000))
+    TEXT_CACHE_PATH = os.getenv('TEXT_CACHE_PATH', '')
     TOP_K = int(os.getenv('TOP_K', 20))
+    MAX_BATCH_QUERIES = int(os.getenv('MAX_BATCH_QUERIES', 256))
+    
+    # Text search mode: 'dense' (CLIP only), 'lexical' (title/tag index only,
+    # no inference) or 'hybrid' (reciprocal-rank fusion of both rankings,
+    # each fetching TEXT_HYBRID_CANDIDATES candidates)
+    TEXT_SEARCH_MODE = os.getenv('TEXT_SEARCH_MODE', 'dense')
+    TEXT_HYBRID_CANDIDATES = int(os.getenv('TEXT_HYBRID_CANDIDATES', 100))
+    
+    # Prometheus metrics at /metrics; SERVER_TIMING adds per-stage
+    # durations to every response as a Server-Timing header
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    SERVER_TIMING = os.getenv('SERVER_TIMING', 'false').lower() == 'true'
+    
+    # Serialize responses with orjson when it is installed
+    FAST_JSON = os.getenv('FAST_JSON', 'true').lower() == 'true'
+    
+    # Search engine: 'exact' (brute-force matrix scan), 'ivf' (pure NumPy
+    # inverted file) or 'hnsw' (requires hnswlib). ANN is only used once the
+    # catalog has ANN_MIN_SIZE embeddings; candidates are re-scored exactly.
+    SEARCH_ENGINE = os.getenv('SEARCH_ENGINE', 'exact')
+    ANN_MIN_SIZE = int(os.getenv('ANN_MIN_SIZE', 20000))
+    ANN_OVERSAMPLE = int(os.getenv('ANN_OVERSAMPLE', 4))
+    IVF_NLIST = int(os.getenv('IVF_NLIST', 0))  # 0 = 4 * sqrt(N)
+    IVF_NPROBE = int(os.getenv('IVF_NPROBE', 8))
+    HNSW_M = int(os.getenv('HNSW_M', 16))
+    HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', 200))
+    HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', 64))
+    
+    # Embedding storage format: 'array' (legacy BSON doubles), 'float32' or
+    # 'float16' (packed BSON Binary, 4-8x smaller). Reads accept all formats.
+    EMBEDDING_STORAGE = os.getenv('EMBEDDING_STORAGE', 'array')
+    
+    # Embedding index sync (change streams, or polling on standalone mongod)
+    INDEX_WATCH_ENABLED = os.getenv('INDEX_WATCH_ENABLED', 'true').lower() == 'true'
+    INDEX_POLL_INTERVAL = float(os.getenv('INDEX_POLL_INTERVAL', 10))
+    
+    # Precomputed similar-artwork table, served by /recommend/similar when
+    # the request has no filters and top_k <= NEIGHBORS_K
+    NEIGHBORS_ENABLED = os.getenv('NEIGHBORS_ENABLED', 'true').lower() == 'true'
+    NEIGHBORS_K = int(os.getenv('NEIGHBORS_K', 50))
+    
+    # Personalized profiles: per-interaction weights, views scaled up to
+    # PROFILE_VIEW_FULL_SECONDS, recency half-life for timestamped views and
+    # the number of taste clusters (centroids) queried per user
+    PROFILE_WEIGHTS = os.getenv('PROFILE_WEIGHTS', 'purchase=5,cart=3,save=2.5,like=2,view=1')
+    PROFILE_VIEW_FULL_SECONDS = float(os.getenv('PROFILE_VIEW_FULL_SECONDS', 30))
+    PROFILE_HALF_LIFE_DAYS = float(os.getenv('PROFILE_HALF_LIFE_DAYS', 30))
+    PROFILE_CENTROIDS = int(os.getenv('PROFILE_CENTROIDS', 1))
+    # Views that count per user; keep equal to the viewedArtworks cap in Node
+    PROFILE_VIEW_WINDOW = int(os.getenv('PROFILE_VIEW_WINDOW', 100))
+    
+    # CPU inference: INFERENCE_PRECISION 'fp32', 'int8' (dynamic quantization
+    # of linear layers) or 'bf16'; INFERENCE_MODE 'eager' or 'torchscript'.
+    # Non-default settings are compared against fp32 at startup.
+    INFERENCE_PRECISION = os.getenv('INFERENCE_PRECISION', 'fp32')
+    INFERENCE_MODE = os.getenv('INFERENCE_MODE', 'eager')
+    INFERENCE_SELF_CHECK = os.getenv('INFERENCE_SELF_CHECK', 'true').lower() == 'true'
+    INFERENCE_MIN_COSINE = float(os.getenv('INFERENCE_MIN_COSINE', 0.98))
+    TORCH_INTRA_OP_THREADS = int(os.getenv('TORCH_INTRA_OP_THREADS', 0))  # 0 = torch default
+    TORCH_INTER_OP_THREADS = int(os.getenv('TORCH_INTER_OP_THREADS', 0))
+    
+    # Dynamic batching of model calls: concurrent requests arriving within
+    # INFERENCE_BATCH_WINDOW_MS share one forward pass of up to
+    # INFERENCE_MAX_BATCH items
+    INFERENCE_BATCH_WINDOW_MS = float(os.getenv('INFERENCE_BATCH_WINDOW_MS', 5))
+    INFERENCE_MAX_BATCH = int(os.getenv('INFERENCE_MAX_BATCH', 32))
+    
+    # Host-shared index snapshots: workers map one copy-on-write .npy file
+    # (use a tmpfs path such as /dev/shm/artscape-index); empty disables
+    INDEX_SNAPSHOT_DIR = os.getenv('INDEX_SNAPSHOT_DIR', '')
+    INDEX_SNAPSHOT_INTERVAL = float(os.getenv('INDEX_SNAPSHOT_INTERVAL', 30))
+    
+    # ASGI mode (asgi_service.py): threads running inference/search, and
+    # threads for blocking I/O such as image downloads and sync Mongo calls
+    ASYNC_INFERENCE_WORKERS = int(os.getenv('ASYNC_INFERENCE_WORKERS', 2))
+    ASYNC_IO_WORKERS = int(os.getenv('ASYNC_IO_WORKERS', 32))
+    
+    # Background backfill jobs
+    BACKFILL_CHUNK_SIZE = int(os.getenv('BACKFILL_CHUNK_SIZE', 128))
+    BACKFILL_LEASE_SECONDS = int(os.getenv('BACKFILL_LEASE_SECONDS', 300))
+    
+    # Durable per-upload embedding queue (embedding_jobs collection);
+    # false makes /generate-embedding embed synchronously again
+    EMBEDDING_QUEUE_ENABLED = os.getenv('EMBEDDING_QUEUE_ENABLED', 'true').lower() == 'true'
+    EMBEDDING_QUEUE_BATCH_SIZE = int(os.getenv('EMBEDDING_QUEUE_BATCH_SIZE', 16))
+    EMBEDDING_QUEUE_POLL_INTERVAL = float(os.getenv('EMBEDDING_QUEUE_POLL_INTERVAL', 5))
+    EMBEDDING_QUEUE_LEASE_SECONDS = int(os.getenv('EMBEDDING_QUEUE_LEASE_SECONDS', 300))
+    EMBEDDING_QUEUE_MAX_ATTEMPTS = int(os.getenv('EMBEDDING_QUEUE_MAX_ATTEMPTS', 6))
+    EMBEDDING_QUEUE_BACKOFF_SECONDS = float(os.getenv('EMBEDDING_QUEUE_BACKOFF_SECONDS', 30))
+    EMBEDDING_QUEUE_BACKOFF_MAX = float(os.getenv('EMBEDDING_QUEUE_BACKOFF_MAX', 3600))
+    # Seconds between scans that queue artworks still lacking an embedding
+    EMBEDDING_QUEUE_SWEEP_INTERVAL = float(os.getenv('EMBEDDING_QUEUE_SWEEP_INTERVAL', 300))
+    EMBEDDING_JOB_RETENTION_DAYS = float(os.getenv('EMBEDDING_JOB_RETENTION_DAYS', 7))
     
     # Server Configuration
     PORT = int(os.getenv('PORT', 7860))
 
 
-def initialize_model():
+# Shared keep-alive session so image downloads reuse TCP/TLS connections
+http_session = create_http_session(pool_size=Config.HTTP_POOL_SIZE)
+
+# Downloaded images (or their tensors/embeddings), bounded by bytes
+image_cache = ByteBudgetCache(
+    Config.IMAGE_CACHE_MAX_MB * 1024 * 1024,
+    ttl=Config.IMAGE_CACHE_TTL,
+    negative_ttl=Config.IMAGE_CACHE_NEGATIVE_TTL
+)
+
+# Normalized text query -> embedding, so repeated searches skip the text tower
+text_cache = TextEmbeddingCache(
+    Config.TEXT_CACHE_SIZE,
+    Config.MODEL_NAME,
+    path=Config.TEXT_CACHE_PATH or None
+)
+
+# Request/stage latency histograms, failure counters and model gauges
+metrics = MetricsRegistry()
+request_latency = metrics.histogram(
+    'recommendation_request_duration_seconds', 'Request latency', ('endpoint', 'method', 'status')
+)
+stage_latency = metrics.histogram(
+    'recommendation_stage_duration_seconds', 'Time spent per request stage', ('endpoint', 'stage')
+)
+image_failures = metrics.counter(
+    'recommendation_image_failures_total', 'Images that could not be downloaded or decoded', ('reason',)
+)
+cache_hits = metrics.counter('recommendation_cache_hits_total', 'Cache lookups answered from cache', ('cache',))
+cache_misses = metrics.counter('recommendation_cache_misses_total', 'Cache lookups that missed', ('cache',))
+model_info = metrics.gauge(
+    'recommendation_model_info', 'Loaded model and where it runs (always 1)', ('model', 'device', 'precision', 'mode')
+)
+inference_batch_size = metrics.gauge(
+    'recommendation_inference_batch_size', 'Items in the latest batched forward pass', ('tower',)
+)
+indexed_artworks = metrics.gauge('recommendation_indexed_artworks', 'Artworks in the embedding index')
+
+
+def collect_metrics():
+    """Mirror counters kept by caches and the index at scrape time"""
+    caches = {'image': image_cache, 'text': text_cache}
+    if neighbor_table:
+        caches['neighbor_table'] = neighbor_table
+    yield cache_hits, [({'cache': name}, cache.hits) for name, cache in caches.items()]
+    yield cache_misses, [({'cache': name}, cache.misses) for name, cache in caches.items()]
+    yield indexed_artworks, [({}, len(embedding_index))]
+    if towers:
+        yield model_info, [({
+            'model': Config.MODEL_NAME,
+            'device': device,
+            'precision': towers.precision,
+            'mode': towers.mode
+        }, 1)]
+    elif inference_client and inference_client.info:
+        info = inference_client.info
+        yield model_info, [({
+            'model': info['model'],
+            'device': info['device'],
+            'precision': info['precision'],
+            'mode': info['mode']
+        }, 1)]
+
+
+metrics.add_collector(collect_metrics)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider that records jsonify time as the serialize stage
+    
+    Compact responses are encoded with orjson when it is installed and
+    FAST_JSON is on. Types orjson does not know (dates, ObjectIds, ...) go
+    through Flask's default hook, so the output matches the standard encoder.
+    """
+    
+    def dumps(self, obj, **kwargs):
+        with stage('serialize'):
+            if orjson is not None and Config.FAST_JSON and kwargs.get('indent') is None:
+                options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SERIALIZE_NUMPY
+                if self.sort_keys:
+                    options |= orjson.OPT_SORT_KEYS
+                return orjson.dumps(obj, default=self.default, option=options).decode()
+            return super().dumps(obj, **kwargs)
+
+
+app.json = TimedJSONProvider(app)
+
+
+def initialize_model(preload=False):
     """
     Initialize CLIP model and processor
     Downloads model if not present in cache directory
+    
+    Args:
+        preload: Loading in the gunicorn master before fork; only weights are
+            loaded and converted, forward passes (tracing, self-check) and
+            thread pool sizing are left to prepare_towers in each worker
     """
-    global model, processor, device
+    global model, processor, device, towers
+    
+    if Config.INFERENCE_SERVER_ADDRESS and Config.SERVICE_ROLE != 'inference':
+        connect_inference_server()
+        return
     
     logger.info("=" * 50)
     logger.info("Initializing CLIP model...")
     
+    # Thread pools must be sized before the first forward pass
+    if not preload:
+        configure_threads(Config.TORCH_INTRA_OP_THREADS, Config.TORCH_INTER_OP_THREADS)
+    
     # Determine device (GPU if available, else CPU)
     device = "cuda" if torch.cuda.is_available() else "cpu"
     logger.info(f"Using device: {device}")
@@ -102,8 +371,10 @@ def initialize_model():
     else:
         logger.info("No GPU available, using CPU (slower but functional)")
     
+    snapshot = Path(Config.MODEL_SNAPSHOT_DIR)
+    
     # Create model cache directory if using local storage
-    if Config.MODEL_CACHE_DIR:
+    if Config.MODEL_CACHE_DIR and not (snapshot / 'model.safetensors').exists():
         model_dir = Path(Config.MODEL_CACHE_DIR)
         model_dir.mkdir(parents=True, exist_ok=True)
         logger.info(f"Model cache directory: {model_dir.absolute()}")
@@ -116,24 +387,23 @@ def initialize_model():
     
     try:
         # Load model and processor
-        if Config.MODEL_CACHE_DIR:
-            logger.info(f"Loading model from: {Config.MODEL_CACHE_DIR}")
-            model = CLIPModel.from_pretrained(
-                Config.MODEL_NAME,
-                cache_dir=Config.MODEL_CACHE_DIR
-            ).to(device)
-            processor = CLIPProcessor.from_pretrained(
-                Config.MODEL_NAME,
-                cache_dir=Config.MODEL_CACHE_DIR
-            )
-        else:
-            logger.info("Loading model from default HuggingFace cache")
-            model = CLIPModel.from_pretrained(Config.MODEL_NAME).to(device)
-            processor = CLIPProcessor.from_pretrained(Config.MODEL_NAME)
+        model = load_pretrained(CLIPModel).to(device)
+        processor = load_pretrained(CLIPProcessor)
         
         # Set model to evaluation mode
         model.eval()
         
+        # Quantize / cast / trace the towers as configured
+        towers = ClipTowers(
+            model,
+            device=device,
+            precision=Config.INFERENCE_PRECISION,
+            mode=Config.INFERENCE_MODE,
+            defer_trace=preload
+        )
+        if not preload:
+            prepare_towers()
+        
         logger.info("✓ Model initialized successfully")
         logger.info(f"Model: {Config.MODEL_NAME}")
         logger.info(f"Embedding dimension: 512")
@@ -144,14 +414,102 @@ def initialize_model():
         raise
 
 
+def prepare_towers():
+    """
+    Finish the towers in the process that serves them: trace, compare with
+    fp32 and restore the text embedding cache of this variant
+    """
+    global model
+    
+    towers.prepare()
+    if (towers.precision, towers.mode) != ('fp32', 'eager') and Config.INFERENCE_SELF_CHECK:
+        towers.self_check(model, processor, min_cosine=Config.INFERENCE_MIN_COSINE)
+    # Drop the fp32 weights if an optimized copy replaced them
+    model = towers.model
+    
+    # Restore text embeddings persisted by a previous run of the same towers
+    text_cache.set_model(embedding_model_name())
+    text_cache.load()
+
+
+def embedding_model_name():
+    """
+    Model and tower variant embeddings are computed with, e.g.
+    'openai/clip-vit-base-patch32:int8/torchscript'
+    
+    int8, bf16 and TorchScript towers produce slightly different vectors
+    than fp32, so the text cache and stored embedding provenance are keyed
+    by this rather than by Config.MODEL_NAME alone. With inference servers
+    it is the variant they report.
+    """
+    if towers is not None:
+        return f"{Config.MODEL_NAME}:{towers.variant}"
+    if inference_client is not None and inference_client.info:
+        info = inference_client.info
+        return f"{info['model']}:{info['precision']}/{info['mode']}"
+    return Config.MODEL_NAME
+
+
+def load_pretrained(cls):
+    """
+    Load the CLIP model or processor from the local snapshot, the model
+    cache directory or the default HuggingFace cache, in that order
+    """
+    snapshot = Path(Config.MODEL_SNAPSHOT_DIR)
+    if (snapshot / 'model.safetensors').exists():
+        logger.info(f"Loading {cls.__name__} snapshot from: {snapshot}")
+        if cls is CLIPModel:
+            return cls.from_pretrained(snapshot, local_files_only=True, use_safetensors=True)
+        return cls.from_pretrained(snapshot, local_files_only=True)
+    if Config.MODEL_CACHE_DIR:
+        logger.info(f"Loading {cls.__name__} from: {Config.MODEL_CACHE_DIR}")
+        return cls.from_pretrained(Config.MODEL_NAME, cache_dir=Config.MODEL_CACHE_DIR)
+    logger.info(f"Loading {cls.__name__} from default HuggingFace cache")
+    return cls.from_pretrained(Config.MODEL_NAME)
+
+
+def connect_inference_server():
+    """
+    Use inference_server.py processes instead of a local model
+    
+    Only the processor is loaded here, since images are preprocessed in the
+    HTTP worker. Servers are contacted lazily; initialize_services waits for
+    them, so this is safe to call before they are started (gunicorn preload).
+    """
+    global processor, inference_client
+    
+    processor = load_pretrained(CLIPProcessor)
+    inference_client = InferenceClient(
+        [address.strip() for address in Config.INFERENCE_SERVER_ADDRESS.split(',') if address.strip()],
+        Config.INFERENCE_SERVER_AUTHKEY.encode()
+    )
+    logger.info(f"✓ Inference forwarded to {inference_client.addresses}")
+
+
+def wait_for_inference_server():
+    """Block until the inference servers answer and adopt their device"""
+    global device
+    
+    info = inference_client.wait_ready(Config.INFERENCE_SERVER_WAIT_SECONDS)
+    device = info['device']
+    logger.info(f"✓ Inference server ready: {info['model']} on {info['device']} "
+                f"({info['precision']}, {info['mode']}, pid {info['pid']})")
+    # Cached text embeddings must come from the server's towers
+    text_cache.set_model(embedding_model_name())
+    text_cache.load()
+
+
 def initialize_database():
     """
     Initialize MongoDB connection and create indexes
     """
-    global db
+    global db, profile_store, index_snapshots
     
     logger.info("Connecting to MongoDB...")
     
+    if Config.EMBEDDING_STORAGE not in STORAGE_FORMATS:
+        raise ValueError(f"EMBEDDING_STORAGE must be one of {STORAGE_FORMATS}")
+    
     try:
         client = MongoClient(Config.MONGODB_URI, serverSelectionTimeoutMS=5000)
         
@@ -162,7 +520,7 @@ def initialize_database():
         
         # Create indexes for better query performance
         logger.info("Creating database indexes...")
-        db.artworks.create_index([("clip_embedding", 1)])
+        db.artworks.create_index([("embedding_updated_at", 1)])
         db.artworks.create_index([("artist", 1)])
         db.artworks.create_index([("createdAt", -1)])
         
@@ -174,31 +532,317 @@ def initialize_database():
         logger.info(f"Database: {Config.DB_NAME}")
         logger.info(f"Total artworks: {artwork_count}")
         logger.info(f"Artworks with embeddings: {embedding_count}")
+        logger.info(f"Embedding storage format: {Config.EMBEDDING_STORAGE}")
+        
+        # Load embeddings into the in-memory index used by /recommend/*,
+        # mapping the host's shared snapshot when one exists
+        configure_search_engine()
+        if Config.INDEX_SNAPSHOT_DIR:
+            if index_snapshots is not None:
+                index_snapshots.stop()
+            index_snapshots = IndexSnapshotManager(
+                embedding_index,
+                Config.INDEX_SNAPSHOT_DIR,
+                Config.MODEL_NAME,
+                publish_interval=Config.INDEX_SNAPSHOT_INTERVAL,
+                on_remap=resync_index
+            )
+        if index_snapshots is None or not index_snapshots.load_current():
+            embedding_index.load(db.artworks)
+        
+        # Incrementally maintained user profiles for /recommend/personalized
+        profile_store = UserProfileStore(
+            db.user_profiles,
+            db.users,
+            embedding_index,
+            Config.MODEL_NAME,
+            weights=parse_weights(Config.PROFILE_WEIGHTS),
+            view_full_seconds=Config.PROFILE_VIEW_FULL_SECONDS,
+            half_life_days=Config.PROFILE_HALF_LIFE_DAYS,
+            centroids=Config.PROFILE_CENTROIDS,
+            view_window=Config.PROFILE_VIEW_WINDOW
+        )
         
     except Exception as e:
         logger.error(f"Failed to connect to MongoDB: {str(e)}")
         raise
 
 
-@lru_cache(maxsize=1000)
-def load_image_from_url(url):
+def configure_search_engine():
+    """
+    Configure the optional ANN engine of the embedding index from Config
+    """
+    engine = Config.SEARCH_ENGINE
+    if engine == 'exact':
+        embedding_index.configure_ann(None)
+        return
+    
+    if engine == 'ivf':
+        params = {'nlist': Config.IVF_NLIST or None, 'nprobe': Config.IVF_NPROBE}
+    elif engine == 'hnsw':
+        if hnswlib is None:
+            logger.warning("SEARCH_ENGINE=hnsw but hnswlib is not installed, using exact search")
+            embedding_index.configure_ann(None)
+            return
+        params = {
+            'm': Config.HNSW_M,
+            'ef_construction': Config.HNSW_EF_CONSTRUCTION,
+            'ef_search': Config.HNSW_EF_SEARCH
+        }
+    else:
+        raise ValueError(f"SEARCH_ENGINE must be 'exact' or one of {ANN_ENGINES}")
+    
+    embedding_index.configure_ann(
+        engine,
+        params,
+        min_size=Config.ANN_MIN_SIZE,
+        oversample=Config.ANN_OVERSAMPLE
+    )
+    logger.info(f"Search engine: {engine} (used from {Config.ANN_MIN_SIZE} artworks)")
+
+
+def start_index_watcher():
+    """
+    Start the background watcher that keeps the embedding index in sync
+    with writes made by other workers
+    """
+    global index_watcher
+    
+    if not Config.INDEX_WATCH_ENABLED:
+        logger.info("Embedding index watcher disabled")
+        return
+    
+    if index_watcher is not None:
+        index_watcher.stop()
+    
+    index_watcher = IndexWatcher(
+        embedding_index,
+        db.artworks,
+        poll_interval=Config.INDEX_POLL_INTERVAL
+    )
+    index_watcher.start()
+
+
+def start_neighbor_table():
+    """
+    Load (or build) the precomputed similar-artwork table and keep it
+    updated as embeddings change
+    """
+    global neighbor_table
+    
+    if not Config.NEIGHBORS_ENABLED:
+        logger.info("Neighbor table disabled")
+        return
+    
+    if neighbor_table is not None:
+        neighbor_table.stop()
+    
+    neighbor_table = NeighborTable(
+        embedding_index,
+        db.artwork_neighbors,
+        k=Config.NEIGHBORS_K,
+        model_name=Config.MODEL_NAME
+    )
+    neighbor_table.start()
+
+
+def resync_index(since):
+    """Re-apply writes newer than a remapped snapshot"""
+    if index_watcher is not None:
+        index_watcher.resync(since)
+
+
+def start_index_snapshots():
+    """
+    Start publishing (one worker per host) or following shared index snapshots
+    """
+    if index_snapshots is None:
+        return
+    if embedding_index.loaded_at and index_snapshots.mapped_version:
+        # Loaded from a snapshot: apply what changed since it was written
+        resync_index(embedding_index.loaded_at)
+    index_snapshots.start()
+
+
+def start_backfill_worker():
+    """
+    Start the background worker that runs (and resumes) backfill jobs
+    """
+    global backfill_manager
+    
+    if backfill_manager is not None:
+        backfill_manager.stop()
+    
+    backfill_manager = BackfillJobManager(
+        db.embedding_backfill_jobs,
+        db.artworks,
+        embed_artworks,
+        projection=EMBED_PROJECTION,
+        chunk_size=Config.BACKFILL_CHUNK_SIZE,
+        lease_seconds=Config.BACKFILL_LEASE_SECONDS
+    )
+    backfill_manager.start()
+
+
+def start_embedding_queue():
+    """
+    Start the worker that drains the per-upload embedding queue
+    """
+    global embedding_queue
+    
+    if not Config.EMBEDDING_QUEUE_ENABLED:
+        return
+    
+    if embedding_queue is not None:
+        embedding_queue.stop()
+    
+    embedding_queue = EmbeddingQueue(
+        db.embedding_jobs,
+        db.artworks,
+        process_embedding_jobs,
+        batch_size=Config.EMBEDDING_QUEUE_BATCH_SIZE,
+        poll_interval=Config.EMBEDDING_QUEUE_POLL_INTERVAL,
+        lease_seconds=Config.EMBEDDING_QUEUE_LEASE_SECONDS,
+        max_attempts=Config.EMBEDDING_QUEUE_MAX_ATTEMPTS,
+        backoff_seconds=Config.EMBEDDING_QUEUE_BACKOFF_SECONDS,
+        backoff_max_seconds=Config.EMBEDDING_QUEUE_BACKOFF_MAX,
+        sweep_interval=Config.EMBEDDING_QUEUE_SWEEP_INTERVAL,
+        retention_days=Config.EMBEDDING_JOB_RETENTION_DAYS
+    )
+    embedding_queue.start()
+
+
+# Fields embed_artworks needs: display metadata plus the stored provenance
+EMBED_PROJECTION = {**METADATA_PROJECTION, 'embedding_source': 1}
+
+# Outcomes of load_image_from_url
+IMAGE_CHANGED = 'changed'
+IMAGE_UNCHANGED = 'unchanged'
+IMAGE_FAILED = 'failed'
+
+
+def load_image_from_url(url, previous=None):
     """
-    Load and cache image from URL
+    Load image from URL through the byte-bounded image cache
+    
+    Depending on Config.IMAGE_CACHE_MODE the cache holds the decoded RGB
+    image ('image'), only the preprocessed 224x224 pixel tensor ('tensor'),
+    or the finished embedding keyed by URL plus content hash ('embedding').
+    Failed downloads are cached for IMAGE_CACHE_NEGATIVE_TTL seconds.
+    
+    If previous (the artwork's stored embedding_source) was computed with
+    the current model, tower variant and preprocessing, the cache is bypassed and the
+    download is conditional on its validators; a 304 or an identical
+    content hash is reported as unchanged without decoding.
     
     Args:
         url: Image URL
+        previous: Stored embedding_source to compare against, or None
         
     Returns:
-        PIL.Image or None if failed
+        Tuple of (status, image, source): status is IMAGE_CHANGED,
+        IMAGE_UNCHANGED or IMAGE_FAILED; image is a PIL.Image, pixel tensor
+        or cached embedding (all accepted by get_image_embeddings) for
+        IMAGE_CHANGED; source is the embedding_source to store with it
     """
+    model_name = embedding_model_name()
+    current = is_current(previous, model_name)
+    mode = Config.IMAGE_CACHE_MODE
+    if mode != 'off' and not current:
+        found, value = image_cache.get(url)
+        if found:
+            return (IMAGE_CHANGED, *value) if value else (IMAGE_FAILED, None, None)
+    
+    failure = 'download'
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        image = Image.open(BytesIO(response.content)).convert('RGB')
-        return image
+        with stage('download'):
+            headers = conditional_headers(previous, url) if current else {}
+            response = http_session.get(url, timeout=10, headers=headers)
+            if response.status_code == 304:
+                return IMAGE_UNCHANGED, None, previous
+            response.raise_for_status()
+            content = response.content
+        
+        source = build_source(url, content, response.headers, model_name)
+        if current and source['content_hash'] == previous['content_hash']:
+            return IMAGE_UNCHANGED, None, source
+        
+        if mode == 'embedding':
+            cache_key = (url, source['content_hash'])
+            found, embedding = image_cache.get(cache_key)
+            if found:
+                return IMAGE_CHANGED, embedding, source
+        
+        failure = 'decode'
+        with stage('decode'):
+            image = Image.open(BytesIO(content)).convert('RGB')
     except Exception as e:
         logger.error(f"Error loading image from {url}: {str(e)}")
-        return None
+        image_failures.inc(reason=failure)
+        if mode != 'off':
+            image_cache.set(url, None, 0)
+        return IMAGE_FAILED, None, None
+    
+    if mode == 'image':
+        image_cache.set(url, (image, source), image.width * image.height * 3)
+    elif mode == 'tensor':
+        with stage('decode'):
+            pixel_values = processor(images=image, return_tensors="pt")['pixel_values'][0]
+        image_cache.set(url, (pixel_values, source), pixel_values.numel() * pixel_values.element_size())
+        return IMAGE_CHANGED, pixel_values, source
+    elif mode == 'embedding':
+        # get_image_embeddings stores the result under this key
+        image.info['cache_key'] = cache_key
+    
+    return IMAGE_CHANGED, image, source
+
+
+def image_features(pixel_values):
+    """
+    Run the image tower on a batch of preprocessed images
+    
+    Args:
+        pixel_values: List of (3 x 224 x 224) pixel tensors
+        
+    Returns:
+        float32 array of unit-length embeddings, one row per image
+    """
+    inference_batch_size.set(len(pixel_values), tower='image')
+    if inference_client:
+        return inference_client.encode_images(torch.stack(pixel_values).numpy())
+    return towers.encode_images(torch.stack(pixel_values)).numpy()
+
+
+def text_features(texts):
+    """
+    Run the text tower on a batch of texts
+    
+    Args:
+        texts: List of text strings
+        
+    Returns:
+        float32 array of unit-length embeddings, one row per text
+    """
+    inference_batch_size.set(len(texts), tower='text')
+    if inference_client:
+        return inference_client.encode_texts(texts)
+    inputs = towers.tokenize(processor, texts)
+    return towers.encode_texts(inputs['input_ids'], inputs['attention_mask']).numpy()
+
+
+# One worker thread per tower merges concurrent requests into batched calls
+image_batcher = MicroBatcher(
+    image_features,
+    max_batch=Config.INFERENCE_MAX_BATCH,
+    max_wait_ms=Config.INFERENCE_BATCH_WINDOW_MS,
+    name='image-batcher'
+)
+text_batcher = MicroBatcher(
+    text_features,
+    max_batch=Config.INFERENCE_MAX_BATCH,
+    max_wait_ms=Config.INFERENCE_BATCH_WINDOW_MS,
+    name='text-batcher'
+)
 
 
 def get_image_embedding(image):
@@ -211,28 +855,67 @@ def get_image_embedding(image):
     Returns:
         List of floats (512-dimensional vector) or None if failed
     """
-    try:
-        # Preprocess image
-        inputs = processor(images=image, return_tensors="pt").to(device)
-        
-        # Generate embedding
-        with torch.no_grad():
-            image_features = model.get_image_features(**inputs)
-            # Normalize to unit length
-            image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+    embeddings = get_image_embeddings([image])
+    return embeddings[0] if embeddings else None
+
+
+def get_image_embeddings(images):
+    """
+    Generate CLIP embeddings for a batch of images
+    
+    Images are preprocessed in the calling thread; the forward pass runs on
+    image_batcher, batched together with concurrent requests.
+    
+    Args:
+        images: List of PIL.Image objects, preprocessed pixel tensors or
+            cached embeddings as returned by load_image_from_url
         
-        # Convert to list
-        embedding = image_features.cpu().numpy()[0].tolist()
-        return embedding
+    Returns:
+        List of embeddings (lists of floats), one per image, or None if failed
+    """
+    try:
+        embeddings = [None] * len(images)
+        pil_positions = []
+        tensor_positions = []
+        
+        for i, item in enumerate(images):
+            if isinstance(item, np.ndarray):
+                embeddings[i] = item.tolist()
+            elif torch.is_tensor(item):
+                tensor_positions.append(i)
+            else:
+                pil_positions.append(i)
+        
+        # Preprocess remaining images and stack everything into one batch
+        pixel_batches = []
+        if pil_positions:
+            with stage('decode'):
+                inputs = processor(images=[images[i] for i in pil_positions], return_tensors="pt")
+            pixel_batches.append(inputs['pixel_values'])
+        if tensor_positions:
+            pixel_batches.append(torch.stack([images[i] for i in tensor_positions]))
+        
+        if pixel_batches:
+            # Forward pass shared with concurrent requests
+            with stage('inference'):
+                features = image_batcher.submit_many(list(torch.cat(pixel_batches)))
+            for row, i in enumerate(pil_positions + tensor_positions):
+                embeddings[i] = features[row].tolist()
+                cache_key = getattr(images[i], 'info', {}).get('cache_key')
+                if cache_key:
+                    image_cache.set(cache_key, features[row], features[row].nbytes)
+        
+        return embeddings
         
     except Exception as e:
-        logger.error(f"Error generating image embedding: {str(e)}")
+        logger.error(f"Error generating image embeddings: {str(e)}")
         return None
 
 
 def get_text_embedding(text):
     """
-    Generate CLIP embedding for text
+    Generate CLIP embedding for text, served from text_cache when the
+    normalized query was seen before
     
     Args:
         text: Text string
@@ -240,23 +923,41 @@ def get_text_embedding(text):
     Returns:
         List of floats (512-dimensional vector) or None if failed
     """
-    try:
-        # Preprocess text
-        inputs = processor(text=[text], return_tensors="pt", padding=True).to(device)
-        
-        # Generate embedding
-        with torch.no_grad():
-            text_features = model.get_text_features(**inputs)
-            # Normalize to unit length
-            text_features = text_features / text_features.norm(dim=-1, keepdim=True)
-        
-        # Convert to list
-        embedding = text_features.cpu().numpy()[0].tolist()
-        return embedding
+    embeddings = get_text_embeddings([text])
+    return embeddings[0] if embeddings else None
+
+
+def get_text_embeddings(texts):
+    """
+    Generate CLIP embeddings for several texts
+    
+    Cached queries are served from text_cache; misses go through the text
+    tower on text_batcher, batched together with concurrent requests.
+    
+    Args:
+        texts: List of text strings
         
-    except Exception as e:
-        logger.error(f"Error generating text embedding: {str(e)}")
-        return None
+    Returns:
+        List of embeddings (lists of floats), one per text, or None if failed
+    """
+    embeddings = [text_cache.get_embedding(text) for text in texts]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    
+    if missing:
+        try:
+            # Forward pass shared with concurrent requests
+            with stage('inference'):
+                features = text_batcher.submit_many([texts[i] for i in missing])
+            for row, i in enumerate(missing):
+                embeddings[i] = features[row]
+                text_cache.set_embedding(texts[i], features[row])
+            
+        except Exception as e:
+            logger.error(f"Error generating text embedding: {str(e)}")
+            return None
+    
+    # Convert to lists
+    return [embedding.tolist() for embedding in embeddings]
 
 
 def cosine_similarity(embedding1, embedding2):
@@ -273,10 +974,135 @@ def cosine_similarity(embedding1, embedding2):
     return float(np.dot(embedding1, embedding2))
 
 
+# Fields a recommendation item can carry besides artwork_id
+RECOMMENDATION_FIELDS = ('similarity', 'title', 'artist_id', 'image', 'price', 'tags')
+
+
+def parse_fields(fields, include_tags=False):
+    """
+    Parse a "fields" selection of recommendation item fields
+    
+    Args:
+        fields: List or comma separated string, e.g. "title,image", or None
+            for the default set. artwork_id is always returned.
+        include_tags: Whether the endpoint returns tags by default
+        
+    Returns:
+        Tuple of field names
+        
+    Raises:
+        ValueError: If an unknown field is requested
+    """
+    if not fields:
+        return RECOMMENDATION_FIELDS if include_tags else RECOMMENDATION_FIELDS[:-1]
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    fields = tuple(f.strip() for f in fields if f.strip() and f.strip() != 'artwork_id')
+    unknown = [f for f in fields if f not in RECOMMENDATION_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields {unknown}, expected any of {list(RECOMMENDATION_FIELDS)}")
+    return fields
+
+
+def requested_fields(data, include_tags=False):
+    """Fields selected by the request body or the ?fields= query parameter"""
+    return parse_fields((data or {}).get('fields') or request.args.get('fields'), include_tags)
+
+
+def format_recommendations(results, include_tags=False, fields=None):
+    """
+    Build response items from embedding index search results
+    
+    Results are already cut to top_k, so only the winners are shaped.
+    
+    Args:
+        results: List of (artwork_id, similarity, metadata) tuples
+        include_tags: Whether to include the artwork tags
+        fields: Fields to include (see parse_fields); overrides include_tags
+        
+    Returns:
+        List of recommendation dicts
+    """
+    if fields is None:
+        fields = RECOMMENDATION_FIELDS if include_tags else RECOMMENDATION_FIELDS[:-1]
+    metadata_fields = [f for f in fields if f != 'similarity']
+    with_similarity = 'similarity' in fields
+    
+    recommendations = []
+    with stage('serialize'):
+        for artwork_id, similarity, metadata in results:
+            item = {'artwork_id': artwork_id}
+            if with_similarity:
+                item['similarity'] = similarity
+            for field in metadata_fields:
+                item[field] = metadata[field]
+            recommendations.append(item)
+    return recommendations
+
+
 # ============================================================================
 # API ENDPOINTS
 # ============================================================================
 
+# Paths answered while the service is still starting
+STARTUP_EXEMPT_PATHS = {'/', '/health', '/health/live', '/health/ready', '/metrics'}
+
+# Ranking modes of /recommend/text (see Config.TEXT_SEARCH_MODE)
+TEXT_SEARCH_MODES = ('dense', 'lexical', 'hybrid')
+
+
+@app.before_request
+def start_timing():
+    """Start collecting stage durations for this request"""
+    if Config.METRICS_ENABLED or Config.SERVER_TIMING:
+        start_request()
+
+
+@app.after_request
+def record_timing(response):
+    """Observe request and stage latencies and add the Server-Timing header"""
+    timer = finish_request()
+    if timer is None:
+        return response
+    
+    # Route templates keep label cardinality bounded
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    if Config.METRICS_ENABLED:
+        request_latency.observe(timer.elapsed(), endpoint=endpoint, method=request.method, status=response.status_code)
+        for name, seconds in timer.stages.items():
+            stage_latency.observe(seconds, endpoint=endpoint, stage=name)
+    if Config.SERVER_TIMING:
+        response.headers['Server-Timing'] = timer.server_timing()
+    return response
+
+
+@app.before_request
+def start_services_after_fork():
+    """
+    Start this worker's services on its first request if no post_fork hook
+    did (SERVICE_PRELOAD without gunicorn.conf.py)
+    """
+    if Config.SERVICE_PRELOAD:
+        start_worker_services()
+
+
+@app.before_request
+def require_ready():
+    """
+    Hold requests briefly while the service starts, then reject them with
+    503 instead of letting handlers dereference an unloaded model or db
+    """
+    if request.method == 'OPTIONS' or request.path in STARTUP_EXEMPT_PATHS:
+        return None
+    if service_ready.wait(Config.READY_WAIT_SECONDS):
+        return None
+    return jsonify({
+        'success': False,
+        'error': 'Service is starting, retry shortly',
+        'phase': startup_state['phase']
+    }), 503, {'Retry-After': '5'}
+
+
 @app.route('/', methods=['GET'])
 def root():
     """Root endpoint to verify service is running"""
@@ -286,6 +1112,33 @@ def root():
         'endpoints': ['/health', '/recommend/similar', '/recommend/text', '/recommend/personalized']
     })
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Metrics of this worker in Prometheus text format"""
+    if not Config.METRICS_ENABLED:
+        return jsonify({'success': False, 'error': 'Metrics are disabled'}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/health/live', methods=['GET'])
+def liveness():
+    """Liveness probe: the process is up and serving HTTP"""
+    return jsonify({'status': 'alive'})
+
+@app.route('/health/ready', methods=['GET'])
+def readiness():
+    """
+    Readiness probe: model, database and index are loaded
+    
+    Returns:
+        200 when ready, 503 with the startup phase (and error) otherwise
+    """
+    body = {
+        'ready': service_ready.is_set(),
+        'phase': startup_state['phase'],
+        'error': startup_state['error']
+    }
+    return jsonify(body), 200 if body['ready'] else 503
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """
@@ -295,28 +1148,56 @@ def health_check():
         JSON with service status
     """
     return jsonify({
-        'status': 'healthy',
+        'status': 'healthy' if service_ready.is_set() else 'starting',
+        'ready': service_ready.is_set(),
+        'startup': startup_state,
         'service': 'artscape-recommendation-service',
         'device': device,
-        'model_loaded': model is not None,
+        'model_loaded': model is not None or inference_client is not None,
         'db_connected': db is not None,
-        'model_name': Config.MODEL_NAME
+        'model_name': Config.MODEL_NAME,
+        'inference': {
+            'precision': towers.precision,
+            'mode': towers.mode,
+            'self_check': towers.self_check_result
+        } if towers else None,
+        'inference_server': inference_client.stats() if inference_client else None,
+        'indexed_artworks': len(embedding_index),
+        'search_engine': embedding_index.ann_stats(),
+        'lexical_index': embedding_index.lexical.stats(),
+        'image_cache': {'mode': Config.IMAGE_CACHE_MODE, **image_cache.stats()},
+        'text_cache': text_cache.stats(),
+        'index_watcher': index_watcher.stats() if index_watcher else None,
+        'index_snapshots': index_snapshots.stats() if index_snapshots else None,
+        'neighbor_table': neighbor_table.stats() if neighbor_table else None,
+        'user_profiles': profile_store.stats() if profile_store else None,
+        'embedding_queue': embedding_queue.stats() if embedding_queue else None,
+        'inference_batching': {'image': image_batcher.stats(), 'text': text_batcher.stats()}
     })
 
 
 @app.route('/generate-embedding', methods=['POST'])
 def generate_embedding():
     """
-    Generate and store embedding for a single artwork
+    Queue embedding generation for a single artwork
+    
+    The job is stored in the embedding_jobs queue and embedded by the drain
+    worker, so the call returns before the model runs. With "sync": true
+    (or EMBEDDING_QUEUE_ENABLED=false) the embedding is generated inline.
+    "queued": true means the caller already stored the job (the Node
+    server does); it is then only picked up, since rewriting it could revoke
+    a claim made in between.
     
     Request body:
         {
             "artwork_id": "artwork_id",
-            "image_url": "https://..."
+            "image_url": "https://...",
+            "queued": false,  // optional
+            "sync": false  // optional
         }
     
     Returns:
-        JSON with success status
+        JSON with the queued job (202), or the stored embedding's dimension
     """
     try:
         data = request.json
@@ -328,11 +1209,30 @@ def generate_embedding():
                 'success': False,
                 'error': 'Missing artwork_id or image_url'
             }), 400
+        if not ObjectId.is_valid(artwork_id):
+            return jsonify({
+                'success': False,
+                'error': 'Invalid artwork_id'
+            }), 400
+        
+        if embedding_queue is not None and not data.get('sync', False):
+            with stage('db_write'):
+                job = embedding_queue.find(artwork_id) if data.get('queued') else None
+                if job is None:
+                    job = embedding_queue.enqueue(artwork_id, image_url)
+                else:
+                    embedding_queue.notify()
+            return jsonify({
+                'success': True,
+                'artwork_id': artwork_id,
+                'status': job['status'],
+                'queued': True
+            }), 202
         
         logger.info(f"Generating embedding for artwork: {artwork_id}")
         
         # Load image
-        image = load_image_from_url(image_url)
+        _, image, source = load_image_from_url(image_url)
         if image is None:
             return jsonify({
                 'success': False,
@@ -348,22 +1248,28 @@ def generate_embedding():
             }), 500
         
         # Store in database
-        result = db.artworks.update_one(
-            {'_id': ObjectId(artwork_id)},
-            {
-                '$set': {
-                    'clip_embedding': embedding,
-                    'embedding_updated_at': datetime.utcnow()
-                }
-            }
-        )
+        with stage('db_write'):
+            artwork = db.artworks.find_one_and_update(
+                {'_id': ObjectId(artwork_id)},
+                {
+                    '$set': {
+                        'clip_embedding': encode_embedding(embedding, Config.EMBEDDING_STORAGE),
+                        'embedding_source': source,
+                        'embedding_updated_at': datetime.utcnow()
+                    }
+                },
+                projection=METADATA_PROJECTION
+            )
         
-        if result.matched_count == 0:
+        if artwork is None:
             return jsonify({
                 'success': False,
                 'error': 'Artwork not found'
             }), 404
         
+        # Make the new embedding searchable without a reload
+        embedding_index.upsert(artwork_id, embedding, artwork_metadata(artwork))
+        
         logger.info(f"✓ Embedding stored for artwork: {artwork_id}")
         
         return jsonify({
@@ -389,7 +1295,10 @@ def recommend_similar():
         {
             "artwork_id": "artwork_id",
             "top_k": 20,  // optional
-            "exclude_artist": false  // optional
+            "exclude_artist": false,  // optional
+            "filters": {"min_price": 0, "max_price": 500, "tags": ["abstract"]},  // optional
+            "engine": "exact",  // optional, bypass the ANN engine and neighbor table
+            "fields": ["title", "image"]  // optional, default all
         }
     
     Returns:
@@ -400,6 +1309,7 @@ def recommend_similar():
         artwork_id = data.get('artwork_id')
         top_k = data.get('top_k', Config.TOP_K)
         exclude_artist = data.get('exclude_artist', False)
+        exact = data.get('engine') == 'exact'
         
         if not artwork_id:
             return jsonify({
@@ -407,64 +1317,69 @@ def recommend_similar():
                 'error': 'Missing artwork_id'
             }), 400
         
+        try:
+            fields = requested_fields(data, include_tags=True)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
         logger.info(f"Finding similar artworks for: {artwork_id}")
         
-        # Get source artwork
-        source_artwork = db.artworks.find_one({'_id': ObjectId(artwork_id)})
-        if not source_artwork:
+        # Get source artwork from the in-memory index
+        source_embedding = embedding_index.get(artwork_id)
+        if source_embedding is None:
+            with stage('db_fetch'):
+                exists = db.artworks.find_one({'_id': ObjectId(artwork_id)}, {'_id': 1})
+            if not exists:
+                return jsonify({
+                    'success': False,
+                    'error': 'Artwork not found'
+                }), 404
             return jsonify({
                 'success': False,
-                'error': 'Artwork not found'
+                'error': 'Artwork does not have an embedding. Generate it first.'
             }), 404
         
-        if 'clip_embedding' not in source_artwork:
-            return jsonify({
-                'success': False,
-                'error': 'Artwork does not have an embedding. Generate it first.'
-            }), 404
-        
-        source_embedding = source_artwork['clip_embedding']
-        
-        # Build query
-        query = {
-            '_id': {'$ne': ObjectId(artwork_id)},
-            'clip_embedding': {'$exists': True}
-        }
-        
-        if exclude_artist and 'artist' in source_artwork:
-            query['artist'] = {'$ne': source_artwork['artist']}
-        
-        # Get all artworks with embeddings
-        artworks = list(db.artworks.find(query))
-        
-        if not artworks:
-            return jsonify({
-                'success': True,
-                'source_artwork_id': artwork_id,
-                'recommendations': [],
-                'total_compared': 0
-            })
-        
-        # Calculate similarities
-        similarities = []
-        for artwork in artworks:
-            similarity = cosine_similarity(source_embedding, artwork['clip_embedding'])
-            tags = artwork.get('tags', [])
-            if isinstance(tags, str):
-                tags = [t.strip() for t in tags.split(',')] if tags else []
-            similarities.append({
-                'artwork_id': str(artwork['_id']),
-                'similarity': float(similarity),
-                'title': artwork.get('title', 'Untitled'),
-                'artist_id': str(artwork.get('artist', 'Unknown')) if artwork.get('artist') else 'Unknown',
-                'image': artwork.get('image', ''),
-                'price': artwork.get('price', 0),
-                'tags': tags if isinstance(tags, list) else []
-            })
-        
-        # Sort by similarity and get top K
-        similarities.sort(key=lambda x: x['similarity'], reverse=True)
-        recommendations = similarities[:top_k]
+        # Unfiltered requests are answered from the precomputed table
+        if neighbor_table and not exclude_artist and not exact and not data.get('filters'):
+            with stage('search'):
+                neighbors = neighbor_table.get(artwork_id, top_k)
+            if neighbors is not None:
+                results = [
+                    (neighbor_id, score, embedding_index.get_metadata(neighbor_id))
+                    for neighbor_id, score in neighbors
+                    if neighbor_id in embedding_index
+                ]
+                return jsonify({
+                    'success': True,
+                    'source_artwork_id': artwork_id,
+                    'recommendations': format_recommendations(results, fields=fields),
+                    'total_compared': len(embedding_index) - 1,
+                    'engine': 'neighbor_table'
+                })
+        
+        exclude_artist_id = None
+        if exclude_artist:
+            source_metadata = embedding_index.get_metadata(artwork_id)
+            if source_metadata and source_metadata['artist_id'] != 'Unknown':
+                exclude_artist_id = source_metadata['artist_id']
+        
+        # Score indexed artworks with one matrix-vector product
+        filters = SearchFilter.from_request(
+            data.get('filters'),
+            exclude_ids=[artwork_id],
+            exclude_artist=exclude_artist_id
+        )
+        with stage('search'):
+            results, total_compared, engine = embedding_index.search(
+                source_embedding,
+                top_k,
+                filters=filters,
+                exact=exact
+            )
+        recommendations = format_recommendations(results, fields=fields)
         
         logger.info(f"✓ Found {len(recommendations)} similar artworks")
         
@@ -472,7 +1387,8 @@ def recommend_similar():
             'success': True,
             'source_artwork_id': artwork_id,
             'recommendations': recommendations,
-            'total_compared': len(similarities)
+            'total_compared': total_compared,
+            'engine': engine
         })
         
     except Exception as e:
@@ -491,7 +1407,11 @@ def recommend_by_text():
     Request body:
         {
             "query": "abstract painting with warm colors",
-            "top_k": 20  // optional
+            "top_k": 20,  // optional
+            "filters": {"artist_id": "...", "max_price": 500},  // optional
+            "engine": "exact",  // optional, bypass the ANN engine
+            "mode": "hybrid",  // optional, 'dense', 'lexical' or 'hybrid'
+            "fields": ["title", "image"]  // optional, default all
         }
     
     Returns:
@@ -500,59 +1420,68 @@ def recommend_by_text():
     try:
         data = request.json
         query_text = data.get('query')
-        top_k = data.get('top_k', Config.TOP_K)
+        top_k = int(data.get('top_k', Config.TOP_K))
+        exact = data.get('engine') == 'exact'
+        mode = data.get('mode', Config.TEXT_SEARCH_MODE)
         
         if not query_text:
             return jsonify({
                 'success': False,
                 'error': 'Missing query text'
             }), 400
-        
-        logger.info(f"Text search: '{query_text}'")
-        
-        # Generate text embedding
-        text_embedding = get_text_embedding(query_text)
-        if text_embedding is None:
+        if mode not in TEXT_SEARCH_MODES:
             return jsonify({
                 'success': False,
-                'error': 'Failed to generate text embedding'
-            }), 500
-        
-        # Get all artworks with embeddings
-        artworks = list(db.artworks.find({'clip_embedding': {'$exists': True}}))
+                'error': f"mode must be one of {list(TEXT_SEARCH_MODES)}"
+            }), 400
         
-        if not artworks:
+        try:
+            fields = requested_fields(data, include_tags=False)
+        except ValueError as e:
             return jsonify({
-                'success': True,
-                'query': query_text,
-                'recommendations': [],
-                'total_compared': 0
-            })
+                'success': False,
+                'error': str(e)
+            }), 400
         
-        # Calculate similarities
-        similarities = []
-        for artwork in artworks:
-            similarity = cosine_similarity(text_embedding, artwork['clip_embedding'])
-            similarities.append({
-                'artwork_id': str(artwork['_id']),
-                'similarity': float(similarity),
-                'title': artwork.get('title', 'Untitled'),
-                'artist_id': str(artwork.get('artist', 'Unknown')) if artwork.get('artist') else 'Unknown',
-                'image': artwork.get('image', ''),
-                'price': artwork.get('price', 0)
-            })
+        logger.info(f"Text search ({mode}): '{query_text}'")
+        filters = SearchFilter.from_request(data.get('filters'))
         
-        # Sort by similarity and get top K
-        similarities.sort(key=lambda x: x['similarity'], reverse=True)
-        recommendations = similarities[:top_k]
+        if mode == 'lexical':
+            # Title/tag matches only; no text tower forward pass
+            with stage('search'):
+                results = embedding_index.lexical_search(query_text, top_k, filters)
+            total_compared = len(results)
+            engine = 'lexical'
+        else:
+            text_embedding = get_text_embedding(query_text)
+            if text_embedding is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Failed to generate text embedding'
+                }), 500
+            
+            with stage('search'):
+                if mode == 'hybrid':
+                    results, total_compared, engine = hybrid_search(query_text, text_embedding, top_k, filters, exact)
+                else:
+                    # Score indexed artworks with one matrix-vector product
+                    results, total_compared, engine = embedding_index.search(
+                        text_embedding,
+                        top_k,
+                        filters=filters,
+                        exact=exact
+                    )
+        recommendations = format_recommendations(results, fields=fields)
         
         logger.info(f"✓ Found {len(recommendations)} matching artworks")
         
         return jsonify({
             'success': True,
             'query': query_text,
+            'mode': mode,
             'recommendations': recommendations,
-            'total_compared': len(similarities)
+            'total_compared': total_compared,
+            'engine': engine
         })
         
     except Exception as e:
@@ -563,6 +1492,229 @@ def recommend_by_text():
         }), 500
 
 
+def hybrid_search(query_text, text_embedding, top_k, filters, exact=False):
+    """
+    Fuse the lexical and dense rankings of a text query
+    
+    Both rankings fetch TEXT_HYBRID_CANDIDATES candidates and are merged by
+    reciprocal-rank fusion. Lexical-only candidates are scored against the
+    query embedding so every result carries its CLIP similarity.
+    
+    Returns:
+        (results, total_compared, engine) like EmbeddingIndex.search,
+        ordered by fused rank
+    """
+    fetch_k = max(top_k, Config.TEXT_HYBRID_CANDIDATES)
+    lexical = embedding_index.lexical_search(query_text, fetch_k, filters)
+    dense, total_compared, engine = embedding_index.search(text_embedding, fetch_k, filters=filters, exact=exact)
+    
+    fused = reciprocal_rank_fusion([
+        [artwork_id for artwork_id, _, _ in lexical],
+        [artwork_id for artwork_id, _, _ in dense]
+    ])[:top_k]
+    
+    scored = {artwork_id: (similarity, metadata) for artwork_id, similarity, metadata in dense}
+    missing = [artwork_id for artwork_id, _ in fused if artwork_id not in scored]
+    if missing:
+        scored.update(embedding_index.score(text_embedding, missing))
+    
+    results = [
+        (artwork_id, scored[artwork_id][0], scored[artwork_id][1])
+        for artwork_id, _ in fused
+        if artwork_id in scored
+    ]
+    return results, total_compared, f"hybrid+{engine}"
+
+
+@app.route('/recommend/similar/batch', methods=['POST'])
+def recommend_similar_batch():
+    """
+    Get similar artworks for many artworks at once
+    
+    All source embeddings are stacked and scored with one matrix-matrix
+    product followed by a row-wise top-k.
+    
+    Request body:
+        {
+            "artwork_ids": ["artwork_id", ...],
+            "top_k": 20,  // optional
+            "exclude_artist": false,  // optional
+            "filters": {"max_price": 500},  // optional, applied to every query
+            "fields": ["title", "image"]  // optional, default all
+        }
+    
+    Returns:
+        JSON with one result per artwork id, in request order
+    """
+    try:
+        data = request.json or {}
+        artwork_ids = data.get('artwork_ids') or []
+        top_k = data.get('top_k', Config.TOP_K)
+        exclude_artist = data.get('exclude_artist', False)
+        
+        if not artwork_ids or not isinstance(artwork_ids, list):
+            return jsonify({
+                'success': False,
+                'error': 'Missing artwork_ids'
+            }), 400
+        
+        if len(artwork_ids) > Config.MAX_BATCH_QUERIES:
+            return jsonify({
+                'success': False,
+                'error': f'At most {Config.MAX_BATCH_QUERIES} artwork_ids per request'
+            }), 400
+        
+        try:
+            fields = requested_fields(data, include_tags=True)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        logger.info(f"Finding similar artworks for {len(artwork_ids)} artworks")
+        
+        results = [None] * len(artwork_ids)
+        positions = []
+        queries = []
+        filters = []
+        
+        for i, artwork_id in enumerate(artwork_ids):
+            embedding = embedding_index.get(artwork_id)
+            if embedding is None:
+                results[i] = {
+                    'source_artwork_id': artwork_id,
+                    'recommendations': [],
+                    'error': 'Artwork not found or has no embedding'
+                }
+                continue
+            
+            exclude_artist_id = None
+            if exclude_artist:
+                metadata = embedding_index.get_metadata(artwork_id)
+                if metadata and metadata['artist_id'] != 'Unknown':
+                    exclude_artist_id = metadata['artist_id']
+            
+            positions.append(i)
+            queries.append(embedding)
+            filters.append(SearchFilter.from_request(
+                data.get('filters'),
+                exclude_ids=[artwork_id],
+                exclude_artist=exclude_artist_id
+            ))
+        
+        if queries:
+            with stage('search'):
+                batch_results = embedding_index.search_batch(np.stack(queries), top_k, filters)
+            for i, (matches, total_compared) in zip(positions, batch_results):
+                results[i] = {
+                    'source_artwork_id': artwork_ids[i],
+                    'recommendations': format_recommendations(matches, fields=fields),
+                    'total_compared': total_compared
+                }
+        
+        logger.info(f"✓ Answered {len(queries)} similar-artwork queries in one batch")
+        
+        return jsonify({
+            'success': True,
+            'results': results,
+            'engine': 'exact'
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in recommend_similar_batch: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/recommend/text/batch', methods=['POST'])
+def recommend_by_text_batch():
+    """
+    Get artworks for many text descriptions at once
+    
+    Uncached queries share one text-tower forward pass and all queries are
+    scored with one matrix-matrix product.
+    
+    Request body:
+        {
+            "queries": ["abstract painting", "portrait in oil", ...],
+            "top_k": 20,  // optional
+            "filters": {"max_price": 500},  // optional, applied to every query
+            "fields": ["title", "image"]  // optional, default all
+        }
+    
+    Returns:
+        JSON with one result per query, in request order
+    """
+    try:
+        data = request.json or {}
+        queries = data.get('queries') or []
+        top_k = data.get('top_k', Config.TOP_K)
+        
+        if not queries or not isinstance(queries, list) or not all(isinstance(q, str) and q for q in queries):
+            return jsonify({
+                'success': False,
+                'error': 'Missing queries'
+            }), 400
+        
+        if len(queries) > Config.MAX_BATCH_QUERIES:
+            return jsonify({
+                'success': False,
+                'error': f'At most {Config.MAX_BATCH_QUERIES} queries per request'
+            }), 400
+        
+        try:
+            fields = requested_fields(data, include_tags=False)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        logger.info(f"Batch text search: {len(queries)} queries")
+        
+        text_embeddings = get_text_embeddings(queries)
+        if text_embeddings is None:
+            return jsonify({
+                'success': False,
+                'error': 'Failed to generate text embeddings'
+            }), 500
+        
+        query_filter = SearchFilter.from_request(data.get('filters'))
+        with stage('search'):
+            batch_results = embedding_index.search_batch(
+                np.asarray(text_embeddings, dtype=np.float32),
+                top_k,
+                [query_filter] * len(queries)
+            )
+        
+        results = [
+            {
+                'query': query_text,
+                'recommendations': format_recommendations(matches, fields=fields),
+                'total_compared': total_compared
+            }
+            for query_text, (matches, total_compared) in zip(queries, batch_results)
+        ]
+        
+        logger.info(f"✓ Answered {len(queries)} text queries in one batch")
+        
+        return jsonify({
+            'success': True,
+            'results': results,
+            'engine': 'exact'
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in recommend_by_text_batch: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
 @app.route('/recommend/personalized', methods=['POST'])
 def recommend_personalized():
     """
@@ -571,7 +1723,10 @@ def recommend_personalized():
     Request body:
         {
             "user_id": "user_id",
-            "top_k": 20  // optional
+            "top_k": 20,  // optional
+            "filters": {"min_price": 100, "tags": ["portrait"]},  // optional
+            "engine": "exact",  // optional, bypass the ANN engine
+            "fields": ["title", "image"]  // optional, default all
         }
     
     Returns:
@@ -581,6 +1736,7 @@ def recommend_personalized():
         data = request.json
         user_id = data.get('user_id')
         top_k = data.get('top_k', Config.TOP_K)
+        exact = data.get('engine') == 'exact'
         
         if not user_id:
             return jsonify({
@@ -588,28 +1744,26 @@ def recommend_personalized():
                 'error': 'Missing user_id'
             }), 400
         
+        try:
+            fields = requested_fields(data, include_tags=False)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
         logger.info(f"Getting personalized recommendations for user: {user_id}")
         
-        # Get user's liked/purchased artworks
-        user = db.users.find_one({'_id': ObjectId(user_id)})
-        if not user:
+        # Read the persisted profile (rebuilt from the user document if stale)
+        with stage('db_fetch'):
+            profile = profile_store.get(user_id)
+        if profile is None:
             return jsonify({
                 'success': False,
                 'error': 'User not found'
             }), 404
         
-        liked_artwork_ids = [str(a) for a in user.get('likedArtworks', [])]
-        saved_artwork_ids = [str(a) for a in user.get('savedArtworks', [])]
-        purchased_artwork_ids = [str(a) for a in user.get('purchasedArtworks', [])]
-        cart_additions = [str(a) for a in user.get('cartAdditions', [])]
-        viewed = user.get('viewedArtworks', [])
-        viewed_artwork_ids = [str(v.get('artwork')) for v in viewed if v.get('artwork')]
-        
-        # Combine interactions (saves, likes, purchases, cart = strong; views = additional)
-        interaction_ids = list(set(
-            liked_artwork_ids + saved_artwork_ids + purchased_artwork_ids + cart_additions + viewed_artwork_ids
-        ))
-        
+        interaction_ids = profile['interaction_ids']
         if not interaction_ids:
             return jsonify({
                 'success': True,
@@ -619,13 +1773,7 @@ def recommend_personalized():
                 'message': 'No user history available. Like or purchase artworks to get personalized recommendations.'
             })
         
-        # Get embeddings of user's interacted artworks
-        interacted_artworks = list(db.artworks.find({
-            '_id': {'$in': [ObjectId(aid) for aid in interaction_ids]},
-            'clip_embedding': {'$exists': True}
-        }))
-        
-        if not interacted_artworks:
+        if profile['vectors'] is None:
             return jsonify({
                 'success': True,
                 'user_id': user_id,
@@ -634,52 +1782,50 @@ def recommend_personalized():
                 'message': 'No embeddings found for user history'
             })
         
-        # Calculate average embedding (user profile)
-        user_embeddings = [art['clip_embedding'] for art in interacted_artworks]
-        user_profile_embedding = np.mean(user_embeddings, axis=0).tolist()
-        
-        logger.info(f"User profile based on {len(interacted_artworks)} artworks")
-        
-        # Get all artworks excluding already interacted ones
-        all_artworks = list(db.artworks.find({
-            '_id': {'$nin': [ObjectId(aid) for aid in interaction_ids]},
-            'clip_embedding': {'$exists': True}
-        }))
+        logger.info(f"User profile based on {profile['count']} artworks, {len(profile['vectors'])} centroids")
+        
+        # Score all artworks excluding already interacted ones
+        filters = SearchFilter.from_request(data.get('filters'), exclude_ids=interaction_ids)
+        with stage('search'):
+            if len(profile['vectors']) == 1:
+                results, total_compared, engine = embedding_index.search(
+                    profile['vectors'][0],
+                    top_k,
+                    filters=filters,
+                    exact=exact
+                )
+            else:
+                # One query per taste cluster, answered by a single batched search
+                batch = embedding_index.search_batch(
+                    profile['vectors'],
+                    top_k,
+                    filters=[filters] * len(profile['vectors'])
+                )
+                results = merge_centroid_results([r for r, _ in batch], profile['weights'], top_k)
+                total_compared = batch[0][1]
+                engine = 'exact'
         
-        if not all_artworks:
+        if total_compared == 0:
             return jsonify({
                 'success': True,
                 'user_id': user_id,
-                'based_on_items': len(interacted_artworks),
+                'based_on_items': profile['count'],
                 'recommendations': [],
                 'message': 'No new artworks to recommend'
             })
         
-        # Calculate similarities
-        similarities = []
-        for artwork in all_artworks:
-            similarity = cosine_similarity(user_profile_embedding, artwork['clip_embedding'])
-            similarities.append({
-                'artwork_id': str(artwork['_id']),
-                'similarity': float(similarity),
-                'title': artwork.get('title', 'Untitled'),
-                'artist_id': str(artwork.get('artist', 'Unknown')) if artwork.get('artist') else 'Unknown',
-                'image': artwork.get('image', ''),
-                'price': artwork.get('price', 0)
-            })
-        
-        # Sort by similarity and get top K
-        similarities.sort(key=lambda x: x['similarity'], reverse=True)
-        recommendations = similarities[:top_k]
+        recommendations = format_recommendations(results, fields=fields)
         
         logger.info(f"✓ Generated {len(recommendations)} personalized recommendations")
         
         return jsonify({
             'success': True,
             'user_id': user_id,
-            'based_on_items': len(interacted_artworks),
+            'based_on_items': profile['count'],
+            'profile_centroids': len(profile['vectors']),
             'recommendations': recommendations,
-            'total_compared': len(similarities)
+            'total_compared': total_compared,
+            'engine': engine
         })
         
     except Exception as e:
@@ -690,14 +1836,308 @@ def recommend_personalized():
         }), 500
 
 
+@app.route('/profiles/interaction', methods=['POST'])
+def record_interaction():
+    """
+    Update a user's profile vector with a tracked interaction
+    
+    Request body:
+        {
+            "user_id": "user_id",
+            "artwork_id": "artwork_id",
+            "interaction": "like",  // like, save, purchase, cart or view
+            "removed": false,  // optional, true for unlike/unsave
+            "duration_seconds": 12  // optional, view duration
+        }
+    
+    Returns:
+        JSON with success status
+    """
+    try:
+        data = request.json
+        user_id = data.get('user_id')
+        artwork_id = data.get('artwork_id')
+        interaction = data.get('interaction')
+        
+        if not user_id or not artwork_id or interaction not in INTERACTION_TYPES:
+            return jsonify({
+                'success': False,
+                'error': f"Missing user_id or artwork_id, or interaction not in {INTERACTION_TYPES}"
+            }), 400
+        
+        if data.get('removed'):
+            # The artwork may still be held by another interaction type
+            profile_store.invalidate(user_id)
+        else:
+            profile_store.record(
+                user_id,
+                artwork_id,
+                interaction,
+                duration_seconds=data.get('duration_seconds', 0)
+            )
+        
+        return jsonify({
+            'success': True,
+            'user_id': user_id
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in record_interaction: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/profiles/<user_id>/rebuild', methods=['POST'])
+def rebuild_profile(user_id):
+    """
+    Rebuild a user's profile vector from their history, e.g. after the
+    history was edited
+    
+    Returns:
+        JSON with the number of artworks in the profile
+    """
+    try:
+        profile = profile_store.rebuild(user_id)
+        if profile is None:
+            return jsonify({
+                'success': False,
+                'error': 'User not found'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'user_id': user_id,
+            'based_on_items': profile['count']
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in rebuild_profile: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+def embed_and_store(batch):
+    """
+    Embed a batch of loaded images and store the results
+    
+    Runs one forward pass for the whole batch and writes all embeddings
+    with a single bulk_write. If the batched pass fails, images are
+    embedded one by one so a single bad image only fails its own artwork.
+    
+    Args:
+        batch: List of (artwork, PIL.Image, embedding_source) tuples
+        
+    Returns:
+        Tuple of (stored artwork ids, failed artwork ids)
+    """
+    if not batch:
+        return [], []
+    
+    embeddings = get_image_embeddings([image for _, image, _ in batch])
+    if embeddings is None:
+        logger.warning(f"Batched inference failed, retrying {len(batch)} images individually")
+        embeddings = [get_image_embedding(image) for _, image, _ in batch]
+    
+    updated_at = datetime.utcnow()
+    operations = []
+    stored = []
+    failed = []
+    
+    for (artwork, _, source), embedding in zip(batch, embeddings):
+        if embedding is None:
+            logger.warning(f"Failed to generate embedding for artwork {artwork['_id']}")
+            failed.append(artwork['_id'])
+            continue
+        operations.append(UpdateOne(
+            {'_id': artwork['_id']},
+            {
+                '$set': {
+                    'clip_embedding': encode_embedding(embedding, Config.EMBEDDING_STORAGE),
+                    'embedding_source': source,
+                    'embedding_updated_at': updated_at
+                }
+            }
+        ))
+        stored.append((artwork, embedding))
+    
+    if not operations:
+        return [], failed
+    
+    try:
+        db.artworks.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        failed_indexes = {error['index'] for error in e.details.get('writeErrors', [])}
+        for index in sorted(failed_indexes):
+            logger.error(f"Error storing embedding for artwork {stored[index][0]['_id']}")
+            failed.append(stored[index][0]['_id'])
+        stored = [item for index, item in enumerate(stored) if index not in failed_indexes]
+    
+    for artwork, embedding in stored:
+        embedding_index.upsert(artwork['_id'], embedding, artwork_metadata(artwork))
+    
+    return [artwork['_id'] for artwork, _ in stored], failed
+
+
+def process_embedding_jobs(jobs):
+    """
+    Embed the artworks of a batch of embedding_jobs documents
+    
+    Missing artworks and artworks without an image fail permanently; failed
+    downloads and inference errors are retried by the queue with backoff.
+    
+    Args:
+        jobs: List of job documents (_id is the artwork id)
+        
+    Returns:
+        Dict of artwork id -> None on success or JobFailure
+    """
+    with stage('db_fetch'):
+        artworks = {
+            artwork['_id']: artwork
+            for artwork in db.artworks.find({'_id': {'$in': [job['_id'] for job in jobs]}}, METADATA_PROJECTION)
+        }
+    
+    outcomes = {}
+    loadable = []
+    for job in jobs:
+        artwork = artworks.get(job['_id'])
+        if artwork is None:
+            outcomes[job['_id']] = JobFailure('Artwork not found', permanent=True)
+        elif not (artwork.get('image') or job.get('image_url')):
+            outcomes[job['_id']] = JobFailure('Artwork has no image', permanent=True)
+        else:
+            # The artwork's current image wins over the URL it was queued with
+            artwork['image'] = artwork.get('image') or job['image_url']
+            loadable.append(artwork)
+    
+    batch = []
+    images = prefetch_images(
+        loadable,
+        lambda artwork: load_image_from_url(artwork['image']),
+        workers=Config.DOWNLOAD_WORKERS,
+        max_pending=len(loadable)
+    )
+    for artwork, result in images:
+        # prefetch_images yields None if the loader raised
+        _, image, source = result or (IMAGE_FAILED, None, None)
+        if image is None:
+            outcomes[artwork['_id']] = JobFailure('Failed to load image')
+        else:
+            batch.append((artwork, image, source))
+    
+    for start in range(0, len(batch), Config.BATCH_SIZE):
+        stored, failed = embed_and_store(batch[start:start + Config.BATCH_SIZE])
+        for artwork_id in stored:
+            outcomes[artwork_id] = None
+        for artwork_id in failed:
+            outcomes[artwork_id] = JobFailure('Failed to generate or store embedding')
+    
+    logger.info(f"✓ Embedding queue batch: {len(batch)} embedded, {len(jobs) - len(batch)} not loadable")
+    return outcomes
+
+
+def embed_artworks(artworks, skip_unchanged=False):
+    """
+    Download, embed and store a sequence of artworks
+    
+    Images are prefetched on a thread pool and embedded in batches of
+    Config.BATCH_SIZE. With skip_unchanged, artworks whose stored
+    embedding_source shows the same image content, model and preprocessing
+    are only checked (conditional GET or content hash), not re-embedded.
+    
+    Args:
+        artworks: Iterable of artwork documents (needs _id, image, the
+            display fields and, for skip_unchanged, embedding_source)
+        skip_unchanged: Skip artworks whose embedding is still current
+        
+    Returns:
+        Tuple of (processed, failed, skipped) counts
+    """
+    processed = 0
+    failed = 0
+    skipped = 0
+    batch = []
+    refreshed = []
+    
+    loadable = []
+    for artwork in artworks:
+        if artwork.get('image'):
+            loadable.append(artwork)
+        else:
+            logger.warning(f"Artwork {artwork['_id']} has no image_url")
+            failed += 1
+    
+    def load(artwork):
+        previous = artwork.get('embedding_source') if skip_unchanged else None
+        return load_image_from_url(artwork['image'], previous)
+    
+    # Download and decode images on a thread pool while earlier batches
+    # are running inference; at most PREFETCH_BATCHES batches are held
+    images = prefetch_images(
+        loadable,
+        load,
+        workers=Config.DOWNLOAD_WORKERS,
+        max_pending=Config.BATCH_SIZE * Config.PREFETCH_BATCHES
+    )
+    
+    for i, (artwork, result) in enumerate(images, 1):
+        status, image, source = result or (IMAGE_FAILED, None, None)
+        
+        if status == IMAGE_UNCHANGED:
+            skipped += 1
+            # Keep the validators fresh so the next check can be a 304
+            if source != artwork.get('embedding_source'):
+                refreshed.append(UpdateOne({'_id': artwork['_id']}, {'$set': {'embedding_source': source}}))
+            continue
+        
+        if image is None:
+            logger.warning(f"Failed to load image for artwork {artwork['_id']}")
+            failed += 1
+            continue
+        
+        batch.append((artwork, image, source))
+        
+        if len(batch) >= Config.BATCH_SIZE:
+            stored, not_stored = embed_and_store(batch)
+            processed += len(stored)
+            failed += len(not_stored)
+            batch = []
+            logger.info(f"Progress: {i}/{len(loadable)} artworks processed")
+    
+    # Embed the final partial batch
+    stored, not_stored = embed_and_store(batch)
+    processed += len(stored)
+    failed += len(not_stored)
+    
+    if refreshed:
+        try:
+            db.artworks.bulk_write(refreshed, ordered=False)
+        except BulkWriteError as e:
+            logger.error(f"Error refreshing {len(e.details.get('writeErrors', []))} embedding sources")
+    
+    if skipped:
+        logger.info(f"Skipped {skipped} artworks with unchanged image, model and preprocessing")
+    
+    return processed, failed, skipped
+
+
 @app.route('/batch-generate-embeddings', methods=['POST'])
 def batch_generate_embeddings():
     """
     Generate embeddings for multiple artworks in batch
     
+    With force_regenerate, artworks whose image, model and preprocessing
+    are unchanged since their embedding was stored are skipped unless
+    reembed_unchanged is set.
+    
     Request body:
         {
             "force_regenerate": false,  // optional
+            "reembed_unchanged": false,  // optional
             "limit": 100  // optional
         }
     
@@ -707,6 +2147,7 @@ def batch_generate_embeddings():
     try:
         data = request.json or {}
         force_regenerate = data.get('force_regenerate', False)
+        skip_unchanged = force_regenerate and not data.get('reembed_unchanged', False)
         limit = data.get('limit', 100)
         
         logger.info(f"Batch processing: force_regenerate={force_regenerate}, limit={limit}")
@@ -717,7 +2158,7 @@ def batch_generate_embeddings():
         else:
             query = {'clip_embedding': {'$exists': False}}
         
-        artworks = list(db.artworks.find(query).limit(limit))
+        artworks = list(db.artworks.find(query, EMBED_PROJECTION).limit(limit))
         
         if not artworks:
             return jsonify({
@@ -725,64 +2166,21 @@ def batch_generate_embeddings():
                 'message': 'No artworks to process',
                 'processed': 0,
                 'failed': 0,
+                'skipped': 0,
                 'total': 0
             })
         
-        logger.info(f"Processing {len(artworks)} artworks...")
-        
-        processed = 0
-        failed = 0
-        
-        for i, artwork in enumerate(artworks, 1):
-            try:
-                artwork_id = artwork['_id']
-                image_url = artwork.get('image')
-                
-                if not image_url:
-                    logger.warning(f"Artwork {artwork_id} has no image_url")
-                    failed += 1
-                    continue
-                
-                # Load image
-                image = load_image_from_url(image_url)
-                if image is None:
-                    logger.warning(f"Failed to load image for artwork {artwork_id}")
-                    failed += 1
-                    continue
-                
-                # Generate embedding
-                embedding = get_image_embedding(image)
-                if embedding is None:
-                    logger.warning(f"Failed to generate embedding for artwork {artwork_id}")
-                    failed += 1
-                    continue
-                
-                # Update database
-                db.artworks.update_one(
-                    {'_id': artwork_id},
-                    {
-                        '$set': {
-                            'embedding': embedding,
-                            'embedding_updated_at': datetime.utcnow()
-                        }
-                    }
-                )
-                
-                processed += 1
-                
-                if i % 10 == 0:
-                    logger.info(f"Progress: {i}/{len(artworks)} artworks processed")
-                
-            except Exception as e:
-                logger.error(f"Error processing artwork {artwork.get('_id')}: {str(e)}")
-                failed += 1
-        
-        logger.info(f"✓ Batch processing complete: {processed} successful, {failed} failed")
+        logger.info(f"Processing {len(artworks)} artworks in batches of {Config.BATCH_SIZE}...")
+        
+        processed, failed, skipped = embed_artworks(artworks, skip_unchanged=skip_unchanged)
+        
+        logger.info(f"✓ Batch processing complete: {processed} successful, {failed} failed, {skipped} unchanged")
         
         return jsonify({
             'success': True,
             'processed': processed,
             'failed': failed,
+            'skipped': skipped,
             'total': len(artworks)
         })
         
@@ -794,28 +2192,250 @@ def batch_generate_embeddings():
         }), 500
 
 
+@app.route('/jobs/backfill', methods=['POST'])
+def create_backfill_job():
+    """
+    Start a resumable background embedding backfill
+    
+    Request body:
+        {
+            "force_regenerate": false,  // optional
+            "reembed_unchanged": false,  // optional, see /batch-generate-embeddings
+            "limit": 1000  // optional, default: all artworks
+        }
+    
+    Returns:
+        JSON with the queued job (202)
+    """
+    try:
+        data = request.json or {}
+        job = backfill_manager.submit(
+            force_regenerate=data.get('force_regenerate', False),
+            limit=data.get('limit'),
+            reembed_unchanged=data.get('reembed_unchanged', False)
+        )
+        
+        return jsonify({
+            'success': True,
+            'job': job_to_dict(job)
+        }), 202
+        
+    except Exception as e:
+        logger.error(f"Error in create_backfill_job: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/jobs/embeddings', methods=['GET'])
+def get_embedding_queue():
+    """
+    Get the embedding queue's job counts and recent dead-lettered jobs
+    
+    Returns:
+        JSON with queue status
+    """
+    try:
+        if embedding_queue is None:
+            return jsonify({
+                'success': False,
+                'error': 'Embedding queue disabled'
+            }), 404
+        
+        dead = db.embedding_jobs.find(
+            {'status': JOB_DEAD},
+            {'image_url': 1, 'attempts': 1, 'last_error': 1, 'dead_at': 1}
+        ).sort('dead_at', -1).limit(20)
+        
+        return jsonify({
+            'success': True,
+            'counts': embedding_queue.counts(),
+            'worker': embedding_queue.stats(),
+            'dead_letters': [
+                {
+                    'artwork_id': str(job['_id']),
+                    'image_url': job.get('image_url'),
+                    'attempts': job.get('attempts'),
+                    'error': job.get('last_error'),
+                    'dead_at': job['dead_at'].isoformat() + 'Z' if job.get('dead_at') else None
+                }
+                for job in dead
+            ]
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in get_embedding_queue: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/jobs/embeddings/retry-dead', methods=['POST'])
+def retry_dead_embedding_jobs():
+    """
+    Requeue all dead-lettered embedding jobs (e.g. after fixing image URLs)
+    
+    Returns:
+        JSON with the number of requeued jobs
+    """
+    try:
+        if embedding_queue is None:
+            return jsonify({
+                'success': False,
+                'error': 'Embedding queue disabled'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'requeued': embedding_queue.retry_dead()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in retry_dead_embedding_jobs: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_backfill_job(job_id):
+    """
+    Get progress and throughput of a backfill job
+    
+    Returns:
+        JSON with job status
+    """
+    try:
+        job = backfill_manager.get(job_id)
+        if not job:
+            return jsonify({
+                'success': False,
+                'error': 'Job not found'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'job': job_to_dict(job)
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in get_backfill_job: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_backfill_job(job_id):
+    """
+    Cancel a backfill job; running jobs stop at their next checkpoint
+    
+    Returns:
+        JSON with job status
+    """
+    try:
+        job = backfill_manager.cancel(job_id)
+        if not job:
+            return jsonify({
+                'success': False,
+                'error': 'Job not found'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'job': job_to_dict(job)
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in cancel_backfill_job: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
 # ============================================================================
 # INITIALIZATION (runs on import for gunicorn/Railway)
 # ============================================================================
 
 # Initialize services asynchronously to avoid blocking startup
-import threading
-import time
+import atexit
+import gc
 
-def async_initialize():
-    """Initialize services in background thread"""
+# Persist the text embedding cache on shutdown
+atexit.register(text_cache.save)
+
+def initialize_services():
+    """
+    Load everything request handlers depend on, then mark the service ready
+    
+    The model is skipped if it was already loaded before fork; its towers
+    are only traced and checked here, in the worker.
+    """
     try:
-        logger.info("Starting async initialization...")
-        time.sleep(2)  # Give server time to start
-        initialize_model()
+        if model is None and inference_client is None:
+            startup_state['phase'] = 'loading_model'
+            initialize_model()
+        elif towers is not None and not towers.prepared:
+            startup_state['phase'] = 'preparing_model'
+            prepare_towers()
+        if inference_client is not None:
+            startup_state['phase'] = 'connecting_inference_server'
+            wait_for_inference_server()
+        startup_state['phase'] = 'loading_index'
         initialize_database()
+        startup_state['phase'] = 'starting_workers'
+        start_index_watcher()
+        start_index_snapshots()
+        start_neighbor_table()
+        start_backfill_worker()
+        start_embedding_queue()
+        startup_state['phase'] = 'ready'
+        service_ready.set()
         logger.info("✓ Services initialized successfully")
     except Exception as e:
+        startup_state['phase'] = 'failed'
+        startup_state['error'] = str(e)
         logger.error(f"Failed to initialize services: {str(e)}")
 
-# Start initialization in background
-init_thread = threading.Thread(target=async_initialize, daemon=True)
-init_thread.start()
+
+def start_worker_services():
+    """
+    Start per-process services in a forked worker (gunicorn post_fork)
+    
+    MongoDB clients and threads do not survive fork, so each worker opens
+    its own connection, index and background threads. Only the first call
+    in a process starts them, so request hooks can call it as a fallback
+    when the server has no post_fork hook.
+    """
+    global services_pid
+    
+    with services_lock:
+        if services_pid == os.getpid():
+            return
+        services_pid = os.getpid()
+    configure_threads(Config.TORCH_INTRA_OP_THREADS, Config.TORCH_INTER_OP_THREADS)
+    threading.Thread(target=initialize_services, name='service-init', daemon=True).start()
+
+
+if Config.SERVICE_ROLE == 'inference':
+    # inference_server.py loads the model itself and serves no HTTP
+    pass
+elif Config.SERVICE_PRELOAD:
+    # Load weights once in the gunicorn master; workers share the pages
+    # copy-on-write. gc.freeze keeps the collector from touching (and so
+    # copying) the objects created so far.
+    startup_state['phase'] = 'loading_model'
+    initialize_model(preload=True)
+    gc.freeze()
+elif __name__ != '__main__':
+    # Imported by a server without preload: initialize in the background
+    # while /health/live already answers
+    threading.Thread(target=initialize_services, name='service-init', daemon=True).start()
 
 # ============================================================================
 # SERVER STARTUP
@@ -824,8 +2444,9 @@ init_thread.start()
 if __name__ == '__main__':
     try:
         # Initialize services
-        initialize_model()
-        initialize_database()
+        initialize_services()
+        if not service_ready.is_set():
+            raise RuntimeError(startup_state['error'])
         
         # Start server
         logger.info("=" * 50)
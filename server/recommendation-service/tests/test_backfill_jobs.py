@@ -0,0 +1,165 @@
+"""
+Resuming, limits and lease ownership of backfill jobs
+
+Runs against mongomock; skipped when it is not installed.
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backfill_jobs import (  # noqa: E402
+    BackfillJobManager, LeaseLost, job_to_dict,
+    JOB_QUEUED, JOB_RUNNING, JOB_COMPLETED, JOB_CANCELLED
+)
+
+
+class Embedder:
+    """Records the chunks it was given; on_chunk runs before each chunk returns"""
+
+    def __init__(self, on_chunk=None):
+        self.chunks = []
+        self.on_chunk = on_chunk
+
+    def __call__(self, chunk, skip_unchanged):
+        self.chunks.append([artwork['_id'] for artwork in chunk])
+        if self.on_chunk:
+            self.on_chunk(len(self.chunks))
+        return len(chunk), 0, 0
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient().db
+    db.artworks.insert_many([{'image': f"https://img/{i}.jpg"} for i in range(10)])
+    return db
+
+
+def artwork_ids(db):
+    return [artwork['_id'] for artwork in db.artworks.find().sort('_id', 1)]
+
+
+def make_manager(db, embed, **kwargs):
+    return BackfillJobManager(db.backfill_jobs, db.artworks, embed, chunk_size=4, **kwargs)
+
+
+def run_next(manager):
+    job = manager._claim()
+    assert job is not None
+    manager._execute(job)
+    return manager.jobs.find_one({'_id': job['_id']})
+
+
+def orphan(db, job_id, **fields):
+    """Make a job look like its worker died mid-run"""
+    stale = datetime.utcnow() - timedelta(hours=1)
+    db.backfill_jobs.update_one(
+        {'_id': job_id},
+        {'$set': {'status': JOB_RUNNING, 'owner': 'gone:1', 'heartbeat_at': stale, **fields}}
+    )
+
+
+def test_job_runs_in_checkpointed_chunks(db):
+    embed = Embedder()
+    manager = make_manager(db, embed)
+    manager.submit()
+
+    job = run_next(manager)
+
+    assert [len(chunk) for chunk in embed.chunks] == [4, 4, 2]
+    assert sum(embed.chunks, []) == artwork_ids(db)
+    assert (job['status'], job['processed'], job['last_id']) == (JOB_COMPLETED, 10, artwork_ids(db)[-1])
+    assert job_to_dict(job)['processed'] == 10
+    assert manager._claim() is None
+
+
+def test_orphaned_job_resumes_after_its_checkpoint(db):
+    ids = artwork_ids(db)
+    job_id = make_manager(db, Embedder()).submit()['_id']
+    orphan(db, job_id, last_id=ids[3], processed=4)
+
+    embed = Embedder()
+    job = run_next(make_manager(db, embed))
+
+    assert sum(embed.chunks, []) == ids[4:]
+    assert (job['status'], job['processed']) == (JOB_COMPLETED, 10)
+
+
+def test_running_job_with_fresh_heartbeat_is_not_claimed(db):
+    manager = make_manager(db, Embedder())
+    job_id = manager.submit()['_id']
+    orphan(db, job_id, heartbeat_at=datetime.utcnow())
+
+    assert manager._claim() is None
+
+
+def test_limit_counts_across_resumes(db):
+    ids = artwork_ids(db)
+    job_id = make_manager(db, Embedder()).submit(limit=6)['_id']
+    orphan(db, job_id, last_id=ids[3], processed=3, failed=1)
+
+    embed = Embedder()
+    job = run_next(make_manager(db, embed))
+
+    assert embed.chunks == [ids[4:6]]
+    assert (job['processed'], job['failed']) == (5, 1)
+
+
+def test_lost_lease_does_not_double_count(db):
+    manager = make_manager(db, None)
+    job_id = manager.submit()['_id']
+
+    def take_over(chunk_number):
+        # Another worker resumed the job while this chunk was embedding
+        db.backfill_jobs.update_one({'_id': job_id}, {'$set': {'owner': 'other:2'}})
+
+    manager.embed = Embedder(take_over)
+    job = manager._claim()
+    with pytest.raises(LeaseLost):
+        manager._execute(job)
+
+    job = db.backfill_jobs.find_one({'_id': job_id})
+    assert (job['status'], job['processed'], job['last_id']) == (JOB_RUNNING, 0, None)
+
+
+def test_cancel_stops_at_the_next_checkpoint(db):
+    manager = make_manager(db, None)
+    job_id = manager.submit()['_id']
+    manager.embed = Embedder(lambda chunk_number: manager.cancel(str(job_id)))
+
+    job = run_next(manager)
+
+    assert len(manager.embed.chunks) == 1
+    assert (job['status'], job['processed']) == (JOB_CANCELLED, 4)
+
+
+def test_cancelled_jobs_are_never_run(db):
+    embed = Embedder()
+    manager = make_manager(db, embed)
+
+    queued = manager.submit()
+    assert manager.cancel(str(queued['_id']))['status'] == JOB_CANCELLED
+    assert manager._claim() is None
+
+    # Cancel requested while running, then the worker died
+    orphaned = manager.submit()['_id']
+    orphan(db, orphaned, cancel_requested=True)
+    job = run_next(manager)
+
+    assert (job['_id'], job['status']) == (orphaned, JOB_CANCELLED)
+    assert embed.chunks == []
+    assert manager.cancel('not-an-id') is None
+    assert manager.get(str(queued['_id']))['status'] == JOB_CANCELLED
+
+
+def test_submit_queues_a_fresh_job(db):
+    job = make_manager(db, Embedder()).submit(force_regenerate=True, limit=3)
+
+    report = job_to_dict(job)
+    assert report['status'] == JOB_QUEUED
+    assert (report['force_regenerate'], report['limit'], report['last_id']) == (True, 3, None)
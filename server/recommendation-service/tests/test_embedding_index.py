@@ -0,0 +1,158 @@
+"""
+Exact search and filter masks of EmbeddingIndex against a brute-force scan
+"""
+
+import os
+import sys
+import pytest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_index import EmbeddingIndex, SearchFilter, normalize_tag  # noqa: E402
+
+DIM = 32
+ARTISTS = ['a1', 'a2', 'a3', 'Unknown']
+TAGS = ['Red', 'blue', 'Abstract ', 'portrait']
+
+
+def artwork_id(i):
+    return f"{i:024x}"
+
+
+def metadata(i):
+    return {
+        'title': f"Artwork {i}",
+        'artist_id': ARTISTS[i % len(ARTISTS)],
+        'image': f"https://img/{i}.jpg",
+        # Every 11th price is not a number and never passes a price filter
+        'price': 'n/a' if i % 11 == 0 else float(i % 50),
+        'tags': [TAGS[i % len(TAGS)], TAGS[(i * 7) % len(TAGS)]]
+    }
+
+
+@pytest.fixture
+def artworks():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((300, DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return {artwork_id(i): (vectors[i], metadata(i)) for i in range(len(vectors))}
+
+
+@pytest.fixture
+def index(artworks):
+    index = EmbeddingIndex(dim=DIM)
+    for key, (vector, meta) in artworks.items():
+        index.upsert(key, vector, meta)
+    return index
+
+
+def passes(key, meta, filters):
+    """Reference implementation of SearchFilter"""
+    if filters is None:
+        return True
+    if key in {str(i) for i in filters.exclude_ids}:
+        return False
+    if filters.exclude_artist is not None and meta['artist_id'] == filters.exclude_artist:
+        return False
+    if filters.artist_id is not None and meta['artist_id'] != filters.artist_id:
+        return False
+    if filters.min_price is not None or filters.max_price is not None:
+        if not isinstance(meta['price'], float):
+            return False
+        if filters.min_price is not None and meta['price'] < filters.min_price:
+            return False
+        if filters.max_price is not None and meta['price'] > filters.max_price:
+            return False
+    if filters.tags:
+        wanted = {normalize_tag(tag) for tag in filters.tags}
+        if not wanted & {normalize_tag(tag) for tag in meta['tags']}:
+            return False
+    return True
+
+
+def brute_force(artworks, query, top_k, filters=None):
+    scored = [
+        (key, float(vector @ query))
+        for key, (vector, meta) in artworks.items()
+        if passes(key, meta, filters)
+    ]
+    scored.sort(key=lambda item: -item[1])
+    return scored[:top_k], len(scored)
+
+
+FILTERS = [
+    None,
+    SearchFilter(),
+    SearchFilter(artist_id='a2'),
+    SearchFilter(min_price=10, max_price=20),
+    SearchFilter(tags=['red', 'ABSTRACT']),
+    SearchFilter(exclude_ids=[artwork_id(3), artwork_id(4)], exclude_artist='a1'),
+    SearchFilter(artist_id='a3', min_price=5, tags=['portrait']),
+    SearchFilter(artist_id='nobody')
+]
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+def test_filter_mask_matches_reference(index, artworks, filters):
+    mask = index._filter_mask(filters) if filters is not None else None
+    expected = [passes(key, meta, filters) for key, (_, meta) in artworks.items()]
+    rows = [index._id_to_row[key] for key in artworks]
+    actual = [True if mask is None else bool(mask[row]) for row in rows]
+    assert actual == expected
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+def test_search_matches_brute_force(index, artworks, filters):
+    query = artworks[artwork_id(7)][0]
+    expected, allowed = brute_force(artworks, query, 15, filters)
+
+    results, total_compared, engine = index.search(query, 15, filters=filters)
+
+    assert engine == 'exact'
+    assert total_compared == allowed
+    assert [key for key, _, _ in results] == [key for key, _ in expected]
+    np.testing.assert_allclose([score for _, score, _ in results], [score for _, score in expected], rtol=1e-5)
+    for key, _, meta in results:
+        assert meta == artworks[key][1]
+
+
+def test_search_batch_matches_search(index, artworks):
+    queries = [artworks[artwork_id(i)][0] for i in (1, 2, 3)]
+    filters = [None, SearchFilter(min_price=25), SearchFilter(tags=['blue'], exclude_ids=[artwork_id(3)])]
+
+    batch = index.search_batch(queries, 10, filters)
+
+    for query, query_filter, (results, total_compared) in zip(queries, filters, batch):
+        single, single_total, _ = index.search(query, 10, filters=query_filter)
+        assert [key for key, _, _ in results] == [key for key, _, _ in single]
+        assert total_compared == single_total
+
+
+def test_remove_keeps_rows_aligned(index, artworks):
+    for i in range(0, 300, 3):
+        assert index.remove(artwork_id(i))
+        del artworks[artwork_id(i)]
+    assert not index.remove(artwork_id(0))
+
+    query = artworks[artwork_id(10)][0]
+    expected, allowed = brute_force(artworks, query, 20, SearchFilter(artist_id='a3'))
+    results, total_compared, _ = index.search(query, 20, filters=SearchFilter(artist_id='a3'))
+
+    assert len(index) == len(artworks)
+    assert total_compared == allowed
+    assert [key for key, _, _ in results] == [key for key, _ in expected]
+
+
+def test_upsert_changes_version_only_when_something_changed(index, artworks):
+    key = artwork_id(5)
+    vector, meta = artworks[key]
+    version = index.version
+
+    assert not index.upsert(key, vector, dict(meta))
+    assert index.version == version
+
+    assert index.upsert(key, vector, {**meta, 'artist_id': 'a9'})
+    assert index.version == version + 1
+    results, _, _ = index.search(vector, 1, filters=SearchFilter(artist_id='a9'))
+    assert [result[0] for result in results] == [key]
@@ -0,0 +1,164 @@
+"""
+Claiming, retrying and dead-lettering of EmbeddingQueue jobs
+
+Runs against mongomock; skipped when it is not installed.
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId  # noqa: E402
+from embedding_queue import (  # noqa: E402
+    EmbeddingQueue, JobFailure, JOB_PENDING, JOB_PROCESSING, JOB_DONE, JOB_DEAD
+)
+
+IMAGE_URL = 'https://img/1.jpg'
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+def make_queue(db, **kwargs):
+    return EmbeddingQueue(db.embedding_jobs, db.artworks, process=None, batch_size=4, **kwargs)
+
+
+def make_due(db, job_id):
+    db.embedding_jobs.update_one({'_id': job_id}, {'$set': {'next_attempt_at': datetime.utcnow()}})
+
+
+def test_enqueue_is_one_pending_job_per_artwork(db):
+    queue = make_queue(db)
+    artwork_id = ObjectId()
+
+    queue.enqueue(str(artwork_id), IMAGE_URL)
+    job = queue.enqueue(str(artwork_id), 'https://img/2.jpg')
+
+    assert db.embedding_jobs.count_documents({}) == 1
+    assert job['status'] == JOB_PENDING
+    assert job['image_url'] == 'https://img/2.jpg'
+    assert queue.find(str(artwork_id))['_id'] == artwork_id
+
+
+def test_enqueue_rejects_malformed_ids(db):
+    queue = make_queue(db)
+    with pytest.raises(ValueError):
+        queue.enqueue('not-an-id', IMAGE_URL)
+    assert queue.find('not-an-id') is None
+
+
+def test_claimed_job_is_not_claimed_again_until_its_lease_expires(db):
+    queue = make_queue(db, lease_seconds=60)
+    artwork_id = ObjectId()
+    queue.enqueue(str(artwork_id), IMAGE_URL)
+
+    batch = queue._claim_batch()
+    assert [job['_id'] for job in batch] == [artwork_id]
+    assert batch[0]['status'] == JOB_PROCESSING
+    assert batch[0]['attempts'] == 1
+    assert queue._claim_batch() == []
+
+    # A worker that died mid-job leaves an expired lease behind
+    db.embedding_jobs.update_one({'_id': artwork_id}, {'$set': {'lease_until': datetime.utcnow() - timedelta(seconds=1)}})
+    retaken = queue._claim_batch()
+    assert [job['attempts'] for job in retaken] == [2]
+    assert retaken[0]['claim_token'] != batch[0]['claim_token']
+
+
+def test_success_completes_the_job(db):
+    queue = make_queue(db)
+    artwork_id = ObjectId()
+    queue.enqueue(str(artwork_id), IMAGE_URL)
+
+    batch = queue._claim_batch()
+    queue._record(batch, {artwork_id: None})
+
+    job = db.embedding_jobs.find_one({'_id': artwork_id})
+    assert job['status'] == JOB_DONE
+    assert job['completed_at'] is not None
+    assert 'claim_token' not in job
+    assert queue.completed == 1
+
+
+def test_failure_is_retried_with_backoff_then_dead_lettered(db):
+    queue = make_queue(db, max_attempts=3, backoff_seconds=30)
+    artwork_id = ObjectId()
+    queue.enqueue(str(artwork_id), IMAGE_URL)
+
+    for attempt in (1, 2):
+        batch = queue._claim_batch()
+        assert [job['attempts'] for job in batch] == [attempt]
+        queue._record(batch, {artwork_id: JobFailure('Failed to load image')})
+
+        job = db.embedding_jobs.find_one({'_id': artwork_id})
+        assert job['status'] == JOB_PENDING
+        assert job['last_error'] == 'Failed to load image'
+        # Not due before the backoff has passed
+        assert job['next_attempt_at'] > datetime.utcnow() + timedelta(seconds=20)
+        assert queue._claim_batch() == []
+        make_due(db, artwork_id)
+
+    batch = queue._claim_batch()
+    queue._record(batch, {artwork_id: JobFailure('Failed to load image')})
+
+    assert db.embedding_jobs.find_one({'_id': artwork_id})['status'] == JOB_DEAD
+    assert (queue.retried, queue.dead_lettered) == (2, 1)
+    assert queue.counts()[JOB_DEAD] == 1
+
+
+def test_permanent_failure_and_retry_dead(db):
+    queue = make_queue(db)
+    artwork_id = ObjectId()
+    queue.enqueue(str(artwork_id), IMAGE_URL)
+
+    batch = queue._claim_batch()
+    queue._record(batch, {artwork_id: JobFailure('Artwork not found', permanent=True)})
+    assert db.embedding_jobs.find_one({'_id': artwork_id})['status'] == JOB_DEAD
+
+    assert queue.retry_dead() == 1
+    job = db.embedding_jobs.find_one({'_id': artwork_id})
+    assert (job['status'], job['attempts']) == (JOB_PENDING, 0)
+    assert len(queue._claim_batch()) == 1
+
+
+def test_missing_outcome_counts_as_failure(db):
+    queue = make_queue(db)
+    artwork_id = ObjectId()
+    queue.enqueue(str(artwork_id), IMAGE_URL)
+
+    queue._record(queue._claim_batch(), {})
+
+    job = db.embedding_jobs.find_one({'_id': artwork_id})
+    assert (job['status'], job['last_error']) == (JOB_PENDING, 'No result for job')
+
+
+def test_requeue_during_processing_wins_over_the_old_result(db):
+    queue = make_queue(db)
+    artwork_id = ObjectId()
+    queue.enqueue(str(artwork_id), IMAGE_URL)
+    batch = queue._claim_batch()
+
+    # A new upload replaces the job while the old image is being embedded
+    queue.enqueue(str(artwork_id), 'https://img/2.jpg')
+    queue._record(batch, {artwork_id: None})
+
+    job = db.embedding_jobs.find_one({'_id': artwork_id})
+    assert (job['status'], job['image_url']) == (JOB_PENDING, 'https://img/2.jpg')
+
+
+def test_sweep_queues_artworks_without_embedding_once(db):
+    queue = make_queue(db)
+    missing = db.artworks.insert_one({'image': IMAGE_URL}).inserted_id
+    db.artworks.insert_one({'image': IMAGE_URL, 'clip_embedding': [0.0]})
+    db.artworks.insert_one({'image': ''})
+
+    assert queue.sweep() == 1
+    assert queue.sweep() == 0
+    assert [job['_id'] for job in db.embedding_jobs.find()] == [missing]
@@ -0,0 +1,90 @@
+"""
+Parity of the optimized CLIP towers against the fp32 eager model
+
+Runs on a small randomly initialized CLIP so no weights are downloaded;
+skipped when torch or transformers are not installed.
+"""
+
+import os
+import sys
+import pytest
+
+torch = pytest.importorskip('torch')
+transformers = pytest.importorskip('transformers')
+pytest.importorskip('PIL')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inference_backend import ClipTowers, TEXT_LENGTH  # noqa: E402
+
+MIN_COSINE = float(os.getenv('INFERENCE_MIN_COSINE', 0.98))
+
+
+@pytest.fixture(scope='module')
+def reference():
+    torch.manual_seed(0)
+    config = transformers.CLIPConfig(
+        text_config={'hidden_size': 64, 'intermediate_size': 128, 'num_hidden_layers': 2,
+                     'num_attention_heads': 4, 'max_position_embeddings': TEXT_LENGTH, 'vocab_size': 1000},
+        vision_config={'hidden_size': 64, 'intermediate_size': 128, 'num_hidden_layers': 2,
+                       'num_attention_heads': 4, 'image_size': 224, 'patch_size': 32},
+        projection_dim=32
+    )
+    return transformers.CLIPModel(config).eval()
+
+
+@pytest.fixture(scope='module')
+def inputs():
+    generator = torch.Generator().manual_seed(1)
+    pixel_values = torch.randn(4, 3, 224, 224, generator=generator)
+    input_ids = torch.randint(1, 1000, (3, TEXT_LENGTH), generator=generator)
+    attention_mask = torch.ones_like(input_ids)
+    attention_mask[1, 40:] = 0
+    return pixel_values, input_ids, attention_mask
+
+
+def expected(reference, inputs):
+    pixel_values, input_ids, attention_mask = inputs
+    with torch.inference_mode():
+        images = reference.get_image_features(pixel_values=pixel_values).float()
+        texts = reference.get_text_features(input_ids=input_ids, attention_mask=attention_mask).float()
+    return (images / images.norm(dim=-1, keepdim=True),
+            texts / texts.norm(dim=-1, keepdim=True))
+
+
+@pytest.mark.parametrize('precision,mode', [
+    ('fp32', 'torchscript'),
+    ('int8', 'eager'),
+    ('int8', 'torchscript'),
+    ('bf16', 'eager'),
+    ('bf16', 'torchscript')
+])
+def test_towers_match_fp32(reference, inputs, precision, mode):
+    towers = ClipTowers(reference, precision=precision, mode=mode)
+    expected_images, expected_texts = expected(reference, inputs)
+    pixel_values, input_ids, attention_mask = inputs
+
+    image_cosine = (towers.encode_images(pixel_values) * expected_images).sum(dim=-1)
+    text_cosine = (towers.encode_texts(input_ids, attention_mask) * expected_texts).sum(dim=-1)
+
+    assert towers.precision == precision
+    assert float(image_cosine.min()) >= MIN_COSINE
+    assert float(text_cosine.min()) >= MIN_COSINE
+
+
+def test_variant_names_precision_and_mode(reference):
+    assert ClipTowers(reference, precision='int8').variant == 'int8/eager'
+
+
+def test_deferred_trace_runs_in_prepare(reference, inputs):
+    towers = ClipTowers(reference, mode='torchscript', defer_trace=True)
+    assert not towers.prepared
+    assert not isinstance(towers.image_tower, torch.jit.ScriptModule)
+
+    towers.prepare()
+    expected_images, _ = expected(reference, inputs)
+    image_cosine = (towers.encode_images(inputs[0]) * expected_images).sum(dim=-1)
+
+    assert towers.prepared
+    assert isinstance(towers.image_tower, torch.jit.ScriptModule)
+    assert float(image_cosine.min()) >= MIN_COSINE
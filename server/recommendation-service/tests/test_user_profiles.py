@@ -0,0 +1,148 @@
+"""
+Incremental UserProfileStore updates against a rebuild from the user document
+
+Runs against mongomock; skipped when it is not installed.
+"""
+
+import os
+import sys
+from datetime import datetime
+import pytest
+import numpy as np
+
+mongomock = pytest.importorskip('mongomock')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId  # noqa: E402
+from embedding_index import EmbeddingIndex, artwork_metadata  # noqa: E402
+from user_profiles import UserProfileStore  # noqa: E402
+
+DIM = 16
+FIELDS = {'like': 'likedArtworks', 'save': 'savedArtworks', 'purchase': 'purchasedArtworks', 'cart': 'cartAdditions'}
+
+
+@pytest.fixture
+def index():
+    rng = np.random.default_rng(1)
+    index = EmbeddingIndex(dim=DIM)
+    for i in range(20):
+        vector = rng.standard_normal(DIM).astype(np.float32)
+        index.upsert(f"{i:024x}", vector / np.linalg.norm(vector), artwork_metadata({'title': f"Artwork {i}"}))
+    return index
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+def artwork(i):
+    return f"{i:024x}"
+
+
+def make_store(db, index, **kwargs):
+    return UserProfileStore(db.profiles, db.users, index, 'test-model', **kwargs)
+
+
+def track(db, store, user_id, artwork_id, interaction, duration_seconds=0):
+    """Record an interaction the way the backend does: user document first, then the profile"""
+    if interaction == 'view':
+        view = {'artwork': ObjectId(artwork_id), 'durationSeconds': duration_seconds, 'viewedAt': datetime.utcnow()}
+        db.users.update_one({'_id': user_id}, {'$push': {'viewedArtworks': view}})
+    else:
+        db.users.update_one({'_id': user_id}, {'$addToSet': {FIELDS[interaction]: ObjectId(artwork_id)}})
+    store.record(str(user_id), artwork_id, interaction, duration_seconds)
+
+
+def assert_same_profile(actual, expected):
+    assert set(actual['interaction_ids']) == set(expected['interaction_ids'])
+    assert actual['count'] == expected['count']
+    np.testing.assert_allclose(actual['weights'], expected['weights'], rtol=1e-4)
+    np.testing.assert_allclose(actual['vectors'], expected['vectors'], atol=1e-5)
+
+
+@pytest.mark.parametrize('half_life_days', [0, 30])
+def test_running_sums_match_rebuild(db, index, half_life_days):
+    store = make_store(db, index, half_life_days=half_life_days)
+    user_id = db.users.insert_one({}).inserted_id
+    assert store.get(str(user_id))['vectors'] is None
+
+    track(db, store, user_id, artwork(1), 'like')
+    track(db, store, user_id, artwork(2), 'purchase')
+    track(db, store, user_id, artwork(1), 'save')
+    track(db, store, user_id, artwork(3), 'view', 12)
+    track(db, store, user_id, artwork(3), 'view', 60)
+    track(db, store, user_id, artwork(4), 'cart')
+
+    incremental = store.get(str(user_id))
+    assert store.rebuilds == 1
+    assert_same_profile(incremental, store.rebuild(str(user_id)))
+
+
+def test_repeated_interaction_counts_once(db, index):
+    store = make_store(db, index)
+    user_id = db.users.insert_one({}).inserted_id
+    store.get(str(user_id))
+
+    track(db, store, user_id, artwork(5), 'like')
+    version = db.profiles.find_one({'_id': user_id})['version']
+    track(db, store, user_id, artwork(5), 'like')
+
+    assert db.profiles.find_one({'_id': user_id})['version'] == version
+    assert store.get(str(user_id))['count'] == 1
+
+
+def test_views_outside_the_window_are_evicted(db, index):
+    store = make_store(db, index, half_life_days=0, view_window=3)
+    user_id = db.users.insert_one({}).inserted_id
+    store.get(str(user_id))
+
+    track(db, store, user_id, artwork(6), 'like')
+    for i, duration in zip((6, 7, 8, 9, 10), (5, 30, 10, 20, 40)):
+        track(db, store, user_id, artwork(i), 'view', duration)
+
+    incremental = store.get(str(user_id))
+    # Artwork 7 fell out of the window; 6 is still liked
+    assert set(incremental['interaction_ids']) == {artwork(6), artwork(8), artwork(9), artwork(10)}
+    assert_same_profile(incremental, store.rebuild(str(user_id)))
+
+
+def test_unindexed_artworks_are_tracked_without_weight(db, index):
+    store = make_store(db, index, half_life_days=0)
+    user_id = db.users.insert_one({}).inserted_id
+    store.get(str(user_id))
+
+    missing = str(ObjectId())
+    track(db, store, user_id, artwork(11), 'like')
+    track(db, store, user_id, missing, 'save')
+
+    incremental = store.get(str(user_id))
+    assert missing in incremental['interaction_ids']
+    assert incremental['count'] == 1
+    assert_same_profile(incremental, store.rebuild(str(user_id)))
+
+
+def test_stale_or_outdated_profiles_are_rebuilt(db, index):
+    store = make_store(db, index)
+    user_id = db.users.insert_one({'likedArtworks': [ObjectId(artwork(12))]}).inserted_id
+    store.get(str(user_id))
+    store.get(str(user_id))
+    assert (store.hits, store.rebuilds) == (1, 1)
+
+    # An unlike removes the artwork from the user document and invalidates
+    db.users.update_one({'_id': user_id}, {'$set': {'likedArtworks': []}})
+    store.invalidate(str(user_id))
+    assert store.get(str(user_id))['vectors'] is None
+    assert store.rebuilds == 2
+
+    reweighted = make_store(db, index, weights={'purchase': 5.0, 'cart': 3.0, 'save': 2.5, 'like': 4.0, 'view': 1.0})
+    reweighted.get(str(user_id))
+    assert reweighted.rebuilds == 1
+
+
+def test_missing_user_has_no_profile(db, index):
+    store = make_store(db, index)
+    user_id = str(ObjectId())
+    assert store.get(user_id) is None
+    assert db.profiles.count_documents({}) == 0
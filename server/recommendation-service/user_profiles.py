@@ -0,0 +1,525 @@
+"""
+Persisted user profile vectors for personalized recommendations
+
+A profile is a weighted sum of the embeddings of the artworks a user
+interacted with, plus the interacted ids (used to exclude them from results).
+Each interaction type has its own weight (a purchase says more than a view),
+views are scaled by how long the artwork was looked at, and timestamped
+interactions decay with a configurable half-life.
+
+To stay incremental under decay the sums are split in two: 'fixed' holds
+untimestamped interactions (likes, saves, purchases, cart additions recorded
+as ids only) and 'decayed' holds timestamped ones scaled by
+2 ** ((t - anchor) / half_life). The profile at time now is
+fixed + decayed * 2 ** (-(now - anchor) / half_life), so adding an event
+never requires rescaling what is already stored.
+
+Profiles can optionally have several centroids (weighted spherical k-means
+over the history) so users with diverse taste get one cheap query per
+cluster instead of a single averaged blur. New interactions are added to the
+nearest centroid.
+
+The Node backend reports each like, save, purchase, cart addition and view
+as it is tracked, so /recommend/personalized needs a single small read.
+Removals (unlike, unsave) or edited histories mark the profile stale, and it
+is rebuilt from the user document on its next read.
+
+Only the last view_window views count, matching the capped viewedArtworks
+list the backend keeps. Profiles store the weight and centroid of each of
+those views, so an incremental update subtracts the view that falls out of
+the window and gives the same profile a rebuild would.
+"""
+
+import logging
+from datetime import datetime
+import numpy as np
+from bson import ObjectId
+from embedding_storage import encode_embedding, decode_embedding
+
+logger = logging.getLogger(__name__)
+
+# User document fields holding interaction history
+USER_HISTORY_PROJECTION = {
+    'likedArtworks': 1,
+    'savedArtworks': 1,
+    'purchasedArtworks': 1,
+    'cartAdditions': 1,
+    'viewedArtworks': 1
+}
+
+INTERACTION_TYPES = ('like', 'save', 'purchase', 'cart', 'view')
+
+DEFAULT_WEIGHTS = {'purchase': 5.0, 'cart': 3.0, 'save': 2.5, 'like': 2.0, 'view': 1.0}
+
+# Views kept per user; the backend caps viewedArtworks at the same length
+DEFAULT_VIEW_WINDOW = 100
+
+# Anchor is moved forward once decayed sums grow by 2 ** REBASE_HALF_LIVES
+REBASE_HALF_LIVES = 20
+
+SECONDS_PER_DAY = 86400
+
+
+def parse_weights(value):
+    """
+    Parse interaction weights from 'purchase=5,cart=3,...'
+
+    Types not mentioned keep their DEFAULT_WEIGHTS value.
+    """
+    weights = dict(DEFAULT_WEIGHTS)
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        name, _, weight = item.partition('=')
+        if name.strip() not in INTERACTION_TYPES:
+            raise ValueError(f"Unknown interaction type in weights: {name}")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def user_history(user, view_window=DEFAULT_VIEW_WINDOW):
+    """
+    Flatten a user document into interaction events
+
+    Args:
+        user: User document projected with USER_HISTORY_PROJECTION
+        view_window: Number of most recent views to include
+
+    Returns:
+        (artwork_ids, types, durations, timestamps) lists; timestamps are
+        None for interactions stored without one
+    """
+    artwork_ids, types, durations, timestamps = [], [], [], []
+    for field, interaction in (('likedArtworks', 'like'), ('savedArtworks', 'save'),
+                               ('purchasedArtworks', 'purchase'), ('cartAdditions', 'cart')):
+        for artwork_id in dict.fromkeys(str(a) for a in user.get(field, [])):
+            artwork_ids.append(artwork_id)
+            types.append(interaction)
+            durations.append(0)
+            timestamps.append(None)
+    for view in user.get('viewedArtworks', [])[-view_window:]:
+        if view.get('artwork'):
+            artwork_ids.append(str(view['artwork']))
+            types.append('view')
+            durations.append(view.get('durationSeconds') or 0)
+            timestamps.append(view.get('viewedAt'))
+    return artwork_ids, types, durations, timestamps
+
+
+def spherical_kmeans(vectors, weights, k, iterations=10):
+    """
+    Weighted spherical k-means over a small set of embeddings
+
+    Centroids are seeded deterministically: the heaviest item first, then
+    repeatedly the item least similar to every chosen seed.
+
+    Returns:
+        Array of cluster assignments, one per vector
+    """
+    unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    seeds = [int(np.argmax(weights))]
+    closest = unit @ unit[seeds[0]]
+    for _ in range(1, k):
+        seeds.append(int(np.argmin(closest)))
+        closest = np.maximum(closest, unit @ unit[seeds[-1]])
+    centroids = unit[seeds]
+
+    assignment = np.zeros(len(vectors), dtype=np.int64)
+    for _ in range(iterations):
+        assignment = np.argmax(unit @ centroids.T, axis=1)
+        sums = (np.eye(k, dtype=np.float32)[assignment] * weights[:, None]).T @ unit
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        centroids[~empty] = sums[~empty] / norms[~empty]
+    return assignment
+
+
+def merge_centroid_results(results, weights, top_k):
+    """
+    Merge per-centroid search results into one list
+
+    Each centroid gets a share of top_k proportional to its weight; leftover
+    slots go to the best remaining scores. Duplicates keep their best score.
+
+    Args:
+        results: List of result lists, one per centroid, best first
+        weights: Centroid weights
+        top_k: Number of results to return
+
+    Returns:
+        List of (artwork_id, similarity, metadata), best first
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    quotas = np.floor(top_k * weights / weights.sum()).astype(int)
+
+    chosen = {}
+    for quota, centroid_results in zip(quotas, results):
+        taken = 0
+        for result in centroid_results:
+            if taken >= quota:
+                break
+            if result[0] not in chosen:
+                chosen[result[0]] = result
+                taken += 1
+
+    remaining = sorted(
+        (result for centroid_results in results for result in centroid_results),
+        key=lambda result: result[1],
+        reverse=True
+    )
+    for result in remaining:
+        if len(chosen) >= top_k:
+            break
+        chosen.setdefault(result[0], result)
+
+    return sorted(chosen.values(), key=lambda result: result[1], reverse=True)[:top_k]
+
+
+class UserProfileStore:
+    """
+    Incrementally maintained, weighted and time-decayed user profiles
+
+    Args:
+        profiles: pymongo collection storing profile documents
+        users: pymongo collection of users
+        index: EmbeddingIndex providing artwork embeddings
+        model_name: Model the embeddings come from; profiles built by
+            another model are rebuilt
+        weights: Dict of interaction type -> weight
+        view_full_seconds: View duration that earns the full view weight;
+            shorter views are scaled down linearly
+        half_life_days: Half-life of timestamped interactions (0 disables decay)
+        centroids: Maximum number of profile centroids
+        view_window: Number of most recent views that count
+        max_retries: Optimistic update attempts before falling back to a rebuild
+    """
+
+    def __init__(self, profiles, users, index, model_name, weights=None, view_full_seconds=30,
+                 half_life_days=30, centroids=1, view_window=DEFAULT_VIEW_WINDOW, max_retries=3):
+        self.profiles = profiles
+        self.users = users
+        self.index = index
+        self.model_name = model_name
+        self.weights = weights or dict(DEFAULT_WEIGHTS)
+        self.view_full_seconds = view_full_seconds
+        self.half_life = half_life_days * SECONDS_PER_DAY
+        self.centroids = max(1, centroids)
+        self.view_window = view_window
+        self.max_retries = max_retries
+        self.hits = 0
+        self.rebuilds = 0
+        # Profiles built with other settings are rebuilt on read
+        self.settings = {
+            'model': model_name,
+            'weights': self.weights,
+            'view_full_seconds': view_full_seconds,
+            'half_life_days': half_life_days,
+            'centroids': self.centroids,
+            'view_window': view_window
+        }
+
+    def interaction_weights(self, types, durations, timestamps, anchor):
+        """
+        Weights of interaction events in one vectorized pass
+
+        Returns:
+            (fixed, decayed) float32 arrays; each event contributes to
+            exactly one of them
+        """
+        base = np.array([self.weights[t] for t in types], dtype=np.float32)
+        is_view = np.array([t == 'view' for t in types], dtype=bool)
+        durations = np.asarray(durations, dtype=np.float32)
+        base[is_view] *= np.clip(durations[is_view] / self.view_full_seconds, 0.0, 1.0)
+
+        timed = np.array([t is not None for t in timestamps], dtype=bool)
+        if not self.half_life:
+            return base, np.zeros_like(base)
+        age = np.array([
+            (t - anchor).total_seconds() if t is not None else 0.0 for t in timestamps
+        ], dtype=np.float64)
+        decayed = np.where(timed, base * np.exp2(age / self.half_life), 0.0).astype(np.float32)
+        return np.where(timed, 0.0, base).astype(np.float32), decayed
+
+    def _decay_factor(self, profile, now):
+        if not self.half_life:
+            return 1.0
+        return float(np.exp2(-(now - profile['anchor']).total_seconds() / self.half_life))
+
+    def _is_current(self, profile):
+        return profile is not None and not profile.get('stale') and profile.get('settings') == self.settings
+
+    def get(self, user_id):
+        """
+        Get the profile of a user, rebuilding it if missing or stale
+
+        Returns:
+            Dict with 'vectors' ((k x dim) unit-length centroids, or None),
+            'weights' (current weight per centroid), 'interaction_ids' and
+            'count', or None if the user does not exist
+        """
+        profile = self.profiles.find_one({'_id': ObjectId(user_id)})
+        if not self._is_current(profile):
+            return self.rebuild(user_id)
+        self.hits += 1
+        return self._to_dict(profile)
+
+    def rebuild(self, user_id):
+        """
+        Recompute a profile from the user document
+
+        Returns:
+            Profile dict (see get) or None if the user does not exist
+        """
+        user = self.users.find_one({'_id': ObjectId(user_id)}, USER_HISTORY_PROJECTION)
+        if user is None:
+            self.profiles.delete_one({'_id': ObjectId(user_id)})
+            return None
+
+        now = datetime.utcnow()
+        artwork_ids, types, durations, timestamps = user_history(user, self.view_window)
+        interaction_ids = list(dict.fromkeys(artwork_ids))
+        found_ids, embeddings = self.index.get_many(interaction_ids)
+        row_of = {artwork_id: row for row, artwork_id in enumerate(found_ids)}
+
+        keep = [i for i, artwork_id in enumerate(artwork_ids) if artwork_id in row_of]
+        fixed_w, decayed_w = self.interaction_weights(
+            [types[i] for i in keep],
+            [durations[i] for i in keep],
+            [timestamps[i] for i in keep],
+            now
+        )
+        vectors = embeddings[[row_of[artwork_ids[i]] for i in keep]]
+
+        k = min(self.centroids, len(found_ids)) or 1
+        if k > 1:
+            assignment = spherical_kmeans(vectors, fixed_w + decayed_w, k)
+        else:
+            assignment = np.zeros(len(keep), dtype=np.int64)
+        one_hot = np.eye(k, dtype=np.float32)[assignment]
+
+        # Per-view contributions, so the incremental path can evict them
+        position_of = {event: position for position, event in enumerate(keep)}
+        views = []
+        for i, interaction in enumerate(types):
+            if interaction != 'view':
+                continue
+            position = position_of.get(i)
+            views.append({
+                'artwork': artwork_ids[i],
+                'centroid': int(assignment[position]) if position is not None else 0,
+                'fixed': float(fixed_w[position]) if position is not None else 0.0,
+                'decayed': float(decayed_w[position]) if position is not None else 0.0
+            })
+
+        profile = {
+            '_id': ObjectId(user_id),
+            'fixed': encode_embedding(((one_hot * fixed_w[:, None]).T @ vectors).ravel(), 'float32'),
+            'decayed': encode_embedding(((one_hot * decayed_w[:, None]).T @ vectors).ravel(), 'float32'),
+            'fixed_mass': (one_hot.T @ fixed_w).tolist(),
+            'decayed_mass': (one_hot.T @ decayed_w).tolist(),
+            'anchor': now,
+            'count': len(found_ids),
+            'interaction_ids': interaction_ids,
+            'views': views,
+            'interaction_keys': list(dict.fromkeys(
+                f"{types[i]}:{artwork_ids[i]}" for i in range(len(types)) if types[i] != 'view'
+            )),
+            'settings': self.settings,
+            'stale': False,
+            'version': 0,
+            'updated_at': now
+        }
+        self.profiles.replace_one({'_id': profile['_id']}, profile, upsert=True)
+        self.rebuilds += 1
+        return self._to_dict(profile, now)
+
+    def record(self, user_id, artwork_id, interaction, duration_seconds=0):
+        """
+        Add one interaction to a user's profile
+
+        Likes, saves, purchases and cart additions of the same artwork count
+        once per type; every view counts, weighted by its duration, until it
+        falls out of the last view_window views.
+
+        Args:
+            user_id: User id
+            artwork_id: Artwork the user interacted with
+            interaction: One of INTERACTION_TYPES
+            duration_seconds: View duration (views only)
+        """
+        if interaction not in INTERACTION_TYPES:
+            raise ValueError(f"interaction must be one of {INTERACTION_TYPES}")
+        artwork_id = str(artwork_id)
+        key = f"{interaction}:{artwork_id}"
+        vector = self.index.get(artwork_id)
+
+        for _ in range(self.max_retries):
+            profile = self.profiles.find_one({'_id': ObjectId(user_id)})
+            if not self._is_current(profile):
+                # The user document already includes this interaction
+                self.rebuild(user_id)
+                return
+            if interaction != 'view' and key in profile.get('interaction_keys', []):
+                return
+
+            now = datetime.utcnow()
+            if interaction == 'view':
+                update = self._view_update(profile, artwork_id, vector, duration_seconds, now)
+                if update is None:
+                    break
+            else:
+                update = {
+                    '$addToSet': {'interaction_ids': artwork_id, 'interaction_keys': key},
+                    '$inc': {'version': 1},
+                    '$set': {'updated_at': now}
+                }
+                if vector is not None:
+                    update['$set'].update(self._add_vector(profile, vector, interaction, duration_seconds, now))
+                    if artwork_id not in profile['interaction_ids']:
+                        update['$inc']['count'] = 1
+
+            # Compare-and-set on version so concurrent updates are not lost
+            result = self.profiles.update_one(
+                {'_id': profile['_id'], 'version': profile['version']},
+                update
+            )
+            if result.modified_count:
+                return
+
+        self.rebuild(user_id)
+
+    def _view_update(self, profile, artwork_id, vector, duration_seconds, now):
+        """
+        Update adding one view and evicting views beyond view_window
+
+        Returns:
+            Update document, or None if an evicted view's embedding is no
+            longer indexed (the caller rebuilds instead)
+        """
+        fields = self._add_vector(profile, vector, 'view', duration_seconds, now, artwork_id)
+        if fields is None:
+            return None
+
+        # Drop evicted artworks that no longer have any counted interaction
+        referenced = {view['artwork'] for view in fields['views']}
+        referenced.update(key.partition(':')[2] for key in profile.get('interaction_keys', []))
+        interaction_ids = [i for i in profile.get('interaction_ids', []) if i in referenced]
+        if artwork_id not in interaction_ids:
+            interaction_ids.append(artwork_id)
+
+        fields.update({
+            'interaction_ids': interaction_ids,
+            'count': sum(1 for i in interaction_ids if i in self.index),
+            'updated_at': now
+        })
+        return {'$set': fields, '$inc': {'version': 1}}
+
+    def _add_vector(self, profile, vector, interaction, duration_seconds, now, view_artwork=None):
+        """
+        Fields of profile after adding one weighted embedding to its nearest centroid
+
+        For views (view_artwork set) the view is appended to the profile's
+        view window and views beyond view_window are subtracted again;
+        vector may then be None (the view counts but adds no weight).
+        Returns None if an evicted view's embedding is no longer indexed.
+        """
+        dim = self.index.dim
+        fixed = decode_embedding(profile['fixed']).reshape(-1, dim)
+        decayed = decode_embedding(profile['decayed']).reshape(-1, dim)
+        fixed_mass = np.asarray(profile['fixed_mass'], dtype=np.float32)
+        decayed_mass = np.asarray(profile['decayed_mass'], dtype=np.float32)
+        anchor = profile['anchor']
+        views = [dict(view) for view in profile.get('views', [])]
+
+        # Keep the decayed sums bounded by moving the anchor forward
+        factor = self._decay_factor(profile, now)
+        if factor < 2.0 ** -REBASE_HALF_LIVES:
+            decayed *= factor
+            decayed_mass *= factor
+            for view in views:
+                view['decayed'] *= factor
+            anchor = now
+            factor = 1.0
+
+        fields = {}
+        if vector is not None:
+            centroid, fixed_w, decayed_w = self._add_weighted(
+                fixed, decayed, fixed_mass, decayed_mass, factor, anchor,
+                vector, interaction, duration_seconds, now
+            )
+        else:
+            centroid, fixed_w, decayed_w = 0, 0.0, 0.0
+
+        if view_artwork is not None:
+            views.append({'artwork': view_artwork, 'centroid': centroid, 'fixed': fixed_w, 'decayed': decayed_w})
+            for evicted in views[:-self.view_window]:
+                if not (evicted['fixed'] or evicted['decayed']):
+                    continue
+                old = self.index.get(evicted['artwork'])
+                if old is None:
+                    return None
+                c = evicted['centroid']
+                fixed[c] -= evicted['fixed'] * old
+                decayed[c] -= evicted['decayed'] * old
+                fixed_mass[c] = max(fixed_mass[c] - evicted['fixed'], 0.0)
+                decayed_mass[c] = max(decayed_mass[c] - evicted['decayed'], 0.0)
+            fields['views'] = views[-self.view_window:]
+
+        fields.update({
+            'fixed': encode_embedding(fixed.ravel(), 'float32'),
+            'decayed': encode_embedding(decayed.ravel(), 'float32'),
+            'fixed_mass': fixed_mass.tolist(),
+            'decayed_mass': decayed_mass.tolist(),
+            'anchor': anchor
+        })
+        return fields
+
+    def _add_weighted(self, fixed, decayed, fixed_mass, decayed_mass, factor, anchor,
+                      vector, interaction, duration_seconds, now):
+        """
+        Add one weighted embedding to its nearest centroid in place
+
+        Returns:
+            (centroid, fixed weight, decayed weight)
+        """
+        current = fixed + decayed * factor
+        mass = fixed_mass + decayed_mass * factor
+        if len(current) > 1 and mass.any():
+            scores = current @ vector / np.maximum(np.linalg.norm(current, axis=1), 1e-12)
+            scores[mass == 0] = -np.inf
+            centroid = int(np.argmax(scores))
+        else:
+            centroid = 0
+
+        timestamps = [now] if interaction == 'view' else [None]
+        fixed_w, decayed_w = self.interaction_weights([interaction], [duration_seconds], timestamps, anchor)
+        fixed[centroid] += fixed_w[0] * vector
+        decayed[centroid] += decayed_w[0] * vector
+        fixed_mass[centroid] += fixed_w[0]
+        decayed_mass[centroid] += decayed_w[0]
+        return centroid, float(fixed_w[0]), float(decayed_w[0])
+
+    def invalidate(self, user_id):
+        """Mark a profile stale so it is rebuilt on its next read"""
+        self.profiles.update_one(
+            {'_id': ObjectId(user_id)},
+            {'$set': {'stale': True, 'updated_at': datetime.utcnow()}}
+        )
+
+    def _to_dict(self, profile, now=None):
+        dim = self.index.dim
+        factor = self._decay_factor(profile, now or datetime.utcnow())
+        vectors = (decode_embedding(profile['fixed']).reshape(-1, dim)
+                   + decode_embedding(profile['decayed']).reshape(-1, dim) * factor)
+        weights = (np.asarray(profile['fixed_mass'], dtype=np.float32)
+                   + np.asarray(profile['decayed_mass'], dtype=np.float32) * factor)
+        norms = np.linalg.norm(vectors, axis=1)
+        keep = (weights > 0) & (norms > 0)
+        return {
+            'vectors': (vectors[keep] / norms[keep, None]) if keep.any() else None,
+            'weights': weights[keep].tolist(),
+            'interaction_ids': profile.get('interaction_ids', []),
+            'count': profile.get('count', 0)
+        }
+
+    def stats(self):
+        """Profile counters for /health"""
+        return {'hits': self.hits, 'rebuilds': self.rebuilds, 'centroids': self.centroids}
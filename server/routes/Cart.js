@@ -4,6 +4,7 @@ import Cart from '../models/Cart.js';
 import Artwork from '../models/Artwork.js';
 import User from '../models/User.js';
 import { authMiddleware } from '../middleware/AuthMiddleware.js';
+import { trackInteractionHook } from '../middleware/recommendationMiddleware.js';
 
 const router = express.Router();
 
@@ -71,6 +72,7 @@ router.post('/', async (req, res) => {
     await User.findByIdAndUpdate(req.user.id, {
       $addToSet: { cartAdditions: artworkObj }
     }).catch(() => {});
+    trackInteractionHook(req.user.id, artworkId, 'cart');
     const populated = await Cart.findById(cart._id).populate('items');
     const items = (populated.items || []).map((a) => ({
       id: a._id.toString(),
@@ -1,6 +1,7 @@
 import express from 'express'
 import {
     getRecommendations,
+    getRecommendationsBatch,
     searchByText,
     getPersonalizedRecommendations,
     checkRecommendationServiceHealth
@@ -40,6 +41,23 @@ router.get('/similar', async (req, res) => {
     }
 })
 
+/**
+ * Get similar artworks for several artworks at once (e.g. a gallery page)
+ * POST /api/recommendations/similar/batch
+ */
+router.post('/similar/batch', async (req, res) => {
+    try {
+        const { artworkIds, topK } = req.body
+        if (!Array.isArray(artworkIds) || artworkIds.length === 0) {
+            return res.status(400).json({ error: 'artworkIds is required' })
+        }
+        const results = await getRecommendationsBatch(artworkIds, parseInt(topK) || 20)
+        res.json(results || { results: [] })
+    } catch (error) {
+        res.status(500).json({ error: error.message })
+    }
+})
+
 /**
  * Search artworks by text
  * POST /api/recommendations/search
@@ -7,6 +7,7 @@ import mongoose from 'mongoose';
 import dotenv from 'dotenv';
 import User from '../models/User.js';
 import Artwork from '../models/Artwork.js';
+import { rebuildUserProfile } from '../middleware/recommendationMiddleware.js';
 
 dotenv.config();
 
@@ -77,6 +78,8 @@ const sampleInteractions = async () => {
                 viewedArtworks,
                 cartAdditions
             });
+            // History was replaced wholesale, so the cached profile vector is stale
+            await rebuildUserProfile(user._id);
             
             console.log(`${user.username}: likes=${likedArtworks.length}, saved=${savedArtworks.length}, viewed=${viewedArtworks.length}, cart=${cartAdditions.length}`);
         }